@@ -17,9 +17,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import glob
+import hashlib
+import json
 import os
 import re
-from cydc_utils import bytes2str, run_assembler, get_asm_template
+from cydc_cache import hash_files
+from cydc_utils import bytes2str, get_incbin_asm, run_assembler, get_asm_template
+from cydc_tap import TapFile, read_tap
 from pyZX7.compress import compress_data as zx7_compress_data
 
 
@@ -46,9 +51,86 @@ def get_game_id(name=None):
         return f"    DEFB {name}"
 
 
+TOKEN_SCAN_TSTATES = 24  # ld de, (TOKENS_ADDR) / or a
+TOKEN_SCAN_CHAR_TSTATES = 32  # Character of a previous token
+TOKEN_SCAN_END_TSTATES = 40  # Last character of a previous token
+TOKEN_TABLE_TSTATES = 63  # Offset table lookup
+
+
+def get_token_offsets(tokens):
+    """
+    Returns the offset of each token in the token dictionary.
+
+    Args:
+        tokens: Bytes of the tokens, the last character of each one has the bit 7 set
+
+    Returns:
+        List with the offset of the first byte of each token
+    """
+    offsets = []
+    start = 0
+    for i, b in enumerate(tokens):
+        if b >= 128:
+            offsets.append(start)
+            start = i + 1
+    return offsets
+
+
+def get_token_offsets_asm(tokens, token_table=False):
+    """Returns the table with the address of each token, if it is used."""
+    if not token_table:
+        return ""
+    asm = "TOKEN_OFFSETS:\n"
+    for offset in get_token_offsets(tokens):
+        asm += f"    DEFW TOKENS+${offset:X}\n"
+    return asm
+
+
+def get_token_lookup_stats(tokens, texts):
+    """
+    Estimates the cost of finding the tokens used by the texts.
+
+    Without the offset table, PRINT_TOKEN_STR walks the dictionary from the
+    start until it reaches the token; with it, the address is read directly.
+
+    Args:
+        tokens: Bytes of the tokens
+        texts: Encoded texts, as returned by the text compressor
+
+    Returns:
+        Tuple with the size of the table in bytes, the number of characters
+        printed by the texts and the T-states spent finding their tokens
+        without and with the table
+    """
+    offsets = get_token_offsets(tokens)
+    scan_costs = [TOKEN_SCAN_TSTATES + 12]  # jr z, .token_found
+    for n in range(1, len(offsets)):
+        # jr z not taken, ld b, a and the last djnz not taken
+        cost = TOKEN_SCAN_TSTATES + 7 + 4 - 5
+        cost += TOKEN_SCAN_CHAR_TSTATES * (offsets[n] - n) + TOKEN_SCAN_END_TSTATES * n
+        scan_costs.append(cost)
+    lengths = [
+        (offsets[n + 1] if n + 1 < len(offsets) else len(tokens)) - offsets[n]
+        for n in range(len(offsets))
+    ]
+
+    chars = 0
+    scan = 0
+    table = 0
+    for text in texts:
+        for b in text:
+            c = b ^ 0xFF
+            if c < 128 or c - 128 >= len(offsets):
+                chars += 1
+            else:
+                chars += lengths[c - 128]
+                scan += scan_costs[c - 128]
+                table += TOKEN_TABLE_TSTATES
+    return (2 * len(offsets), chars, scan, table)
+
+
 def get_asm_plus3(
     index,
-    size_index,
     tokens,
     chars,
     charw,
@@ -57,8 +139,10 @@ def get_asm_plus3(
     dsk_path="",
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
     name="",
+    bin_path="",
 ):
     if sfx_asm is None:
         sfx_asm = "BEEPFX_AVAILABLE      EQU 0\n"
@@ -70,13 +154,14 @@ def get_asm_plus3(
     d = dict(
         INIT_ADDR="$8000",
         TOKENS=bytes2str(tokens, ""),
+        TOKEN_OFFSETS=get_token_offsets_asm(tokens, token_table),
         CHARS=bytes2str(chars, ""),
         CHARW=bytes2str(charw, ""),
         INDEX=index,
-        SIZE_INDEX=str(size_index),
         SIZE_INDEX_ENTRY=str(5),
         DSK_PATH=dsk_path,
         GAMEID=get_game_id(name),
+        BIN_PATH=bin_path,
     )
 
     t = get_asm_template("inkey")
@@ -126,6 +211,8 @@ def get_asm_plus3(
             asm += "    DEFINE USE_VORTEX\n\n"
 
     asm += get_unused_opcodes_defines(unused_opcodes)
+    if token_table:
+        asm += "    DEFINE USE_TOKEN_TABLE\n\n"
 
     t = get_asm_template("cyd_plus3")
     asm += t.substitute(d)
@@ -135,7 +222,6 @@ def get_asm_plus3(
 
 def get_asm_128(
     index,
-    size_index,
     tokens,
     chars,
     charw,
@@ -144,8 +230,10 @@ def get_asm_128(
     tap_path="",
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
     name="",
+    bin_path="",
 ):
     if sfx_asm is None:
         sfx_asm = "BEEPFX_AVAILABLE      EQU 0\n"
@@ -158,13 +246,14 @@ def get_asm_128(
     d = dict(
         INIT_ADDR="$8000",
         TOKENS=bytes2str(tokens, ""),
+        TOKEN_OFFSETS=get_token_offsets_asm(tokens, token_table),
         CHARS=bytes2str(chars, ""),
         CHARW=bytes2str(charw, ""),
         INDEX=index,
-        SIZE_INDEX=str(size_index),
         SIZE_INDEX_ENTRY=str(5),
         TAP_PATH=tap_path,
         GAMEID=get_game_id(name),
+        BIN_PATH=bin_path,
     )
 
     t = get_asm_template("inkey")
@@ -209,6 +298,8 @@ def get_asm_128(
             asm += "    DEFINE USE_VORTEX\n\n"
 
     asm += get_unused_opcodes_defines(unused_opcodes)
+    if token_table:
+        asm += "    DEFINE USE_TOKEN_TABLE\n\n"
 
     asm = "    DEFINE IS_128_TAPE\n" + asm
 
@@ -220,7 +311,6 @@ def get_asm_128(
 
 def get_asm_mld(
     index,
-    size_index,
     tokens,
     chars,
     charw,
@@ -229,9 +319,11 @@ def get_asm_mld(
     tap_path="",
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
     name="",
     loading_scr=None,
+    bin_path="",
 ):
     if sfx_asm is None:
         sfx_asm = "BEEPFX_AVAILABLE      EQU 0\n"
@@ -248,14 +340,15 @@ def get_asm_mld(
     d = dict(
         INIT_ADDR="$8000",
         TOKENS=bytes2str(tokens, ""),
+        TOKEN_OFFSETS=get_token_offsets_asm(tokens, token_table),
         CHARS=bytes2str(chars, ""),
         CHARW=bytes2str(charw, ""),
         INDEX=index,
-        SIZE_INDEX=str(size_index),
         SIZE_INDEX_ENTRY=str(5),
         TAP_PATH=tap_path,
         GAMEID=get_game_id(name),
         MLD_INTRO_SCR_BYTES=intro_scr_bytes,
+        BIN_PATH=bin_path,
     )
 
     t = get_asm_template("inkey")
@@ -292,6 +385,8 @@ def get_asm_mld(
     t = get_asm_template("vars")
     asm += t.substitute(d)
     asm += get_unused_opcodes_defines(unused_opcodes)
+    if token_table:
+        asm += "    DEFINE USE_TOKEN_TABLE\n\n"
 
     t = get_asm_template("cyd_mld")
     asm += t.substitute(d)
@@ -301,7 +396,6 @@ def get_asm_mld(
 
 def get_asm_mld128(
     index,
-    size_index,
     tokens,
     chars,
     charw,
@@ -310,9 +404,11 @@ def get_asm_mld128(
     tap_path="",
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
     name="",
     loading_scr=None,
+    bin_path="",
 ):
     if sfx_asm is None:
         sfx_asm = "BEEPFX_AVAILABLE      EQU 0\n"
@@ -329,14 +425,15 @@ def get_asm_mld128(
     d = dict(
         INIT_ADDR="$8000",
         TOKENS=bytes2str(tokens, ""),
+        TOKEN_OFFSETS=get_token_offsets_asm(tokens, token_table),
         CHARS=bytes2str(chars, ""),
         CHARW=bytes2str(charw, ""),
         INDEX=index,
-        SIZE_INDEX=str(size_index),
         SIZE_INDEX_ENTRY=str(5),
         TAP_PATH=tap_path,
         GAMEID=get_game_id(name),
         MLD_INTRO_SCR_BYTES=intro_scr_bytes,
+        BIN_PATH=bin_path,
     )
 
     t = get_asm_template("inkey")
@@ -389,6 +486,8 @@ def get_asm_mld128(
             asm += "    DEFINE USE_VORTEX\n\n"
 
     asm += get_unused_opcodes_defines(unused_opcodes)
+    if token_table:
+        asm += "    DEFINE USE_TOKEN_TABLE\n\n"
 
     asm = "    DEFINE IS_128_TAPE\n" + asm
 
@@ -400,7 +499,6 @@ def get_asm_mld128(
 
 def get_asm_48(
     index,
-    size_index,
     tokens,
     chars,
     charw,
@@ -408,7 +506,9 @@ def get_asm_48(
     tap_path="",
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     name="",
+    bin_path="",
 ):
     if sfx_asm is None:
         sfx_asm = "BEEPFX_AVAILABLE      EQU 0\n"
@@ -421,13 +521,14 @@ def get_asm_48(
     d = dict(
         INIT_ADDR="$8000",
         TOKENS=bytes2str(tokens, ""),
+        TOKEN_OFFSETS=get_token_offsets_asm(tokens, token_table),
         CHARS=bytes2str(chars, ""),
         CHARW=bytes2str(charw, ""),
         INDEX=index,
-        SIZE_INDEX=str(size_index),
         SIZE_INDEX_ENTRY=str(5),
         TAP_PATH=tap_path,
         GAMEID=get_game_id(name),
+        BIN_PATH=bin_path,
     )
     t = get_asm_template("inkey")
     includes = t.substitute(d)
@@ -457,6 +558,8 @@ def get_asm_48(
     asm += t.substitute(d)
 
     asm += get_unused_opcodes_defines(unused_opcodes)
+    if token_table:
+        asm += "    DEFINE USE_TOKEN_TABLE\n\n"
 
     t = get_asm_template("cyd_tape")
     asm += t.substitute(d)
@@ -464,10 +567,158 @@ def get_asm_48(
     return asm
 
 
-def get_asm_128_size(
-    sjasmplus_path,
-    output_path,
-    verbose,
+INDEX_ENTRY_SIZE = 5
+INDEX_NUM_TYPES = 4  # TYPE_TXT, TYPE_SCR, TYPE_TRK and TYPE_WYZ
+INDEX_HEADER_SIZE = 4 * INDEX_NUM_TYPES
+GAME_ID_SIZE = 16
+
+
+def get_game_id_bytes(name=None):
+    """Returns the 16 bytes stored at GAME_ID for the given game name."""
+    if name is None:
+        name = ""
+    b = list(name[0:15].encode("latin-1", errors="replace"))
+    return b + [0] * (GAME_ID_SIZE - len(b))
+
+
+def get_index_size(num_entries):
+    """Returns the size in bytes of an index with the given number of entries."""
+    return INDEX_HEADER_SIZE + INDEX_ENTRY_SIZE * num_entries
+
+
+def get_index_bytes(index):
+    """
+    Returns the binary form of the resource index.
+
+    The entries (5 bytes each) are sorted by type and number, after a
+    header with 4 bytes per type: the offset of its first entry from the
+    start of the index (0 if the type has no entries), the number of that
+    entry and the position of the last one. FIND_IN_INDEX goes straight to
+    the position of the number relative to the first one and only steps
+    back over the gaps in the numbering, so consecutive numbers are found
+    without scanning.
+
+    Args:
+        index: List of (type, idx, bank, offset) entries
+
+    Returns:
+        List of bytes
+    """
+    header = [0] * INDEX_HEADER_SIZE
+    b = []
+    first_pos = {}
+    previous = None
+    for pos, entry in enumerate(sorted(index, key=lambda e: (e[0], e[1]))):
+        entry_type, entry_idx, entry_bank, entry_offset = entry
+        if not 0 <= entry_type < INDEX_NUM_TYPES:
+            raise ValueError(f"Invalid index entry type {entry_type}")
+        if (entry_type, entry_idx) == previous:
+            raise ValueError(f"Duplicated index entry {previous}")
+        previous = (entry_type, entry_idx)
+        h = 4 * entry_type
+        if entry_type not in first_pos:
+            first_pos[entry_type] = pos
+            offset = get_index_size(pos)
+            header[h : h + 3] = [offset & 0xFF, (offset >> 8) & 0xFF, entry_idx]
+        header[h + 3] = pos - first_pos[entry_type]
+        b += [entry_type, entry_idx, entry_bank]
+        b += [entry_offset & 0xFF, (entry_offset >> 8) & 0xFF]
+    return header + b
+
+
+def get_index_asm(index):
+    """Returns the source of the resource index, same layout as get_index_bytes()."""
+    header = get_index_bytes(index)[:INDEX_HEADER_SIZE]
+    asm = ""
+    for h in range(0, INDEX_HEADER_SIZE, 4):
+        asm += f"    DEFW ${header[h] + 256 * header[h + 1]:X}\n"
+        asm += f"    DEFB ${header[h + 2]:X}, ${header[h + 3]:X}\n"
+    for v in sorted(index, key=lambda e: (e[0], e[1])):
+        asm += f"    DEFB ${v[0]:X}, ${v[1]:X}, ${v[2]:X}\n"
+        asm += f"    DEFW ${v[3]:X}\n"
+    return asm
+
+
+class InterpreterImage(object):
+    """
+    Interpreter assembled once, without index, ready to be linked.
+
+    The only parts of the interpreter that depend on the packed data are
+    the game ID and the index itself, which goes at the end of the binary,
+    so the final image is obtained by patching and appending bytes.
+    """
+
+    def __init__(self, model, code, symbols):
+        self.model = model
+        self.code = bytes(code)
+        self.symbols = dict(symbols)
+
+    @property
+    def size(self):
+        return self.symbols["SIZE_INTERPRETER"]
+
+    @property
+    def start(self):
+        return self.symbols.get("START_INTERPRETER", 0x8000)
+
+    def link(self, index, name=""):
+        """
+        Returns the final interpreter binary for the given index and name.
+
+        Args:
+            index: List of (type, idx, bank, offset) entries
+            name: Name of the game used as game ID
+
+        Returns:
+            bytearray with the interpreter followed by the index
+        """
+        b = bytearray(self.code)
+        pos = self.symbols["GAME_ID"] - self.start
+        b[pos : pos + GAME_ID_SIZE] = bytes(get_game_id_bytes(name))
+        b += bytes(get_index_bytes(index))
+        return b
+
+
+# Interpreters already assembled in this process
+_interpreter_images = {}
+
+
+# Output path written on the sources used as cache keys, so the same binary
+# is reused from any output directory
+OUTPUT_PATH_KEY = "@OUTPUT_PATH@"
+
+
+def get_asm_digest(asm, sjasmplus_path):
+    """
+    Returns the content hash used to store assembled code in the build cache.
+
+    Besides the generated source, it covers the ASM templates included from
+    it and the assembler executable, so editing any of them, or a compiler
+    version that generates a different source, invalidates the entries.
+
+    Args:
+        asm: Source to assemble, with OUTPUT_PATH_KEY as output path
+        sjasmplus_path: Path of the assembler executable
+
+    Returns:
+        Hex digest
+    """
+    h = hashlib.sha256()
+    h.update(asm.encode("utf-8"))
+    templates = os.path.join(os.path.dirname(__file__), "cyd", "*.asm")
+    hash_files(h, sorted(glob.glob(templates)))
+    asm_path = os.path.abspath(sjasmplus_path)
+    h.update(asm_path.encode("utf-8"))
+    try:
+        st = os.stat(asm_path)
+        h.update(f"{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+    except OSError:
+        pass
+    return h.hexdigest()
+
+
+def get_asm_interpreter(
+    model,
     tokens,
     chars,
     charw,
@@ -475,87 +726,86 @@ def get_asm_128_size(
     has_tracks=False,
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
+    loading_scr=None,
+    bin_path="",
 ):
-    asm = get_asm_128(
-        index="",
-        size_index=0,
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        has_tracks=has_tracks,
-        tap_path="",
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        use_wyz_tracker=use_wyz_tracker,
-        name="",
-    )
-    asm = "    DEFINE SHOW_SIZE_INTERPRETER\n" + asm
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=True,
-    )
-    m = re.search(r"> SIZE_INTERPRETER=\d{1,6} <", res.stderr)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = res.stderr[m.start() : m.end()]
-    m = re.search(r"\d{1,6}", size)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = int(size[m.start() : m.end()])
-    return size
-
-
-def get_asm_48_size(
-    sjasmplus_path,
-    output_path,
-    verbose,
-    tokens,
-    chars,
-    charw,
-    sfx_asm,
-    unused_opcodes=None,
-    pause_start_value=None,
-):
-    asm = get_asm_48(
-        index="",
-        size_index=0,
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        tap_path="",
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        name="",
-    )
-    asm = "    DEFINE SHOW_SIZE_INTERPRETER\n" + asm
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=True,
-    )
-    m = re.search(r"> SIZE_INTERPRETER=\d{1,6} <", res.stderr)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = res.stderr[m.start() : m.end()]
-    m = re.search(r"\d{1,6}", size)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = int(size[m.start() : m.end()])
-    return size
-
-
-def get_asm_plus3_size(
+    """Returns the source to assemble the interpreter alone for the model."""
+    if model == "48k":
+        asm = get_asm_48(
+            index="",
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            bin_path=bin_path,
+        )
+    elif model == "128k":
+        asm = get_asm_128(
+            index="",
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            has_tracks=has_tracks,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            use_wyz_tracker=use_wyz_tracker,
+            bin_path=bin_path,
+        )
+    elif model == "plus3":
+        asm = get_asm_plus3(
+            index="",
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            has_tracks=has_tracks,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            use_wyz_tracker=use_wyz_tracker,
+            bin_path=bin_path,
+        )
+    elif model == "mld" or model == "mld128":
+        asm_builder = get_asm_mld128 if model == "mld128" else get_asm_mld
+        asm = asm_builder(
+            index="",
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            has_tracks=has_tracks,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            use_wyz_tracker=use_wyz_tracker,
+            loading_scr=loading_scr,
+            bin_path=bin_path,
+        )
+    else:
+        raise ValueError(f"Unknown model {model}")
+    return "    DEFINE BUILD_INTERPRETER\n" + asm
+
+
+def get_displayed_symbols(output):
+    """Gets the values printed with DISPLAY "NAME=", /D, value, " <"."""
+    symbols = {}
+    for m in re.finditer(r"> (\w+)=(\d{1,6}) <", output):
+        symbols[m.group(1)] = int(m.group(2))
+    return symbols
+
+
+def build_interpreter(
     sjasmplus_path,
     output_path,
     verbose,
+    model,
     tokens,
     chars,
     charw,
@@ -563,90 +813,266 @@ def get_asm_plus3_size(
     has_tracks=False,
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
+    loading_scr=None,
+    cache=None,
 ):
-    asm = get_asm_plus3(
-        index="",
-        size_index=0,
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
+    """
+    Assembles the interpreter for the model, without index.
+
+    The result only depends on the generated source, so it is assembled once
+    per process for each source and reused afterwards. If a BuildCache is
+    given, the binary and listing are also looked up and stored there.
+
+    Returns:
+        InterpreterImage with the binary and the symbols needed to link it
+    """
+    asm = get_asm_interpreter(
+        model,
+        tokens,
+        chars,
+        charw,
+        sfx_asm,
         has_tracks=has_tracks,
-        dsk_path="",
         unused_opcodes=unused_opcodes,
         pause_start_value=pause_start_value,
+        token_table=token_table,
         use_wyz_tracker=use_wyz_tracker,
-        name="",
+        loading_scr=loading_scr,
+        bin_path=OUTPUT_PATH_KEY + "/__INTERP.BIN",
     )
-    asm = "    DEFINE SHOW_SIZE_INTERPRETER\n" + asm
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=True,
+    digest = get_asm_digest(asm, sjasmplus_path)
+    image = _interpreter_images.get(digest)
+    if image is not None:
+        return image
+
+    if cache is not None:
+        image = _get_cached_interpreter(cache, digest, model, output_path, verbose)
+        if image is not None:
+            _interpreter_images[digest] = image
+            return image
+
+    bin_path = os.path.join(output_path, "__INTERP.BIN").replace(os.sep, "/")
+    asm = asm.replace(OUTPUT_PATH_KEY + "/__INTERP.BIN", bin_path)
+    try:
+        res = run_assembler(
+            asm_path=sjasmplus_path,
+            asm=asm,
+            filename=os.path.join(output_path, "cyd.asm"),
+            listing=verbose,
+            capture_output=True,
+        )
+        with open(bin_path, "rb") as f:
+            code = f.read()
+    finally:
+        if os.path.exists(bin_path):
+            os.remove(bin_path)
+
+    symbols = get_displayed_symbols(res.stderr)
+    for sym in ("SIZE_INTERPRETER", "GAME_ID"):
+        if sym not in symbols:
+            raise ValueError(f"Symbol {sym} not found")
+    symbols["START_INTERPRETER"] = 0x8000
+    if len(code) != symbols["SIZE_INTERPRETER"]:
+        raise ValueError("Size of the interpreter binary does not match")
+
+    image = InterpreterImage(model, code, symbols)
+    _interpreter_images[digest] = image
+    if cache is not None:
+        files = {
+            "interpreter.bin": code,
+            "symbols.json": json.dumps(symbols, sort_keys=True).encode("utf-8"),
+        }
+        lst_path = os.path.join(output_path, "cyd.lst")
+        if verbose and os.path.isfile(lst_path):
+            with open(lst_path, "rb") as f:
+                files["cyd.lst"] = f.read()
+        cache.put(digest, files)
+    return image
+
+
+def _get_cached_interpreter(cache, digest, model, output_path, verbose):
+    files = cache.get(digest)
+    if files is None:
+        return None
+    if verbose and "cyd.lst" not in files:
+        return None  # The listing was requested, so it must be assembled
+    try:
+        code = files["interpreter.bin"]
+        symbols = json.loads(files["symbols.json"].decode("utf-8"))
+    except (KeyError, ValueError):
+        return None
+    if len(code) != symbols.get("SIZE_INTERPRETER"):
+        return None
+    if verbose:
+        with open(os.path.join(output_path, "cyd.lst"), "wb") as f:
+            f.write(files["cyd.lst"])
+    return InterpreterImage(model, code, symbols)
+
+
+def write_interpreter_bin(path, interpreter, index, name):
+    """Writes the linked interpreter so it can be pulled with INCBIN."""
+    with open(path, "wb") as f:
+        f.write(interpreter.link(index, name))
+
+
+def get_asm_linked_interpreter(int_bin_path, save_cmd, device=""):
+    """Returns the source that pulls a linked interpreter binary with INCBIN."""
+    asm = device
+    asm += "    ORG $8000\n"
+    asm += "START_INTERPRETER:\n"
+    asm += f'    INCBIN "{int_bin_path}"\n'
+    asm += "SIZE_INTERPRETER = $ - START_INTERPRETER\n"
+    asm += save_cmd + "\n\n"
+    return asm
+
+
+TAPE_LOADER_TABLE = 5  # Offset of LOAD_TABLE, after the line number, length and REM
+LOADING_SCREEN_ADDR = 16384
+
+# Tape loaders already assembled in this process
+_tape_loaders = {}
+
+
+def get_tape_block_list(entries, is_128=False):
+    """
+    Returns the table of blocks read by the tape loader (LOAD_TABLE).
+
+    Args:
+        entries: List of (address, size, bank) of the blocks after the loader
+        is_128: If the bank of each block is stored
+
+    Returns:
+        List of bytes, ended with a zero address
+    """
+    b = []
+    for address, size, bank in entries:
+        b += [address & 0xFF, (address >> 8) & 0xFF, size & 0xFF, (size >> 8) & 0xFF]
+        if is_128:
+            b.append(bank)
+    return b + [0, 0]
+
+
+def get_tape_loader_asm(tap_path, tap_name, entries, is_128=False):
+    """Returns the source of the BASIC loader of the tape versions."""
+    d = dict(
+        INIT_ADDR="$8000",
+        STACK_ADDRESS="$8000",
+        TAP_NAME=tap_path,
+        TAP_LABEL=tap_name,
+        BLOCK_LIST=bytes2str(get_tape_block_list(entries, is_128)),
+        DEFINE_IS_128="DEFINE IS_128" if is_128 else "",
     )
-    m = re.search(r"> SIZE_INTERPRETER=\d{1,6} <", res.stderr)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = res.stderr[m.start() : m.end()]
-    m = re.search(r"\d{1,6}", size)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = int(size[m.start() : m.end()])
-    return size
-
-
-def get_asm_mld_size(
+    t = get_asm_template("loadertape")
+    return t.substitute(d)
+
+
+def build_tape_loader(
+    sjasmplus_path, output_path, verbose, num_entries, is_128=False, cache=None
+):
+    """
+    Assembles the BASIC loader of the tape versions.
+
+    Its code only depends on the number of blocks to load, so it is assembled
+    once for each source with an empty table of blocks, that
+    get_tape_loader() fills later. If a BuildCache is given, the program is
+    also looked up and stored there.
+
+    Returns:
+        bytes of the BASIC program
+    """
+    tap_key = OUTPUT_PATH_KEY + "/__LOADER.tap"
+    asm = get_tape_loader_asm(tap_key, "loader", [(0, 0, 0)] * num_entries, is_128)
+    digest = get_asm_digest(asm, sjasmplus_path)
+    program = _tape_loaders.get(digest)
+    if program is not None:
+        return program
+
+    if cache is not None:
+        files = cache.get(digest)
+        if files is not None and "loader.bin" in files:
+            _tape_loaders[digest] = files["loader.bin"]
+            return files["loader.bin"]
+
+    tap_path = os.path.join(output_path, "__LOADER.tap").replace(os.sep, "/")
+    asm = asm.replace(tap_key, tap_path)
+    try:
+        run_assembler(
+            asm_path=sjasmplus_path,
+            asm=asm,
+            filename=os.path.join(output_path, "cyd_loader.asm"),
+            listing=verbose,
+            capture_output=False,
+        )
+        with open(tap_path, "rb") as f:
+            blocks = read_tap(f.read())
+    finally:
+        if os.path.exists(tap_path):
+            os.remove(tap_path)
+    if len(blocks) != 2:
+        raise ValueError("Unexpected blocks on the tape loader")
+    program = blocks[1][1]
+
+    _tape_loaders[digest] = program
+    if cache is not None:
+        cache.put(digest, {"loader.bin": program})
+    return program
+
+
+def get_tape_loader(program, entries, is_128=False):
+    """Returns the loader program with its table of blocks filled."""
+    table = get_tape_block_list(entries, is_128)
+    b = bytearray(program)
+    b[TAPE_LOADER_TABLE : TAPE_LOADER_TABLE + len(table)] = bytes(table)
+    return bytes(b)
+
+
+def get_tape_entries(loading_scr, size_interpreter, blocks, banks, bank0_offset):
+    """Returns the (address, size, bank) of the blocks loaded after the loader."""
+    entries = []
+    if loading_scr is not None:
+        entries.append((LOADING_SCREEN_ADDR, len(loading_scr), 0))
+    entries.append((0x8000, size_interpreter, 0))
+    for i, block in enumerate(blocks):
+        offset = bank0_offset if i == 0 else 0xC000
+        entries.append((offset, len(block), banks[i]))
+    return entries
+
+
+def write_tape(
     sjasmplus_path,
     output_path,
     verbose,
-    tokens,
-    chars,
-    charw,
-    sfx_asm,
-    has_tracks=False,
-    unused_opcodes=None,
-    pause_start_value=None,
-    use_wyz_tracker=False,
-    mld_is_128=False,
+    tap_path,
+    tap_name,
+    entries,
+    is_128,
+    loading_scr,
+    interpreter_bin,
+    blocks,
+    cache=None,
 ):
-    asm_builder = get_asm_mld128 if mld_is_128 else get_asm_mld
-    asm = asm_builder(
-        index="",
-        size_index=0,
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        has_tracks=has_tracks,
-        tap_path="",
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        use_wyz_tracker=use_wyz_tracker,
-        name="",
+    """
+    Writes the TAP file of a game whose interpreter is already linked.
+
+    The data blocks are written directly, the assembler is only needed for
+    the loader the first time a number of blocks is used.
+    """
+    program = build_tape_loader(
+        sjasmplus_path, output_path, verbose, len(entries), is_128=is_128, cache=cache
     )
-    asm = "    DEFINE SHOW_SIZE_INTERPRETER\n" + asm
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=True,
-    )
-    m = re.search(r"> SIZE_INTERPRETER=\d{1,6} <", res.stderr)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = res.stderr[m.start() : m.end()]
-    m = re.search(r"\d{1,6}", size)
-    if m is None:
-        raise ValueError("Size pattern not found")
-    size = int(size[m.start() : m.end()])
-    return size
+    tap = TapFile()
+    tap.add_program(tap_name, get_tape_loader(program, entries, is_128), autostart=10)
+    if loading_scr is not None:
+        tap.add_data(loading_scr)
+    tap.add_data(interpreter_bin)
+    for block in blocks:
+        tap.add_data(block)
+    tap.write(tap_path)
 
 
-def do_asm_48(
+def do_asm_tape(
     sjasmplus_path,
     output_path,
     verbose,
@@ -656,66 +1082,47 @@ def do_asm_48(
     banks,
     size_interpreter,
     bank0_offset,
-    tokens,
-    chars,
-    charw,
-    sfx_asm,
+    asm_int,
+    is_128=False,
     loading_scr=None,
-    unused_opcodes=None,
-    pause_start_value=None,
     name="",
+    interpreter=None,
+    cache=None,
 ):
     tap_path = os.path.join(output_path, tap_name + ".tap").replace(os.sep, "/")
-
-    asm_ind = ""
-    for i, v in enumerate(index):
-        asm_ind += f"    DEFB ${v[0]:X}, ${v[1]:X}, ${v[2]:X}\n"
-        asm_ind += f"    DEFW ${v[3]:X}\n"
-
-    asm_int = get_asm_48(
-        index=asm_ind,
-        size_index=len(index),
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        tap_path=tap_path,
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        name=name,
+    entries = get_tape_entries(
+        loading_scr,
+        size_interpreter + get_index_size(len(index)),
+        blocks,
+        banks,
+        bank0_offset,
     )
 
-    block_list = ""
-    if loading_scr is not None:
-        block_list += f"    DEFW LD_SCR_ADDR\n"
-        block_list += f"    DEFW LD_SCR_SIZE\n"
-    block_list += f"    DEFW $8000\n"
-    block_list += f"    DEFW ${(size_interpreter + 5 * len(index)):X}\n"
-    for i, block in enumerate(blocks):
-        bank = banks[i]
-        if i == 0:
-            offset = bank0_offset
-        else:
-            offset = 0xC000
-        block_list += f"    DEFW ${offset:X}\n"
-        block_list += f"    DEFW ${len(block):X}\n"
-    block_list += "    DEFW $0\n"  # End mark
+    if interpreter is not None:
+        write_tape(
+            sjasmplus_path,
+            output_path,
+            verbose,
+            tap_path,
+            tap_name,
+            entries,
+            is_128,
+            loading_scr,
+            interpreter.link(index, name),
+            blocks,
+            cache=cache,
+        )
+        return
 
-    d = dict(
-        INIT_ADDR="$8000",
-        STACK_ADDRESS="$8000",
-        TAP_NAME=tap_path,
-        TAP_LABEL=tap_name,
-        BLOCK_LIST=block_list,
-        DEFINE_IS_128="",
-    )
-    t = get_asm_template("loadertape")
-    asm = t.substitute(d)
+    asm = get_tape_loader_asm(tap_path, tap_name, entries, is_128)
 
+    tmp_files = []
     if loading_scr is not None:
+        scr_bin_path = os.path.join(output_path, "__LOADSCR.BIN").replace(os.sep, "/")
+        tmp_files.append(scr_bin_path)
         asm += "    ORG 16384\n"
         asm += "START_LOADING_SCREEN:\n"
-        asm += bytes2str(loading_scr)
+        asm += get_incbin_asm(scr_bin_path, loading_scr)
         asm += "\nSIZE_LOADING_SCREEN = $ - START_LOADING_SCREEN\n"
         asm += f'    SAVETAP "{tap_path}",HEADLESS,START_LOADING_SCREEN,SIZE_LOADING_SCREEN\n\n'
 
@@ -726,24 +1133,31 @@ def do_asm_48(
             blk_asm = f"    ORG ${bank0_offset:X}\n"
         else:
             blk_asm = "    ORG $C000\n"
+        block_path = os.path.join(output_path, f"__BLOCK_{i}.BIN").replace(os.sep, "/")
+        tmp_files.append(block_path)
         blk_asm += f"START_BLOCK_{i}:\n"
-        blk_asm += bytes2str(block)
-        blk_asm += f"\nSIZE_BLOCK_{i} = $ - START_BLOCK_{i}\n"
+        blk_asm += get_incbin_asm(block_path, block)
+        blk_asm += f"SIZE_BLOCK_{i} = $ - START_BLOCK_{i}\n"
         blk_asm += (
             f'    SAVETAP "{tap_path}",HEADLESS,START_BLOCK_{i},SIZE_BLOCK_{i}\n\n'
         )
         asm += blk_asm
 
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=False,
-    )
+    try:
+        run_assembler(
+            asm_path=sjasmplus_path,
+            asm=asm,
+            filename=os.path.join(output_path, "cyd.asm"),
+            listing=verbose,
+            capture_output=False,
+        )
+    finally:
+        for path in tmp_files:
+            if os.path.exists(path):
+                os.remove(path)
 
 
-def do_asm_128(
+def do_asm_48(
     sjasmplus_path,
     output_path,
     verbose,
@@ -758,93 +1172,104 @@ def do_asm_128(
     charw,
     sfx_asm,
     loading_scr=None,
-    has_tracks=False,
     unused_opcodes=None,
     pause_start_value=None,
-    use_wyz_tracker=False,
+    token_table=False,
     name="",
+    interpreter=None,
+    cache=None,
 ):
-
-    tap_path = os.path.join(output_path, tap_name + ".tap").replace(os.sep, "/")
-
-    asm_ind = ""
-    for i, v in enumerate(index):
-        asm_ind += f"    DEFB ${v[0]:X}, ${v[1]:X}, ${v[2]:X}\n"
-        asm_ind += f"    DEFW ${v[3]:X}\n"
-
-    asm_int = get_asm_128(
-        index=asm_ind,
-        size_index=len(index),
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        has_tracks=has_tracks,
-        tap_path=tap_path,
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        use_wyz_tracker=use_wyz_tracker,
+    asm_int = ""
+    if interpreter is None:
+        tap_path = os.path.join(output_path, tap_name + ".tap").replace(os.sep, "/")
+        asm_int = get_asm_48(
+            index=get_index_asm(index),
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            tap_path=tap_path,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            name=name,
+        )
+    do_asm_tape(
+        sjasmplus_path,
+        output_path,
+        verbose,
+        tap_name,
+        index,
+        blocks,
+        banks,
+        size_interpreter,
+        bank0_offset,
+        asm_int,
+        is_128=False,
+        loading_scr=loading_scr,
         name=name,
+        interpreter=interpreter,
+        cache=cache,
     )
 
-    block_list = ""
-    if loading_scr is not None:
-        block_list += f"    DEFW LD_SCR_ADDR\n"
-        block_list += f"    DEFW LD_SCR_SIZE\n"
-        block_list += f"    DEFB $0\n"
-    block_list += f"    DEFW $8000\n"
-    block_list += f"    DEFW ${(size_interpreter + 5 * len(index)):X}\n"
-    block_list += f"    DEFB $0\n"
-    for i, block in enumerate(blocks):
-        bank = banks[i]
-        if i == 0:
-            offset = bank0_offset
-        else:
-            offset = 0xC000
-        block_list += f"    DEFW ${offset:X}\n"
-        block_list += f"    DEFW ${len(block):X}\n"
-        block_list += f"    DEFB ${bank:X}\n"
-    block_list += "    DEFW $0\n"  # End mark
-
-    d = dict(
-        INIT_ADDR="$8000",
-        STACK_ADDRESS="$8000",
-        TAP_NAME=tap_path,
-        TAP_LABEL=tap_name,
-        BLOCK_LIST=block_list,
-        DEFINE_IS_128="DEFINE IS_128",
-    )
-    t = get_asm_template("loadertape")
-    asm = t.substitute(d)
-
-    if loading_scr is not None:
-        asm += "    ORG 16384\n"
-        asm += "START_LOADING_SCREEN:\n"
-        asm += bytes2str(loading_scr)
-        asm += "\nSIZE_LOADING_SCREEN = $ - START_LOADING_SCREEN\n"
-        asm += f'    SAVETAP "{tap_path}",HEADLESS,START_LOADING_SCREEN,SIZE_LOADING_SCREEN\n\n'
-
-    asm += asm_int
 
-    for i, block in enumerate(blocks):
-        if i == 0:
-            blk_asm = f"    ORG ${bank0_offset:X}\n"
-        else:
-            blk_asm = "    ORG $C000\n"
-        blk_asm += f"START_BLOCK_{i}:\n"
-        blk_asm += bytes2str(block)
-        blk_asm += f"\nSIZE_BLOCK_{i} = $ - START_BLOCK_{i}\n"
-        blk_asm += (
-            f'    SAVETAP "{tap_path}",HEADLESS,START_BLOCK_{i},SIZE_BLOCK_{i}\n\n'
+def do_asm_128(
+    sjasmplus_path,
+    output_path,
+    verbose,
+    tap_name,
+    index,
+    blocks,
+    banks,
+    size_interpreter,
+    bank0_offset,
+    tokens,
+    chars,
+    charw,
+    sfx_asm,
+    loading_scr=None,
+    has_tracks=False,
+    unused_opcodes=None,
+    pause_start_value=None,
+    token_table=False,
+    use_wyz_tracker=False,
+    name="",
+    interpreter=None,
+    cache=None,
+):
+    asm_int = ""
+    if interpreter is None:
+        tap_path = os.path.join(output_path, tap_name + ".tap").replace(os.sep, "/")
+        asm_int = get_asm_128(
+            index=get_index_asm(index),
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            has_tracks=has_tracks,
+            tap_path=tap_path,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            use_wyz_tracker=use_wyz_tracker,
+            name=name,
         )
-        asm += blk_asm
-
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=False,
+    do_asm_tape(
+        sjasmplus_path,
+        output_path,
+        verbose,
+        tap_name,
+        index,
+        blocks,
+        banks,
+        size_interpreter,
+        bank0_offset,
+        asm_int,
+        is_128=True,
+        loading_scr=loading_scr,
+        name=name,
+        interpreter=interpreter,
+        cache=cache,
     )
 
 
@@ -866,49 +1291,43 @@ def do_asm_plus3(
     has_tracks=False,
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
     name="",
+    interpreter=None,
 ):
 
     dsk_path = os.path.join(output_path, dsk_name + ".BIN").replace(os.sep, "/")
 
-    asm_ind = ""
-    for i, v in enumerate(index):
-        asm_ind += f"    DEFB ${v[0]:X}, ${v[1]:X}, ${v[2]:X}\n"
-        asm_ind += f"    DEFW ${v[3]:X}\n"
+    asm_ind = get_index_asm(index)
 
-    blk_asm = ""
-    for i, block in enumerate(blocks):
-        bank = banks[i]
-        block_path = os.path.join(output_path, f"__BLOCK_{i}.BIN").replace(os.sep, "/")
-        blk_asm += f"    PAGE {bank}\n"
-        if i == 0:
-            blk_asm += f"    ORG ${bank0_offset:X}\n"
-        else:
-            blk_asm += "    ORG $C000\n"
-        blk_asm += f"START_BLOCK_{i}:\n"
-        blk_asm += bytes2str(block)
-        blk_asm += f"\nSIZE_BLOCK_{i} = $ - START_BLOCK_{i}\n"
-        blk_asm += f'    SAVEBIN "{block_path}",START_BLOCK_{i},SIZE_BLOCK_{i}\n\n'
-
-    asm_int = get_asm_plus3(
-        index=asm_ind,
-        size_index=len(index),
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        has_tracks=has_tracks,
-        dsk_path=dsk_path,
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        use_wyz_tracker=use_wyz_tracker,
-        name=name,
-    )
+    int_bin_path = os.path.join(output_path, "__INTERP.BIN").replace(os.sep, "/")
+    if interpreter is None:
+        asm_int = get_asm_plus3(
+            index=asm_ind,
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            has_tracks=has_tracks,
+            dsk_path=dsk_path,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            use_wyz_tracker=use_wyz_tracker,
+            name=name,
+        )
+    else:
+        write_interpreter_bin(int_bin_path, interpreter, index, name)
+        asm_int = get_asm_linked_interpreter(
+            int_bin_path,
+            f'    SAVEBIN "{dsk_path}", START_INTERPRETER, SIZE_INTERPRETER',
+            device="    DEVICE ZXSPECTRUM128\n    SLOT 3\n    PAGE 0\n\n",
+        )
 
     block_list = ""
     block_list += f"    DEFW $8000\n"
-    block_list += f"    DEFW ${(size_interpreter + 5 * len(index)):X}\n"
+    block_list += f"    DEFW ${(size_interpreter + get_index_size(len(index))):X}\n"
     block_list += f"    DEFB $0\n"
     for i, block in enumerate(blocks):
         bank = banks[i]
@@ -921,11 +1340,14 @@ def do_asm_plus3(
         block_list += f"    DEFB ${bank:X}\n"
     block_list += "    DEFW $0\n"  # End mark
 
+    tmp_files = [int_bin_path]
     loading_scr_def = ""
     if loading_scr is None:
         loading_scr = ""
     else:
-        loading_scr = bytes2str(loading_scr, "")
+        scr_bin_path = os.path.join(output_path, "__LOADSCR.BIN").replace(os.sep, "/")
+        tmp_files.append(scr_bin_path)
+        loading_scr = get_incbin_asm(scr_bin_path, loading_scr)
         loading_scr_def = "DEFINE LOADING_SCREEN"
 
     d = dict(
@@ -941,25 +1363,26 @@ def do_asm_plus3(
 
     t = get_asm_template("loaderplus3")
     asm = t.substitute(d)
-    asm += asm_int + blk_asm
+    asm += asm_int
 
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=False,
-    )
+    try:
+        res = run_assembler(
+            asm_path=sjasmplus_path,
+            asm=asm,
+            filename=os.path.join(output_path, "cyd.asm"),
+            listing=verbose,
+            capture_output=False,
+        )
+    finally:
+        for path in tmp_files:
+            if os.path.exists(path):
+                os.remove(path)
 
     if res:
-        for i, block in enumerate(blocks):
-            block_path = os.path.join(output_path, f"__BLOCK_{i}.BIN").replace(
-                os.sep, "/"
-            )
-            with open(dsk_path, "ab") as file_dsk, open(block_path, "rb") as file_block:
-                file_dsk.write(file_block.read())
-            if os.path.exists(block_path):
-                os.remove(block_path)
+        # The blocks are loaded as they are after the interpreter, no need to assemble them
+        with open(dsk_path, "ab") as file_dsk:
+            for block in blocks:
+                file_dsk.write(bytes(block))
 
 
 def do_asm_mld(
@@ -980,10 +1403,12 @@ def do_asm_mld(
     has_tracks=False,
     unused_opcodes=None,
     pause_start_value=None,
+    token_table=False,
     use_wyz_tracker=False,
     mld_type="$83",
     mld_is_128=False,
     name="",
+    interpreter=None,
 ):
     # Each aggregated code/data block is placed in one dedicated Dandanator slot.
     # Slot layout: 0=loader/footer, 1=interpreter, 2..N=aggregated blocks.
@@ -1003,48 +1428,49 @@ def do_asm_mld(
             mapped_bank = slot_by_ram_bank.get(entry_bank, entry_bank)
         remapped_index.append((entry_type, entry_idx, mapped_bank, entry_offset))
 
-    asm_ind = ""
-    for _, v in enumerate(remapped_index):
-        asm_ind += f"    DEFB ${v[0]:X}, ${v[1]:X}, ${v[2]:X}\n"
-        asm_ind += f"    DEFW ${v[3]:X}\n"
-
-    dummy_tap = os.path.join(output_path, "__mld_dummy.tap").replace(os.sep, "/")
-    asm_builder = get_asm_mld128 if mld_is_128 else get_asm_mld
-    asm_int = asm_builder(
-        index=asm_ind,
-        size_index=len(index),
-        tokens=tokens,
-        chars=chars,
-        charw=charw,
-        sfx_asm=sfx_asm,
-        has_tracks=has_tracks,
-        tap_path=dummy_tap,
-        unused_opcodes=unused_opcodes,
-        pause_start_value=pause_start_value,
-        use_wyz_tracker=use_wyz_tracker,
-        name=name,
-        loading_scr=loading_scr,
-    )
+    asm_ind = get_index_asm(remapped_index)
+
+    if interpreter is None:
+        dummy_tap = os.path.join(output_path, "__mld_dummy.tap").replace(os.sep, "/")
+        asm_builder = get_asm_mld128 if mld_is_128 else get_asm_mld
+        asm_int = asm_builder(
+            index=asm_ind,
+            tokens=tokens,
+            chars=chars,
+            charw=charw,
+            sfx_asm=sfx_asm,
+            has_tracks=has_tracks,
+            tap_path=dummy_tap,
+            unused_opcodes=unused_opcodes,
+            pause_start_value=pause_start_value,
+            token_table=token_table,
+            use_wyz_tracker=use_wyz_tracker,
+            name=name,
+            loading_scr=loading_scr,
+        )
 
-    int_bin_path = os.path.join(output_path, "__INTERP.BIN").replace(os.sep, "/")
-    asm_int += (
-        f'\n    SAVEBIN "{int_bin_path}", START_INTERPRETER, SIZE_INTERPRETER\n'
-    )
+        int_bin_path = os.path.join(output_path, "__INTERP.BIN").replace(os.sep, "/")
+        asm_int += (
+            f'\n    SAVEBIN "{int_bin_path}", START_INTERPRETER, SIZE_INTERPRETER\n'
+        )
 
-    run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm_int,
-        filename=os.path.join(output_path, "cyd.asm"),
-        listing=verbose,
-        capture_output=False,
-    )
+        run_assembler(
+            asm_path=sjasmplus_path,
+            asm=asm_int,
+            filename=os.path.join(output_path, "cyd.asm"),
+            listing=verbose,
+            capture_output=False,
+        )
 
-    with open(int_bin_path, "rb") as f:
-        int_bytes = list(f.read())
-    if os.path.exists(int_bin_path):
-        os.remove(int_bin_path)
-    if os.path.exists(dummy_tap):
-        os.remove(dummy_tap)
+        with open(int_bin_path, "rb") as f:
+            int_bytes = list(f.read())
+        if os.path.exists(int_bin_path):
+            os.remove(int_bin_path)
+        if os.path.exists(dummy_tap):
+            os.remove(dummy_tap)
+    else:
+        # The interpreter was already assembled, only the index is linked
+        int_bytes = list(interpreter.link(remapped_index, name))
 
     slots = {1: list(int_bytes)}
     for i, block in enumerate(blocks):
@@ -436,24 +436,51 @@ LOAD_CHUNK:
 ;Uses: AF, AF', IX, DE, HL, BC
 FIND_IN_INDEX:
     push ix
-    ld hl, @SIZE_INDEX
-    ld ix, INDEX
-    ld de, @SIZE_INDEX_ENTRY
-.loop:
-    ld a, l
-    or h
-    jr z, .end_loop
-    ld a, (ix+0)
-    cp b
-    jr nz, .next
+    ld a, b
+    cp TYPE_WYZ + 1
+    jr nc, .not_found
+    add a, a
+    add a, a                  ; 4 bytes per type on the header of the index
+    ld l, a
+    ld h, 0
+    ld de, INDEX
+    add hl, de
+    ld e, (hl)
+    inc hl
+    ld d, (hl)                ; DE = offset of the first entry of the type
+    ld a, d
+    or e
+    jr z, .not_found          ; No entries of this type
+    inc hl
+    ld a, c
+    sub (hl)                  ; A = Position if there are no gaps
+    jr c, .not_found
+    inc hl
+    cp (hl)
+    jr c, .in_range
+    ld a, (hl)                ; Position of the last entry of the type
+.in_range:
+    ld l, a
+    ld h, 0
+    add hl, hl
+    add hl, hl
+    add hl, de
+    ld e, a
+    ld d, 0
+    add hl, de                ; HL = Offset of the first entry + 5 * position
+    ld de, INDEX
+    add hl, de
+    push hl
+    pop ix
+    ld de, -@SIZE_INDEX_ENTRY
+.loop:                        ; Entries are sorted, step back over the gaps
     ld a, (ix+1)
     cp c
     jr z, .found
-.next:
+    jr c, .not_found
     add ix, de
-    dec hl
     jr .loop
-.end_loop:
+.not_found:
     ld a, 1
     jp SYS_ERROR
 .found:
@@ -524,6 +551,7 @@ CHARSET_WIDTHS_ADDR DW CHARSET_W
 
 TOKENS:
 @{TOKENS}
+@{TOKEN_OFFSETS}
 
 CHARSET_S:
 @{CHARS}
@@ -531,13 +559,15 @@ CHARSET_S:
 CHARSET_W:
 @{CHARW}
 
-    IFDEF SHOW_SIZE_INTERPRETER
+    IFDEF BUILD_INTERPRETER
 INDEX:
 SIZE_INTERPRETER = $ - START_INTERPRETER
     DISPLAY "SIZE_INTERPRETER=", /D, SIZE_INTERPRETER, " <"
+    DISPLAY "GAME_ID=", /D, GAME_ID, " <"
+    SAVEBIN "@BIN_PATH", START_INTERPRETER, SIZE_INTERPRETER
     ENDIF
 
-    IFNDEF SHOW_SIZE_INTERPRETER
+    IFNDEF BUILD_INTERPRETER
 INDEX:
 @{INDEX}
 
@@ -889,6 +889,16 @@ PRINT_TOKEN_STR:
     push de
 ;----------------------------------------------------------
     ; Get token
+    IFDEF USE_TOKEN_TABLE
+    ld l, a
+    ld h, 0
+    add hl, hl
+    ld de, TOKEN_OFFSETS       ; 2 bytes per token with its address
+    add hl, de
+    ld e, (hl)
+    inc hl
+    ld d, (hl)
+    ELSE
     ld de, (TOKENS_ADDR)
     or a
     jr z, .token_found
@@ -899,6 +909,7 @@ PRINT_TOKEN_STR:
     cp 128
     jr c, .loop1               ; A < 128 don't decrement b
     djnz .loop1                ; Decrease B IF A > 127
+    ENDIF
 .token_found:
     ld hl, TOKEN_BUFFER        ;HL = ptr to token buffer
     push hl
@@ -20,14 +20,26 @@
 from __future__ import print_function
 from operator import itemgetter, attrgetter
 
-import sys, os, argparse, json, re, copy, math, gettext
-
-from cydc_txt_compress import CydcTextCompressor, NUM_TOKENS
+import sys, os, argparse, json, re, copy, math, gettext, functools
+import io, contextlib, shutil, tempfile, time, tracemalloc, pstats
+
+from cydc_txt_compress import (
+    CydcTextCompressor,
+    NUM_TOKENS,
+    TOKEN_ENGINES,
+    TOKENS_META_VERSION,
+    get_tokens_meta_path,
+    get_texts_drift,
+    get_texts_fingerprint,
+)
 from cydc_parser import CydcParser
-from cydc_codegen import CydcCodegen
+from cydc_codegen import CydcCodegen, CodegenError
 from cydc_font import CydcFont
 from cydc_music import compress_track_data, create_wyz_player_bank, add_size_header
 from cydc_preprocessor import CydcPreprocessor, PreprocessorError
+from cydc_cache import BuildCache, get_cache_dir, wait_for_changes, write_deps_file
+from cydc_packing import pack_blocks, pack_blocks_best_fit
+from cydc_stages import StageScheduler
 
 from cyd import *
 from cydc_utils import *
@@ -40,6 +52,72 @@ try:
 except ImportError:
     abarAvailable = False
 
+try:
+    import resource
+
+    resourceAvailable = True
+except ImportError:
+    resourceAvailable = False
+
+# Texts compressed in this process, by texts and parameters. A compile
+# server reuses them on the builds where only the code changes.
+_compressed_texts = {}
+MAX_COMPRESSED_TEXTS = 4
+
+# Format of the files written by --profile-json
+PROFILE_VERSION = 1
+
+VERSION = "1.0.6"
+PROGRAM = "Choose Your Destiny Compiler " + VERSION
+EXEC = "cydc"
+
+
+class CompileError(Exception):
+    """
+    Error that stops a compilation.
+
+    Args:
+        message: Description of the error
+        diagnostics: Errors found on the source, as a list of (stage, message)
+    """
+
+    def __init__(self, message, diagnostics=None):
+        super().__init__(message)
+        self.message = message
+        self.diagnostics = list(diagnostics) if diagnostics else []
+        self.log = ""
+
+
+class BuildResult(object):
+    """
+    Products of a compilation.
+
+    Attributes:
+        target: Name of the main file produced (TAP, DSK or MLD)
+        files: Dict with the contents of the files produced, by name
+        memory_map: List of (bank, bytes used, bytes free) of the banks with data
+        index: List of (type, index, bank, address) of the resources
+        interpreter_size: Size of the interpreter in bytes
+        dependencies: Files read by the compilation
+        log: Messages written by the compiler
+    """
+
+    def __init__(
+        self, target, files, memory_map, index, interpreter_size, dependencies, log=""
+    ):
+        self.target = target
+        self.files = files
+        self.memory_map = memory_map
+        self.index = index
+        self.interpreter_size = interpreter_size
+        self.dependencies = dependencies
+        self.log = log
+
+    @property
+    def data(self):
+        """Contents of the main file."""
+        return self.files[self.target]
+
 
 def dir_path(string):
     """_summary_
@@ -96,26 +174,120 @@ def emit_error(stage, message):
     print(f"ERROR [{stage}]: {message}")
 
 
-def main():
-    """Main function"""
+def load_tokens_meta(tokens_file):
+    """
+    Loads the tokens of a previous compilation and the metadata needed to update them.
 
-    if sys.version_info[0] < 3:  # Python 2
-        sys.exit(_("ERROR: Invalid python version"))
+    Args:
+        tokens_file: Tokens file written with --update-tokens-file
+
+    Returns:
+        Dictionary with the metadata and the tokens, or None if missing or not valid
+    """
+    try:
+        with open(tokens_file, "r", encoding="utf-8") as fti:
+            tokens = json.load(fti)
+        with open(get_tokens_meta_path(tokens_file), "r", encoding="utf-8") as fmi:
+            meta = json.load(fmi)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict) or meta.get("version") != TOKENS_META_VERSION:
+        return None
+    if not isinstance(tokens, list) or len(tokens) > NUM_TOKENS:
+        return None
+    if not all(isinstance(t, str) and t for t in tokens):
+        return None
+    if not isinstance(meta.get("savings"), list) or len(meta["savings"]) != len(tokens):
+        return None
+    if not isinstance(meta.get("texts"), list) or not isinstance(meta.get("max_len_token"), int):
+        return None
+    meta["tokens"] = tokens
+    return meta
+
+
+def save_tokens_meta(tokens_file, tokens, meta):
+    """
+    Writes the tokens and the metadata needed to update them on the next compilation.
 
-    version = "1.0.6"
-    program = "Choose Your Destiny Compiler " + version
-    exec = "cydc"
+    Args:
+        tokens_file: Tokens file
+        tokens: Tokens used
+        meta: Dictionary with the metadata
+    """
+    meta = dict(meta, version=TOKENS_META_VERSION)
+    with open(tokens_file, "w", encoding="utf-8") as fto:
+        fto.write(json.dumps(tokens))
+    with open(get_tokens_meta_path(tokens_file), "w", encoding="utf-8") as fmo:
+        fmo.write(json.dumps(meta))
 
+
+def init_gettext():
     gettext.bindtextdomain(
-        exec, os.path.join(os.path.abspath(os.path.dirname(__file__)), "locale")
+        EXEC, os.path.join(os.path.abspath(os.path.dirname(__file__)), "locale")
     )
-    gettext.textdomain(exec)
-    _ = gettext.gettext
+    gettext.textdomain(EXEC)
 
-    timer = Timer()
-    tmp_timer = Timer()
 
-    arg_parser = argparse.ArgumentParser(sys.argv[0], description=program)
+def write_profile(path, args, scheduler, external_calls, wall, cpu, peak_memory):
+    """
+    Writes the measures of a profiled build as JSON.
+
+    Args:
+        path: Destination file
+        args: Options of the build
+        scheduler: StageScheduler after running with profile=True
+        external_calls: Calls to external programs, from record_external_calls()
+        wall: Seconds spent running the stages
+        cpu: CPU seconds of this process running the stages
+        peak_memory: Peak of memory traced by tracemalloc, None if not traced
+    """
+    max_rss = None
+    if resourceAvailable:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            max_rss *= 1024  # Kilobytes, except on macOS
+    stages = []
+    for stage in scheduler.stages:
+        if stage.name not in scheduler.times:
+            continue
+        (begin, end) = scheduler.times[stage.name]
+        # The stages run one at a time, so a call belongs to the running one
+        calls = [
+            dict(program=c["program"], file=c["file"], wall=c["wall"], cpu=c["cpu"])
+            for c in external_calls
+            if begin <= c["start"] - scheduler.start <= end
+        ]
+        entry = dict(name=stage.name, process=stage.process, start=begin, wall=end - begin)
+        entry.update(scheduler.stats.get(stage.name, {}))
+        entry["external"] = calls
+        stages.append(entry)
+    (critical_path, critical_time) = scheduler.get_critical_path()
+    profile = dict(
+        version=PROFILE_VERSION,
+        compiler=VERSION,
+        model=args.model,
+        input=os.path.abspath(args.input),
+        wall=wall,
+        cpu=cpu,
+        peak_memory=peak_memory,
+        max_rss=max_rss,
+        critical_path=critical_path,
+        stages=stages,
+        external=dict(
+            calls=len(external_calls),
+            wall=sum(c["wall"] for c in external_calls),
+            cpu=None if os.name == "nt" else sum(c["cpu"] for c in external_calls),
+        ),
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def get_arg_parser():
+    """Returns the parser of the command line arguments."""
+    _ = gettext.gettext
+
+    arg_parser = argparse.ArgumentParser(sys.argv[0], description=PROGRAM)
 
     arg_parser.add_argument(
         "-l",
@@ -141,6 +313,20 @@ def main():
         help=_("limit for the superset search heuristic (default: %(default)d)"),
         default=100,
     )
+    arg_parser.add_argument(
+        "--token-engine",
+        choices=TOKEN_ENGINES,
+        default=TOKEN_ENGINES[0],
+        help=_("algorithm used to search the abbreviations, all give the same result (default: %(default)s)"),
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar=_("JOBS"),
+        type=int,
+        default=1,
+        help=_("number of processes searching abbreviations and compressing images in parallel, 0 to use all the CPUs (default: %(default)d)"),
+    )
     # token_group = arg_parser.add_mutually_exclusive_group()
     arg_parser.add_argument(
         "-T",
@@ -154,6 +340,19 @@ def main():
         metavar=_("IMPORT-TOKENS-FILE"),
         help=_("file with the tokens to use"),
     )
+    arg_parser.add_argument(
+        "-U",
+        "--update-tokens-file",
+        metavar=_("UPDATE-TOKENS-FILE"),
+        help=_("file with the tokens to reuse while the texts change little, updated after compressing"),
+    )
+    arg_parser.add_argument(
+        "--tokens-drift",
+        metavar=_("PERCENT"),
+        type=float,
+        default=10.0,
+        help=_("percentage of changed text above which the tokens are searched again (default: %(default)g)"),
+    )
     ###
     arg_parser.add_argument(
         "-C",
@@ -242,12 +441,50 @@ def main():
         action="store_true",
         help=_("exclude code of unused commands"),
     )
+    arg_parser.add_argument(
+        "--token-table",
+        action="store_true",
+        help=_("add a table with the address of each token to print them faster"),
+    )
     arg_parser.add_argument(
         "-code",
         "--show-bytecode",
         action="store_true",
         help=_("show the generated bytecode"),
     )
+    arg_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help=_("don't use nor update the build cache"),
+    )
+    arg_parser.add_argument(
+        "--deps-file",
+        metavar=_("DEPS_FILE"),
+        help=_("file to write the files used by the build, as a Make rule or as JSON if the name ends in .json"),
+    )
+    arg_parser.add_argument(
+        "--profile-json",
+        metavar=_("PROFILE_FILE"),
+        help=_("write the time, memory and data sizes of each stage of the build as JSON (the stages run one at a time)"),
+    )
+    arg_parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        default=False,
+        help=_("with --profile-json, also measure the memory peak of each stage with tracemalloc (the build gets much slower)"),
+    )
+    arg_parser.add_argument(
+        "--cprofile",
+        metavar=_("PSTATS_FILE"),
+        help=_("write the cProfile statistics of the stages run on this process, to read with pstats"),
+    )
+    arg_parser.add_argument(
+        "--watch",
+        action="store_true",
+        default=False,
+        help=_("compile again each time a file of the adventure changes, until Ctrl+C is pressed"),
+    )
     arg_parser.add_argument(
         "--no-strict-colons",
         action="store_true",
@@ -273,7 +510,7 @@ def main():
         "-V",
         "--version",
         action="version",
-        version=program,
+        version=PROGRAM,
         help=_("show program's version number and exit"),
     )
     #####################################################
@@ -312,76 +549,62 @@ def main():
         help=_("Output path to files"),
     )
 
-    try:
-        args = arg_parser.parse_args()
-    except FileNotFoundError as f1:
-        sys.exit(_("ERROR: File not found:") + f"{f1}")
-    except NotADirectoryError as f2:
-        sys.exit(_("ERROR: Not a valid path:") + f"{f2}")
+    return arg_parser
+
+
+def build(args, command=None):
+    """
+    Compiles an adventure.
+
+    Args:
+        args: Options, as returned by the parser of get_arg_parser()
+        command: Arguments of the compiler, stored on the dependencies file
+
+    Returns:
+        BuildResult
+
+    Raises:
+        CompileError: If the adventure can't be compiled
+    """
+    _ = gettext.gettext
+
+    timer = Timer()
+    tmp_timer = Timer()
 
     verbose = 3 if args.verbose > 3 else args.verbose
     model = args.model
     output_name = args.name
 
     if model != "plus3" and args.disk_720:
-        sys.exit(_("ERROR: Invalid parameter this model."))
+        raise CompileError(_("ERROR: Invalid parameter this model."))
 
     if not os.path.isfile(args.input):
-        sys.exit(_("ERROR: Path to input file does not exist."))
-
-    # Preprocess the input file to handle #include directives
-    if verbose > 0:
-        print(_("Preprocessing includes..."))
-    tmp_timer.reset()
-    
-    try:
-        preprocessor = CydcPreprocessor(
-            max_depth=20, 
-            base_path=os.path.dirname(os.path.abspath(args.input)),
-            max_errors=args.max_errors,
-        )
-        text, line_map = preprocessor.preprocess(args.input)
-        
-        if verbose >= 1:
-            included_count = len(preprocessor.included_files) - 1  # -1 for main file
-            if included_count > 0:
-                print(_(f"Preprocessed {included_count} include file(s) in {tmp_timer}"))
-            else:
-                print(_(f"Preprocessing completed in {tmp_timer}"))
-    except PreprocessorError as e:
-        if len(preprocessor.errors) > 0:
-            for prep_error in preprocessor.errors:
-                emit_error("PREPROCESSOR", str(prep_error))
-            if preprocessor.max_errors_reached:
-                emit_error("COMPILER", _(f"Maximum error limit reached ({args.max_errors})."))
-        else:
-            emit_error("PREPROCESSOR", str(e))
-        sys.exit(1)
+        raise CompileError(_("ERROR: Path to input file does not exist."))
 
     if output_name is None:
         output_name = os.path.splitext(os.path.basename(args.input))
         output_name = output_name[0]
 
-    if verbose >= 1:
-        print(_(f"Parameters parsed in {tmp_timer}"))
-
     ######################################################################
 
-    tokens = None
+    if args.import_tokens_file is not None and args.update_tokens_file is not None:
+        raise CompileError(_("ERROR: Tokens can't be imported and updated at the same time."))
+
+    imported_tokens = None
     if args.import_tokens_file is not None:
         tmp_timer.reset()
         input_token_file = args.import_tokens_file
         if not os.path.isfile(input_token_file):
-            sys.exit(_("Path to token file does not exist."))
+            raise CompileError(_("Path to token file does not exist."))
         with open(input_token_file, "r", encoding="utf-8") as fti:
             try:
                 jsonToken = json.load(fti)
             except json.JSONDecodeError:
-                sys.exit(_("ERROR: The token import file has not a valid format."))
+                raise CompileError(_("ERROR: The token import file has not a valid format."))
             if not isinstance(jsonToken, list):
-                sys.exit(_("ERROR: The token import file has not a valid format."))
+                raise CompileError(_("ERROR: The token import file has not a valid format."))
             if len(jsonToken) > NUM_TOKENS:
-                sys.exit(
+                raise CompileError(
                     _(
                         "ERROR: Number of tokens must be equal o less to %(NUM_TOKENS)d."
                         % {"NUM_TOKENS": NUM_TOKENS}
@@ -389,8 +612,8 @@ def main():
                 )
             for t in jsonToken:
                 if not isinstance(t, str):
-                    sys.exit(_("ERROR: The token import file has not a valid format."))
-            tokens = jsonToken
+                    raise CompileError(_("ERROR: The token import file has not a valid format."))
+            imported_tokens = jsonToken
         if verbose >= 1:
             print(_(f"Tokens imported in {tmp_timer}"))
 
@@ -402,55 +625,55 @@ def main():
         input_charset_file = args.import_charset
         jsonCharset = None
         if not os.path.isfile(input_charset_file):
-            sys.exit(_("Path to charset file does not exist."))
+            raise CompileError(_("Path to charset file does not exist."))
         with open(input_charset_file, "r", encoding="utf-8") as fci:
             try:
                 jsonCharset = json.load(fci)
             except json.JSONDecodeError:
-                sys.exit(_("ERROR: The charset import file has not a valid format."))
+                raise CompileError(_("ERROR: The charset import file has not a valid format."))
             if not isinstance(jsonCharset, list):
-                sys.exit(_("ERROR: The charset import file has not a valid format."))
+                raise CompileError(_("ERROR: The charset import file has not a valid format."))
             if len(jsonCharset) > 256:
-                sys.exit(_("ERROR: Too many characters!"))
+                raise CompileError(_("ERROR: Too many characters!"))
             for c in jsonCharset:
                 if not isinstance(c, dict):
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
                 if set(c.keys()) != set(["Character", "Width", "Id"]):
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
                 pxl = c["Character"]
                 if len(pxl) != 8:
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
                 for l in pxl:
                     if not isinstance(l, int):
-                        sys.exit(
+                        raise CompileError(
                             _("ERROR: The charset import file has not a valid format.")
                         )
                     if l < 0 or l > 255:
-                        sys.exit(
+                        raise CompileError(
                             _("ERROR: The charset import file has not a valid format.")
                         )
                 w = c["Width"]
                 if not isinstance(w, int):
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
                 if w < 1 or w > 8:
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
                 i = c["Id"]
                 if not isinstance(w, int):
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
                 if w < 0 or w > 255:
-                    sys.exit(
+                    raise CompileError(
                         _("ERROR: The charset import file has not a valid format.")
                     )
         font.loadCharset(jsonCharset)
@@ -459,103 +682,61 @@ def main():
 
     ######################################################################
 
-    if verbose > 0:
-        print(_("Parsing code..."))
+    # Exporting current font
+    if args.export_charset is not None:
+        output_charset_file = args.export_charset
+        with open(output_charset_file, "w", encoding="utf-8") as fco:
+            fco.write(font.getJson())
 
-    tmp_timer.reset()
-    parser = CydcParser(
-        gettext,
-        strict_colon_mode=not args.no_strict_colons,
-        max_errors=args.max_errors,
-    )
-    parser.set_line_map(line_map)  # Set line map for better error reporting
-    parser.build()
-    code = parser.parse(input=text, verbose=(verbose >= 3))
-    if verbose >= 2:
-        print(_("Symbols:"))
-        parser.print_symbols()
-    if len(parser.errors) > 0:
-        for e in parser.errors:
-            emit_error("PARSER", e)
-        if parser.max_errors_reached:
-            emit_error("COMPILER", _(f"Maximum error limit reached ({args.max_errors})."))
-        sys.exit(1)
-    print(_(f"Code parsing completed ({tmp_timer})"))
+    l_chars = font.font_chars
+    l_charw = font.font_sizes
 
     ######################################################################
 
-    if verbose > 0:
-        print(_("Compressing texts..."))
-    tmp_timer.reset()
-
-    # Recollecting strings for tokenization
-    strings = []
-    positions = []
-    for pos, value in enumerate(code):
-        opcode = value[0]
-        if opcode == "TEXT":
-            text = value[1]
-            strings.append(text)
-            positions.append(pos)
-
     if args.min_length > args.max_length:
-        sys.exit(_("ERROR: min-length can't be greather than max-length."))
+        raise CompileError(_("ERROR: min-length can't be greather than max-length."))
 
-    txtComp = CydcTextCompressor(gettext, args.superset_limit, verbose=(verbose >= 1))
-    (textBytes, tokenBytes, tokens) = txtComp.compress(
-        strings, args.min_length, args.max_length, tokens
-    )
-
-    # Exporting tokens
-    if args.export_tokens_file is not None:
-        output_token_file = args.export_tokens_file
-        with open(output_token_file, "w", encoding="utf-8") as fto:
-            fto.write(json.dumps(tokens))
-
-    # Set text to compressed bytes format
-    force_slice_texts = args.slice_texts
-    for posT, posC in enumerate(positions):
-        code[posC] = ("TEXT", textBytes[posT])
-        # If any of the texts are bigger than 16Kb (size of bank), we enforce text slicing
-        if not force_slice_texts and ((len(textBytes[posT]) + 1) >= (16 * 1024)):
-            force_slice_texts = True
-
-    del txtComp
-
-    print(_(f"Text compression completed ({tmp_timer})"))
-
-    ######################################################################
+    if args.jobs < 0:
+        raise CompileError(_("ERROR: Invalid number of jobs."))
 
-    # Exporting current font
-    if args.export_charset is not None:
-        output_charset_file = args.export_charset
-        with open(output_charset_file, "w", encoding="utf-8") as fco:
-            fco.write(font.getJson())
+    if args.image_lines not in range(1, 193):
+        raise CompileError(_(f"ERROR: Invalid number of image lines {args.image_lines}."))
 
-    ######################################################################
     if verbose > 0:
         print(_("Reading external files..."))
 
-    if args.image_lines not in range(1, 193):
-        sys.exit(_(f"ERROR: Invalid number of image lines {args.image_lines}."))
-
     sfx = None
     if args.sfx_asm_file is not None:
         with open(args.sfx_asm_file, "r", encoding="utf-8") as f:
             sfx = f.read()
             sfx = re.sub(r"org\s+\d{1,6}", "", sfx, flags=re.IGNORECASE)
 
-    blocks = []
+    loading_scr = None
+    if args.load_scr_file is not None:
+        if verbose > 0:
+            print(_("Reading loading screen..."))
+        if os.path.isfile(args.load_scr_file):
+            with open(args.load_scr_file, "rb") as f:
+                loading_scr = list(f.read())
+            if len(loading_scr) != 32 * (192 + 24):
+                raise CompileError(_("ERROR: Invalid SCR file"))
+        else:
+            raise CompileError(_("ERROR: Can't open load SCR file."))
+
+    images = []
+    screens = []
+    image_deps = []
     if args.images_path is not None:
         images_json_path = os.path.join(args.images_path, f"images.json")
+        # The directory too, so new images are noticed
+        image_deps += [args.images_path, images_json_path]
         result, images_json, error_txt = get_image_config(images_json_path)
         if not result:
-            sys.exit(_(error_txt))
-        tmp_timer.reset()
+            raise CompileError(_(error_txt))
         for i in range(256):
             fpath = os.path.join(args.images_path, f"{i:03d}.scr")
             dpath = os.path.join(args.images_path, f"{i:03d}.csc")
-            if os.path.isfile(fpath) and file_must_be_generated(fpath, dpath):
+            if os.path.isfile(fpath):
                 scr_num_lines = args.image_lines
                 scr_force_mirror = False
                 if images_json is not None:
@@ -567,593 +748,1153 @@ def main():
                                 print(_(f"{fpath} is set with {scr_num_lines} lines."))
                                 if scr_force_mirror:
                                     print(_(f"{fpath} has forced simmetry."))
-                b = compress_screen_file(
-                    fpath,
-                    num_lines=scr_num_lines,
-                    force_mirror=scr_force_mirror,
-                    verbose=(verbose >= 1),
-                )
-                if (model == "plus3") and (len(b) > (7 * 1024)):
-                    sys.exit(_("ERROR: Invalid SCR file, it is too big"))
-                with open(dpath, "wb") as f:
-                    f.write(bytearray(b))
-                t = ("SCR", i, len(b), b, dpath)
-                blocks.append(t)
+                images.append((i, dpath, None))
+                screens.append((fpath, scr_num_lines, scr_force_mirror, dpath))
+                image_deps.append(fpath)
             elif os.path.isfile(dpath):
                 with open(dpath, "rb") as f:
-                    b = list(f.read())
-                    t = ("SCR", i, len(b), b, dpath)
-                    blocks.append(t)
-                    if (model == "plus3") and (len(b) > (7 * 1024)):
-                        sys.exit(_("ERROR: Invalid SCR file, it is too big"))
-        print(_(f"Images processing completed ({tmp_timer})"))
-
-    has_tracks = False
-    wyz_instruments = ""
-    wyz_tracks = dict()
-    wyz_tracks_sizes = dict()
-    if model == "mld" and args.tracks_path is not None:
-        if verbose > 0:
-            print(_("Ignoring tracks for strict MLD 48K target."))
-    elif args.tracks_path is not None and model != "48k":
-        tmp_timer.reset()
-        if args.use_wyz_tracker:
-            # Using WYZ tracker
-            if verbose > 0:
-                print(_("Reading WyzTracker files..."))
-            fpath1 = os.path.join(args.tracks_path, f"instruments.asm")
-            if os.path.isfile(fpath1):
-                with open(fpath1, "r") as f:  # Load instruments data
-                    wyz_instruments += f.read()
-            for i in range(256):
-                fpath = os.path.join(args.tracks_path, f"{i:03d}.mus")
-                if os.path.isfile(fpath):
-                    b = None
-                    with open(fpath, "rb") as f:  # Load track data
-                        b = list(f.read())
-                    if b is not None:
-                        b2, delta = compress_track_data(b)
-                        wyz_tracks[i] = b2
-                        wyz_tracks_sizes[i] = len(b)
-                        if verbose >= 1:
-                            print(
-                                _(
-                                    f"Track {i:03d} compressed: {len(b)} bytes to {len(b2)} bytes (delta={delta})."
-                                )
-                            )
-                        # test
-                        t = ("WYZ", i, 0, [], fpath)
-                        blocks.append(t)
-            if len(wyz_instruments) == 0 and len(wyz_tracks.keys()) > 0:
-                sys.exit(_(f"ERROR: File {fpath1} not found."))
-            has_tracks = len(wyz_instruments) > 0 and len(wyz_tracks.keys()) > 0
-        else:
-            # PT3 tracks
-            if verbose > 0:
-                print(_("Reading PT3 files..."))
-            for i in range(256):
-                fpath = os.path.join(args.tracks_path, f"{i:03d}.PT3")
-                if os.path.isfile(fpath):
-                    with open(fpath, "rb") as f:
-                        b = list(f.read())
-                        if (model == "plus3") and (len(b) > (8 * 1024)):
-                            sys.exit(
-                                _(f"ERROR: Invalid PT3 file {fpath}, it is too big")
-                            )
-                        t = ("TRK", i, len(b), b, fpath)
-                        blocks.append(t)
-                        if not has_tracks:
-                            has_tracks = True
-        print(_(f"Tracks processing completed ({tmp_timer})"))
+                    images.append((i, dpath, list(f.read())))
+                image_deps.append(dpath)
 
-    loading_scr = None
-    if args.load_scr_file is not None:
-        if verbose > 0:
-            print(_("Reading loading screen..."))
-        if os.path.isfile(args.load_scr_file):
-            with open(args.load_scr_file, "rb") as f:
-                loading_scr = list(f.read())
-            if len(loading_scr) != 32 * (192 + 24):
-                sys.exit(_("ERROR: Invalid SCR file"))
-        else:
-            sys.exit(_("ERROR: Can't open load SCR file."))
+    # Images already compressed are found here, only the rest need a process
+    screen_cache = None if args.no_cache else BuildCache(get_cache_dir("images"))
+    (screen_results, screen_keys, screen_jobs) = find_compressed_screens(
+        screens, screen_cache, verbose=(verbose >= 1)
+    )
+
+    asm_cache = None if args.no_cache else BuildCache(get_cache_dir("interpreter"))
 
     ######################################################################
-    tmp_timer.reset()
-    ######################################################################
-    use_wyz_tracker = has_tracks and args.use_wyz_tracker
+    # Stages of the compilation. Each one runs as soon as the values it
+    # needs are ready, so the independent ones overlap.
 
-    wyz_player_bin = None
-    if use_wyz_tracker:
+    def preprocess_stage():
+        # Preprocess the input file to handle #include directives
         if verbose > 0:
-            print(_("Assembling WyzTracker bank..."))
-        res, wyz_player_bin = create_wyz_player_bank(
-            track_path=args.tracks_path,
-            sjasmplus_path=args.sjasmplus_path,
-            tracks=wyz_tracks,
-            instruments=wyz_instruments,
-            verbose=(verbose >= 1),
-        )
-        if not res:
-            sys.exit(_("ERROR: Invalid WyzTracker code generation."))
-        else:
-            for k in wyz_tracks_sizes.keys():
-                if wyz_tracks_sizes[k] > (16 * 1024 - len(wyz_player_bin)):
-                    sys.exit(
-                        _(f"ERROR: Track {k} doens't fit on available space in bank 1!")
+            print(_("Preprocessing includes..."))
+        stage_timer = Timer()
+        try:
+            preprocessor = CydcPreprocessor(
+                max_depth=20,
+                base_path=os.path.dirname(os.path.abspath(args.input)),
+                max_errors=args.max_errors,
+            )
+            text, line_map = preprocessor.preprocess(args.input)
+
+            if verbose >= 1:
+                included_count = len(preprocessor.included_files) - 1  # -1 for main file
+                if included_count > 0:
+                    print(_(f"Preprocessed {included_count} include file(s) in {stage_timer}"))
+                else:
+                    print(_(f"Preprocessing completed in {stage_timer}"))
+        except PreprocessorError as e:
+            diagnostics = []
+            if len(preprocessor.errors) > 0:
+                for prep_error in preprocessor.errors:
+                    diagnostics.append(("PREPROCESSOR", str(prep_error)))
+                if preprocessor.max_errors_reached:
+                    diagnostics.append(
+                        ("COMPILER", _(f"Maximum error limit reached ({args.max_errors})."))
                     )
+            else:
+                diagnostics.append(("PREPROCESSOR", str(e)))
+            raise CompileError(diagnostics[0][1], diagnostics) from e
+        return (text, line_map, list(preprocessor.source_files))
 
-    ######################################################################
+    def parse_stage(source, line_map):
+        if verbose > 0:
+            print(_("Parsing code..."))
+        stage_timer = Timer()
+        parser = CydcParser(
+            gettext,
+            strict_colon_mode=not args.no_strict_colons,
+            max_errors=args.max_errors,
+        )
+        parser.set_line_map(line_map)  # Set line map for better error reporting
+        parser.build(use_cache=not args.no_cache)
+        code = parser.parse(input=source, verbose=(verbose >= 3))
+        if verbose >= 2:
+            print(_("Symbols:"))
+            parser.print_symbols()
+        if len(parser.errors) > 0:
+            diagnostics = [("PARSER", e) for e in parser.errors]
+            if parser.max_errors_reached:
+                diagnostics.append(
+                    ("COMPILER", _(f"Maximum error limit reached ({args.max_errors})."))
+                )
+            raise CompileError(diagnostics[0][1], diagnostics)
+        print(_(f"Code parsing completed ({stage_timer})"))
+        return code
 
-    codegen = CydcCodegen(gettext)
-    chunks = []
-    l_tokens = []
-    l_chars = []
-    l_charw = []
+    def texts_stage(parsed_code):
+        if verbose > 0:
+            print(_("Compressing texts..."))
+        stage_timer = Timer()
+
+        # Recollecting strings for tokenization
+        code = list(parsed_code)
+        strings = []
+        positions = []
+        for pos, value in enumerate(code):
+            opcode = value[0]
+            if opcode == "TEXT":
+                strings.append(value[1])
+                positions.append(pos)
+
+        txtComp = CydcTextCompressor(
+            gettext,
+            args.superset_limit,
+            verbose=(verbose >= 1),
+            engine=args.token_engine,
+            jobs=args.jobs,
+        )
 
-    if args.trim_interpreter:
-        unused_opcodes = codegen.get_unused_opcodes(code)
-    else:
-        unused_opcodes = set()
+        # Reusing the tokens of the previous compilation
+        tokens = imported_tokens
+        tokens_meta = None
+        if args.update_tokens_file is not None:
+            tokens_meta = load_tokens_meta(args.update_tokens_file)
+        if tokens_meta is not None:
+            if (
+                tokens_meta["min_length"] != args.min_length
+                or tokens_meta["max_length"] != args.max_length
+                or tokens_meta["superset_limit"] != args.superset_limit
+            ):
+                print(_("Token search parameters changed, searching tokens again."))
+            else:
+                drift = get_texts_drift(tokens_meta["texts"], strings)
+                if drift > args.tokens_drift:
+                    print(_("Texts changed %(drift).1f%%, searching tokens again.") % {"drift": drift})
+                else:
+                    print(_("Texts changed %(drift).1f%%, updating previous tokens.") % {"drift": drift})
+                    tokens = txtComp.update_tokens(
+                        strings,
+                        tokens_meta["tokens"],
+                        tokens_meta["savings"],
+                        tokens_meta["max_len_token"],
+                    )
+                    txtComp.best_max_length = tokens_meta["max_len_token"]
+
+        key = (
+            tuple(strings),
+            args.min_length,
+            args.max_length,
+            args.superset_limit,
+            args.token_engine,
+            None if tokens is None else json.dumps(tokens),
+        )
+        if key in _compressed_texts:
+            print(_("Texts unchanged, reusing their compression."))
+            (textBytes, tokenBytes, tokens, txtComp.best_max_length) = copy.deepcopy(
+                _compressed_texts[key]
+            )
+        else:
+            (textBytes, tokenBytes, tokens) = txtComp.compress(
+                strings,
+                args.min_length,
+                args.max_length,
+                tokens,
+                stop=scheduler.interrupted,
+            )
+            # A search cut short by Ctrl-C is not worth reusing
+            if not scheduler.interrupted.is_set():
+                while len(_compressed_texts) >= MAX_COMPRESSED_TEXTS:
+                    del _compressed_texts[next(iter(_compressed_texts))]
+                _compressed_texts[key] = copy.deepcopy(
+                    (textBytes, tokenBytes, tokens, txtComp.best_max_length)
+                )
 
-    if font is None:
-        font = CydcFont()
-    l_chars = font.font_chars
-    l_charw = font.font_sizes
-    l_tokens = tokenBytes
+        # Exporting tokens
+        if args.export_tokens_file is not None:
+            output_token_file = args.export_tokens_file
+            with open(output_token_file, "w", encoding="utf-8") as fto:
+                fto.write(json.dumps(tokens))
 
-    ######################################################################
+        if args.update_tokens_file is not None:
+            try:
+                save_tokens_meta(
+                    args.update_tokens_file,
+                    tokens,
+                    dict(
+                        min_length=args.min_length,
+                        max_length=args.max_length,
+                        superset_limit=args.superset_limit,
+                        max_len_token=txtComp.best_max_length,
+                        texts=get_texts_fingerprint(strings),
+                        savings=txtComp.get_token_savings(strings, tokens),
+                    ),
+                )
+            except OSError:
+                raise CompileError(_("ERROR: Can't write the tokens file."))
+
+        # Set text to compressed bytes format
+        force_slice_texts = args.slice_texts
+        for posT, posC in enumerate(positions):
+            code[posC] = ("TEXT", textBytes[posT])
+            # If any of the texts are bigger than 16Kb (size of bank), we enforce text slicing
+            if not force_slice_texts and ((len(textBytes[posT]) + 1) >= (16 * 1024)):
+                force_slice_texts = True
+
+        print(_(f"Text compression completed ({stage_timer})"))
+        return (code, tokenBytes, textBytes, force_slice_texts)
+
+    def opcodes_stage(parsed_code):
+        if args.trim_interpreter:
+            return CydcCodegen(gettext).get_unused_opcodes(parsed_code)
+        return set()
+
+    images_timer = Timer()
+
+    def images_stage(**compressed_images):
+        # Compressed images are reused only if the SCR and its parameters are
+        # the same, and their CSC files are already written
+        compressed_screens = store_compressed_screens(
+            screens,
+            screen_results,
+            screen_keys,
+            [c for group in compressed_images.values() for c in group],
+            screen_cache,
+            verbose=(verbose >= 1),
+        )
+        compressed = iter(compressed_screens)
+        image_blocks = []
+        for i, dpath, b in images:
+            if b is None:
+                b = next(compressed)
+            if (model == "plus3") and (len(b) > (7 * 1024)):
+                raise CompileError(_("ERROR: Invalid SCR file, it is too big"))
+            t = ("SCR", i, len(b), b, dpath)
+            image_blocks.append(t)
+        if args.images_path is not None:
+            print(_(f"Images processing completed ({images_timer})"))
+        return image_blocks
+
+    def tracks_stage():
+        track_blocks = []
+        track_deps = []
+        has_tracks = False
+        wyz_instruments = ""
+        wyz_tracks = dict()
+        wyz_tracks_sizes = dict()
+        if model == "mld" and args.tracks_path is not None:
+            if verbose > 0:
+                print(_("Ignoring tracks for strict MLD 48K target."))
+        elif args.tracks_path is not None and model != "48k":
+            stage_timer = Timer()
+            track_deps.append(args.tracks_path)
+            if args.use_wyz_tracker:
+                # Using WYZ tracker
+                if verbose > 0:
+                    print(_("Reading WyzTracker files..."))
+                fpath1 = os.path.join(args.tracks_path, f"instruments.asm")
+                track_deps.append(fpath1)
+                if os.path.isfile(fpath1):
+                    with open(fpath1, "r") as f:  # Load instruments data
+                        wyz_instruments += f.read()
+                for i in range(256):
+                    fpath = os.path.join(args.tracks_path, f"{i:03d}.mus")
+                    if os.path.isfile(fpath):
+                        b = None
+                        with open(fpath, "rb") as f:  # Load track data
+                            b = list(f.read())
+                        track_deps.append(fpath)
+                        if b is not None:
+                            b2, delta = compress_track_data(b)
+                            wyz_tracks[i] = b2
+                            wyz_tracks_sizes[i] = len(b)
+                            if verbose >= 1:
+                                print(
+                                    _(
+                                        f"Track {i:03d} compressed: {len(b)} bytes to {len(b2)} bytes (delta={delta})."
+                                    )
+                                )
+                            # test
+                            t = ("WYZ", i, 0, [], fpath)
+                            track_blocks.append(t)
+                if len(wyz_instruments) == 0 and len(wyz_tracks.keys()) > 0:
+                    raise CompileError(_(f"ERROR: File {fpath1} not found."))
+                has_tracks = len(wyz_instruments) > 0 and len(wyz_tracks.keys()) > 0
+            else:
+                # PT3 tracks
+                if verbose > 0:
+                    print(_("Reading PT3 files..."))
+                for i in range(256):
+                    fpath = os.path.join(args.tracks_path, f"{i:03d}.PT3")
+                    if os.path.isfile(fpath):
+                        with open(fpath, "rb") as f:
+                            b = list(f.read())
+                            if (model == "plus3") and (len(b) > (8 * 1024)):
+                                raise CompileError(
+                                    _(f"ERROR: Invalid PT3 file {fpath}, it is too big")
+                                )
+                            t = ("TRK", i, len(b), b, fpath)
+                            track_deps.append(fpath)
+                            track_blocks.append(t)
+                            if not has_tracks:
+                                has_tracks = True
+            print(_(f"Tracks processing completed ({stage_timer})"))
+        return (
+            track_blocks,
+            has_tracks,
+            wyz_instruments,
+            wyz_tracks,
+            wyz_tracks_sizes,
+            track_deps,
+        )
 
-    asm_size = 0
-    try:
-        if model == "plus3":
+    def wyz_stage(has_tracks, wyz_instruments, wyz_tracks, wyz_tracks_sizes):
+        use_wyz_tracker = has_tracks and args.use_wyz_tracker
+        wyz_player_bin = None
+        if use_wyz_tracker:
             if verbose > 0:
-                print(_("Assembling interpreter for size..."))
-            asm_size = get_asm_plus3_size(
+                print(_("Assembling WyzTracker bank..."))
+            res, wyz_player_bin = create_wyz_player_bank(
+                track_path=args.tracks_path,
                 sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
+                tracks=wyz_tracks,
+                instruments=wyz_instruments,
                 verbose=(verbose >= 1),
-                sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
-                has_tracks=has_tracks,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
-                use_wyz_tracker=use_wyz_tracker,
             )
-        elif model == "128k":
+            if not res:
+                raise CompileError(_("ERROR: Invalid WyzTracker code generation."))
+            else:
+                for k in wyz_tracks_sizes.keys():
+                    if wyz_tracks_sizes[k] > (16 * 1024 - len(wyz_player_bin)):
+                        raise CompileError(
+                            _(f"ERROR: Track {k} doens't fit on available space in bank 1!")
+                        )
+        return wyz_player_bin
+
+    def interpreter_stage(token_bytes, text_bytes, has_tracks, unused_opcodes):
+        try:
             if verbose > 0:
-                print(_("Assembling interpreter for size..."))
-            asm_size = get_asm_128_size(
+                print(_("Assembling interpreter..."))
+            interpreter = build_interpreter(
                 sjasmplus_path=args.sjasmplus_path,
                 output_path=args.output_path,
                 verbose=(verbose >= 1),
-                sfx_asm=sfx,
-                tokens=l_tokens,
+                model=model,
+                tokens=token_bytes,
                 chars=l_chars,
                 charw=l_charw,
-                has_tracks=has_tracks,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
-                use_wyz_tracker=use_wyz_tracker,
-            )
-        elif model == "mld" or model == "mld128":
-            if verbose > 0:
-                print(_("Assembling interpreter for size..."))
-            asm_size = get_asm_mld_size(
-                sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
-                verbose=(verbose >= 1),
                 sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
                 has_tracks=has_tracks,
                 unused_opcodes=unused_opcodes,
                 pause_start_value=args.pause_after_load,
-                use_wyz_tracker=use_wyz_tracker,
-                mld_is_128=(model == "mld128"),
-            )
-        else:
-            if verbose > 0:
-                print(_("Assembling interpreter for size..."))
-            asm_size = get_asm_48_size(
-                sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
-                verbose=(verbose >= 1),
-                sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
+                token_table=args.token_table,
+                use_wyz_tracker=has_tracks and args.use_wyz_tracker,
+                loading_scr=loading_scr,
+                cache=asm_cache,
             )
+            asm_size = interpreter.size
 
-    except ValueError as e1:
-        sys.exit(_("ERROR: Error assembling interpreter."), e1)
-    except OSError as e2:
-        sys.exit(_("ERROR: Error assembling interpreter."), e2)
-
-    if verbose:
-        print(f"Interpreter size: {asm_size}")
-
-    if model == "48k" and (asm_size > 32 * 1024):
-        sys.exit(_("ERROR: Interpreter too big!") + f" {asm_size} bytes.")
-    elif model != "48k" and asm_size > 16 * 1024:
-        sys.exit(_("ERROR: Interpreter too big!") + f" {asm_size} bytes.")
+        except ValueError as e1:
+            raise CompileError(_("ERROR: Error assembling interpreter.") + f" {e1}") from e1
+        except OSError as e2:
+            raise CompileError(_("ERROR: Error assembling interpreter.") + f" {e2}") from e2
 
-    ######################################################################
+        if verbose:
+            print(f"Interpreter size: {asm_size}")
 
-    if model == "plus3" and verbose > 0:
-        print(_("Memory organization for disk version..."))
-    elif (model == "mld" or model == "mld128") and verbose > 0:
-        print(_("Memory organization for MLD version..."))
-    elif verbose > 0:
-        print(_("Memory organization for tape version..."))
-
-    # We do this to get an rounded-up approximation of the number of blocks
-    codegen.set_bank_offset_list([0xC000])
-    codegen.set_bank_size_list([16 * 1024])
-    chunks = codegen.generate_code(
-        code=code, slice_text=force_slice_texts, show_debug=False
-    )
+        if verbose or args.token_table:
+            table_size, num_chars, scan_tstates, table_tstates = get_token_lookup_stats(
+                token_bytes, text_bytes
+            )
+            if num_chars > 0:
+                print(
+                    _("Token table: %(size)d bytes, %(before).1f -> %(after).1f T-states per character printed.")
+                    % {
+                        "size": table_size,
+                        "before": scan_tstates / num_chars,
+                        "after": table_tstates / num_chars,
+                    }
+                )
 
-    # To calculate the offset
-    if model == "plus3":
-        num_blocks = len(chunks)
-    else:
-        num_blocks = len(blocks) + len(chunks)
-    bank0_offset = (5 * num_blocks) + asm_size + 0x8000
-    bank0_size_available = (16 * 1024) + (0xC000 - bank0_offset)
-
-    # generate block again
-    if model == "plus3" and use_wyz_tracker:
-        codegen.set_bank_offset_list([bank0_offset, 0xC000])
-        codegen.set_bank_size_list(
-            [bank0_size_available, 16 * 1024, 16 * 1024, 8 * 1024]
+        if model == "48k" and (asm_size > 32 * 1024):
+            raise CompileError(_("ERROR: Interpreter too big!") + f" {asm_size} bytes.")
+        elif model != "48k" and asm_size > 16 * 1024:
+            raise CompileError(_("ERROR: Interpreter too big!") + f" {asm_size} bytes.")
+        return interpreter
+
+    def layout_stage(
+        code,
+        force_slice_texts,
+        interpreter,
+        image_blocks,
+        track_blocks,
+        has_tracks,
+        wyz_player_bin,
+    ):
+        asm_size = interpreter.size
+        blocks = image_blocks + track_blocks
+        use_wyz_tracker = has_tracks and args.use_wyz_tracker
+        codegen = CydcCodegen(gettext)
+
+        if model == "plus3" and verbose > 0:
+            print(_("Memory organization for disk version..."))
+        elif (model == "mld" or model == "mld128") and verbose > 0:
+            print(_("Memory organization for MLD version..."))
+        elif verbose > 0:
+            print(_("Memory organization for tape version..."))
+
+        codegen.translate_code(
+            code=code, slice_text=force_slice_texts, show_debug=args.show_bytecode
         )
-    else:
-        codegen.set_bank_offset_list([bank0_offset, 0xC000])
-        codegen.set_bank_size_list([bank0_size_available, 16 * 1024])
-    chunks = codegen.generate_code(
-        code=code, slice_text=force_slice_texts, show_debug=args.show_bytecode
-    )
+        if verbose > 0:
+            for name, instructions, size in codegen.optimizer_stats:
+                print(
+                    _("Optimizer, %(pass)s: %(instructions)d instructions, %(bytes)d bytes removed.")
+                    % {"pass": name, "instructions": instructions, "bytes": size}
+                )
 
-    if model == "128k" or model == "mld128":
-        if use_wyz_tracker:
-            spectrum_banks = [0, 3, 4, 6, 7]
-        else:
-            spectrum_banks = [0, 1, 3, 4, 6, 7]
-    elif model == "plus3":
-        if use_wyz_tracker:
-            spectrum_banks = [0, 3, 4, 6]
+        # The index goes before the code on bank 0, and has an entry for each
+        # chunk of code, so the code is placed again until both agree. The
+        # first guess is with whole banks.
+        codegen.set_bank_offset_list([0xC000])
+        codegen.set_bank_size_list([16 * 1024])
+        chunks = codegen.layout_code()
+        num_blocks = None
+        while True:
+            # To calculate the offset
+            if model == "plus3":
+                layout_blocks = len(chunks)
+            else:
+                layout_blocks = len(blocks) + len(chunks)
+            if layout_blocks == num_blocks:
+                break
+            num_blocks = layout_blocks
+            bank0_offset = get_index_size(num_blocks) + asm_size + 0x8000
+            bank0_size_available = (16 * 1024) + (0xC000 - bank0_offset)
+
+            if model == "plus3" and use_wyz_tracker:
+                codegen.set_bank_offset_list([bank0_offset, 0xC000])
+                codegen.set_bank_size_list(
+                    [bank0_size_available, 16 * 1024, 16 * 1024, 8 * 1024]
+                )
+            else:
+                codegen.set_bank_offset_list([bank0_offset, 0xC000])
+                codegen.set_bank_size_list([bank0_size_available, 16 * 1024])
+            chunks = codegen.layout_code()
+
+        if model == "128k" or model == "mld128":
+            if use_wyz_tracker:
+                spectrum_banks = [0, 3, 4, 6, 7]
+            else:
+                spectrum_banks = [0, 1, 3, 4, 6, 7]
+        elif model == "plus3":
+            if use_wyz_tracker:
+                spectrum_banks = [0, 3, 4, 6]
+            else:
+                spectrum_banks = [0, 1, 3, 4]
         else:
-            spectrum_banks = [0, 1, 3, 4]
-    else:
-        spectrum_banks = [0]
-
-    tmp_blocks = []
-    tmp_index = []
-    tmp_available_bank_size = []
-    # Make sure that the TXT blocks are first!
-    for i, chunk in enumerate(chunks):
-        # tmp_blocks.insert(i, ("TXT", i, len(chunk), chunk, ""))
-        if i == 0:
-            offset = bank0_offset
-            size = bank0_size_available
-        elif i == 3 and model == "plus3" and use_wyz_tracker:
-            offset = 0xC000
-            size = 8 * 1024
+            spectrum_banks = [0]
+
+        index = []
+        available_banks = []
+        available_bank_size = []
+        # Make sure that the TXT blocks are first!
+        for i in range(max(len(chunks), len(spectrum_banks))):
+            if i == 0:
+                offset = bank0_offset
+                size = bank0_size_available
+            elif i == 3 and model == "plus3" and use_wyz_tracker:
+                offset = 0xC000
+                size = 8 * 1024
+            else:
+                offset = 0xC000
+                size = 16 * 1024
+            if i < len(chunks):
+                if size < len(chunks[i]):
+                    raise CompileError(_("ERROR: Block too big."))
+                index.append((0, i, i, offset))
+                available_banks.append(list(chunks[i]))
+                available_bank_size.append(size - len(chunks[i]))
+            else:
+                available_banks.append([])
+                available_bank_size.append(size)
+
+        max_banks = len(spectrum_banks)
+        if len(chunks) > max_banks:
+            raise CompileError(_("ERROR: Not enough memory available"))
+
+        # On disk the images and tracks are files of their own
+        packed_blocks = [] if model == "plus3" else blocks
+        sizes = [bsize for (btype, bidx, bsize, bdata, bpath) in packed_blocks]
+        previous = pack_blocks_best_fit(sizes, available_bank_size, len(chunks))
+        packing = pack_blocks(sizes, available_bank_size, len(chunks))
+        if packing is None:
+            packing = previous
+        if packing is None:
+            raise CompileError(_("ERROR: Not enough memory available"))
+        if previous is None:
+            print(_("Bank packing: the blocks only fit with the optimal packing."))
+        elif packing[1] < previous[1]:
+            print(
+                _("Bank packing: %(banks)d banks instead of %(previous)d, %(bytes)d bytes recovered.")
+                % {
+                    "banks": packing[1],
+                    "previous": previous[1],
+                    "bytes": sum(available_bank_size[packing[1] : previous[1]]),
+                }
+            )
         else:
-            offset = 0xC000
-            size = 16 * 1024
-        if size < len(chunk):
-            sys.exit(_("ERROR: Block too big."))
-        tmp_blocks.insert(i, chunk)
-        tmp_index.insert(i, (0, i, i, offset))
-        tmp_available_bank_size.insert(i, size - len(chunk))
-
-    max_banks = len(spectrum_banks)
-    num_banks = len(tmp_blocks)
-
-    if num_banks > max_banks:
-        sys.exit(_("ERROR: Not enough memory available"))
-
-    fits = False
-    while not fits:
-        index = copy.deepcopy(tmp_index)
-        available_banks = copy.deepcopy(tmp_blocks)
-        available_banks.extend([[] for x in range(num_banks - len(tmp_blocks))])
-        available_bank_size = copy.deepcopy(tmp_available_bank_size)
-        available_bank_size.extend(
-            [16 * 1024 for x in range(num_banks - len(tmp_available_bank_size))]
-        )
-        fits = True
-        if model != "plus3":
-            for i, block in enumerate(blocks):
-                btype, bidx, bsize, bdata, bpath = block
-                best_fit_index = -1
-                min_leftover = sys.maxsize
-                for j, b in enumerate(available_banks):
-                    available = available_bank_size[j]
-                    if available >= bsize:
-                        leftover = available - bsize
-                        if min_leftover > leftover:
-                            min_leftover = leftover
-                            best_fit_index = j
-                if best_fit_index != -1:
-                    offset = len(available_banks[best_fit_index])
-                    if best_fit_index == 0:
-                        offset += bank0_offset
-                    else:
-                        offset += 0xC000
-                    if btype == "TRK":
-                        b = 2
-                    elif btype == "SCR":
-                        b = 1
-                    elif btype == "WYZ":
-                        b = 3
-                    else:  # btype == "TXT"
-                        sys.exit(_("ERROR: Unexpected data"))
-                    index.append((b, bidx, best_fit_index, offset))
-                    available_banks[best_fit_index] += bdata
-                    available_bank_size[best_fit_index] -= bsize
-                else:
-                    del available_bank_size
-                    del available_banks
-                    del index
-                    num_banks += 1
-                    fits = False
-                    break
-            if num_banks > max_banks:
-                sys.exit(_("ERROR: Not enough memory available"))
-
-    index = [
-        (b, bidx, spectrum_banks[bank], (offset & 0xFFFF))
-        for (b, bidx, bank, offset) in index
-    ]
-
-    print("\nRAM usage:\n-----------------")
-    total_bytes = 0
-    bars_data = []
-    for i, v in enumerate(available_banks):
-        total_bytes += len(v)
-        if abarAvailable:
-            bars_data.append(
-                (
-                    f"Bank [{spectrum_banks[i]}]: {len(v)} / {available_bank_size[i]} bytes",
-                    math.ceil(
-                        (len(v) * 100.0) / (len(v) + available_bank_size[i]) * 100.0
+            # Same number of banks, keep the placement of previous versions
+            packing = previous
+        (placement, num_banks) = packing
+        del available_banks[num_banks:]
+        del available_bank_size[num_banks:]
+
+        for block, bank in zip(packed_blocks, placement):
+            btype, bidx, bsize, bdata, bpath = block
+            offset = len(available_banks[bank])
+            if bank == 0:
+                offset += bank0_offset
+            else:
+                offset += 0xC000
+            if btype == "TRK":
+                b = 2
+            elif btype == "SCR":
+                b = 1
+            elif btype == "WYZ":
+                b = 3
+            else:  # btype == "TXT"
+                raise CompileError(_("ERROR: Unexpected data"))
+            index.append((b, bidx, bank, offset))
+            available_banks[bank] += bdata
+            available_bank_size[bank] -= bsize
+
+        index = [
+            (b, bidx, spectrum_banks[bank], (offset & 0xFFFF))
+            for (b, bidx, bank, offset) in index
+        ]
+
+        print("\nRAM usage:\n-----------------")
+        total_bytes = 0
+        bars_data = []
+        for i, v in enumerate(available_banks):
+            total_bytes += len(v)
+            if abarAvailable:
+                bars_data.append(
+                    (
+                        f"Bank [{spectrum_banks[i]}]: {len(v)} / {available_bank_size[i]} bytes",
+                        math.ceil(
+                            (len(v) * 100.0) / (len(v) + available_bank_size[i]) * 100.0
+                        )
+                        / 100.0,
                     )
-                    / 100.0,
                 )
+            else:
+                print(
+                    f"Bank [{spectrum_banks[i]}]: {len(v)} Bytes / Free: {available_bank_size[i]} bytes."
+                )
+        if abarAvailable:
+            asciibars.plot(
+                bars_data,
+                sep_lc=" -> ",
+                count_pf="%",
+                max_length=20,
+                unit="▓",
+                neg_unit="░",
+                neg_max=100,
             )
-        else:
-            print(
-                f"Bank [{spectrum_banks[i]}]: {len(v)} Bytes / Free: {available_bank_size[i]} bytes."
-            )
-    if abarAvailable:
-        asciibars.plot(
-            bars_data,
-            sep_lc=" -> ",
-            count_pf="%",
-            max_length=20,
-            unit="▓",
-            neg_unit="░",
-            neg_max=100,
-        )
 
-    if use_wyz_tracker:
-        print(_("Bank [1]: Reserved for WyzTracker."))
+        if use_wyz_tracker:
+            print(_("Bank [1]: Reserved for WyzTracker."))
+
+        available_bytes = 0
+        for v in spectrum_banks:
+            if v == 0:
+                available_bytes += bank0_size_available
+            elif v == 6 and model == "plus3" and use_wyz_tracker:
+                available_bytes += 8 * 1024
+            else:
+                available_bytes += 16 * 1024
 
-    available_bytes = 0
-    for v in spectrum_banks:
-        if v == 0:
-            available_bytes += bank0_size_available
-        elif v == 6 and model == "plus3" and use_wyz_tracker:
-            available_bytes += 8 * 1024
-        else:
-            available_bytes += 16 * 1024
-
-    print("\nSummary:")
-    print(f"- {available_bytes} bytes available.")
-    print(f"- {total_bytes} bytes used.")
-    print(f"- {available_bytes-total_bytes} bytes free.")
-    if abarAvailable:
-        bars_data = [
-            (
-                "- RAM usage",
-                math.ceil(((total_bytes * 100.0) / available_bytes) * 100.0) / 100.0,
+        print("\nSummary:")
+        print(f"- {available_bytes} bytes available.")
+        print(f"- {total_bytes} bytes used.")
+        print(f"- {available_bytes-total_bytes} bytes free.")
+        if abarAvailable:
+            bars_data = [
+                (
+                    "- RAM usage",
+                    math.ceil(((total_bytes * 100.0) / available_bytes) * 100.0) / 100.0,
+                )
+            ]
+            asciibars.plot(
+                bars_data,
+                sep_lc=": ",
+                count_pf="%",
+                max_length=40,
+                unit="▓",
+                neg_unit="░",
+                neg_max=100,
             )
-        ]
-        asciibars.plot(
-            bars_data,
-            sep_lc=": ",
-            count_pf="%",
-            max_length=40,
-            unit="▓",
-            neg_unit="░",
-            neg_max=100,
-        )
 
-    if verbose >= 1:
-        print("\nIndex:\n-----------------")
-        for i, v in enumerate(index):
-            print(f"Type={v[0]} Index={v[1]} Bank={v[2]} Start Address=${v[3]:04X}")
+        if verbose >= 1:
+            print("\nIndex:\n-----------------")
+            for i, v in enumerate(index):
+                print(f"Type={v[0]} Index={v[1]} Bank={v[2]} Start Address=${v[3]:04X}")
 
-    print()
+        print()
 
-    # Cutting the spectrum banks not used from the list
-    spectrum_banks = spectrum_banks[0 : len(available_banks)]
+        # Cutting the spectrum banks not used from the list
+        spectrum_banks = spectrum_banks[0 : len(available_banks)]
+        memory_map = [
+            (spectrum_banks[i], len(v), available_bank_size[i])
+            for i, v in enumerate(available_banks)
+        ]
 
-    # In case we use WyzTracker, add bank 1
-    if use_wyz_tracker:
-        spectrum_banks.append(1)
-        available_banks.append(wyz_player_bin)
+        # In case we use WyzTracker, add bank 1
+        if use_wyz_tracker:
+            spectrum_banks.append(1)
+            available_banks.append(wyz_player_bin)
+
+        return (index, available_banks, spectrum_banks, bank0_offset, memory_map)
+
+    def output_stage(
+        index,
+        available_banks,
+        spectrum_banks,
+        bank0_offset,
+        interpreter,
+        token_bytes,
+        has_tracks,
+        unused_opcodes,
+        image_blocks,
+        track_blocks,
+    ):
+        stage_timer = Timer()
+        asm_size = interpreter.size
+        blocks = image_blocks + track_blocks
+        use_wyz_tracker = has_tracks and args.use_wyz_tracker
+        target_name = output_name
 
-    try:
-        if model == "128k":
-            if verbose > 0:
-                print(_("Assembling Spectrum 128k TAP..."))
-            output_name = output_name[:10]
-            do_asm_128(
-                sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
-                verbose=(verbose >= 1),
-                tap_name=output_name,
-                index=index,
-                blocks=available_banks,
-                banks=spectrum_banks,
-                size_interpreter=asm_size,
-                bank0_offset=bank0_offset,
-                sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
-                loading_scr=loading_scr,
-                has_tracks=has_tracks,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
-                use_wyz_tracker=use_wyz_tracker,
-                name=output_name,
-            )
-        elif model == "plus3":
-            if verbose > 0:
-                print(_("Assembling Spectrum PLUS3 binary files..."))
-            output_name = output_name[:8]
-            do_asm_plus3(
-                sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
-                verbose=(verbose >= 1),
-                dsk_name=output_name,
-                index=index,
-                blocks=available_banks,
-                banks=spectrum_banks,
-                size_interpreter=asm_size,
-                bank0_offset=bank0_offset,
-                sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
-                loading_scr=loading_scr,
-                has_tracks=has_tracks,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
-                use_wyz_tracker=use_wyz_tracker,
-                name=output_name,
-            )
-        elif model == "mld" or model == "mld128":
+        try:
+            if model == "128k":
+                if verbose > 0:
+                    print(_("Assembling Spectrum 128k TAP..."))
+                target_name = target_name[:10]
+                do_asm_128(
+                    sjasmplus_path=args.sjasmplus_path,
+                    output_path=args.output_path,
+                    verbose=(verbose >= 1),
+                    tap_name=target_name,
+                    index=index,
+                    blocks=available_banks,
+                    banks=spectrum_banks,
+                    size_interpreter=asm_size,
+                    bank0_offset=bank0_offset,
+                    sfx_asm=sfx,
+                    tokens=token_bytes,
+                    chars=l_chars,
+                    charw=l_charw,
+                    loading_scr=loading_scr,
+                    has_tracks=has_tracks,
+                    unused_opcodes=unused_opcodes,
+                    pause_start_value=args.pause_after_load,
+                    token_table=args.token_table,
+                    use_wyz_tracker=use_wyz_tracker,
+                    name=target_name,
+                    interpreter=interpreter,
+                    cache=asm_cache,
+                )
+            elif model == "plus3":
+                if verbose > 0:
+                    print(_("Assembling Spectrum PLUS3 binary files..."))
+                target_name = target_name[:8]
+                do_asm_plus3(
+                    sjasmplus_path=args.sjasmplus_path,
+                    output_path=args.output_path,
+                    verbose=(verbose >= 1),
+                    dsk_name=target_name,
+                    index=index,
+                    blocks=available_banks,
+                    banks=spectrum_banks,
+                    size_interpreter=asm_size,
+                    bank0_offset=bank0_offset,
+                    sfx_asm=sfx,
+                    tokens=token_bytes,
+                    chars=l_chars,
+                    charw=l_charw,
+                    loading_scr=loading_scr,
+                    has_tracks=has_tracks,
+                    unused_opcodes=unused_opcodes,
+                    pause_start_value=args.pause_after_load,
+                    token_table=args.token_table,
+                    use_wyz_tracker=use_wyz_tracker,
+                    name=target_name,
+                    interpreter=interpreter,
+                )
+            elif model == "mld" or model == "mld128":
+                if verbose > 0:
+                    print(_(f"Assembling Spectrum {model.upper()}..."))
+                target_name = target_name[:8]
+                do_asm_mld(
+                    sjasmplus_path=args.sjasmplus_path,
+                    output_path=args.output_path,
+                    verbose=(verbose >= 1),
+                    mld_name=target_name,
+                    index=index,
+                    blocks=available_banks,
+                    banks=spectrum_banks,
+                    size_interpreter=asm_size,
+                    bank0_offset=bank0_offset,
+                    sfx_asm=sfx,
+                    tokens=token_bytes,
+                    chars=l_chars,
+                    charw=l_charw,
+                    loading_scr=loading_scr,
+                    has_tracks=has_tracks,
+                    unused_opcodes=unused_opcodes,
+                    pause_start_value=args.pause_after_load,
+                    token_table=args.token_table,
+                    use_wyz_tracker=use_wyz_tracker,
+                    mld_type="$88" if model == "mld128" else "$83",
+                    mld_is_128=(model == "mld128"),
+                    name=target_name,
+                    interpreter=interpreter,
+                )
+            else:
+                if verbose > 0:
+                    print(_("Assembling Spectrum 48k TAP..."))
+                target_name = target_name[:10]
+                do_asm_48(
+                    sjasmplus_path=args.sjasmplus_path,
+                    output_path=args.output_path,
+                    verbose=(verbose >= 1),
+                    tap_name=target_name,
+                    index=index,
+                    blocks=available_banks,
+                    banks=spectrum_banks,
+                    size_interpreter=asm_size,
+                    bank0_offset=bank0_offset,
+                    sfx_asm=sfx,
+                    tokens=token_bytes,
+                    chars=l_chars,
+                    charw=l_charw,
+                    loading_scr=loading_scr,
+                    unused_opcodes=unused_opcodes,
+                    pause_start_value=args.pause_after_load,
+                    token_table=args.token_table,
+                    name=target_name,
+                    interpreter=interpreter,
+                    cache=asm_cache,
+                )
+        except ValueError as e1:
+            raise CompileError(_("ERROR: Error assembling source.") + f" {e1}") from e1
+        except OSError as e2:
+            raise CompileError(_("ERROR: Error assembling source.") + f" {e2}") from e2
+
+        ######################################################################
+        if model == "plus3":
             if verbose > 0:
-                print(_(f"Assembling Spectrum {model.upper()}..."))
-            output_name = output_name[:8]
-            do_asm_mld(
-                sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
-                verbose=(verbose >= 1),
-                mld_name=output_name,
-                index=index,
-                blocks=available_banks,
-                banks=spectrum_banks,
-                size_interpreter=asm_size,
-                bank0_offset=bank0_offset,
-                sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
-                loading_scr=loading_scr,
-                has_tracks=has_tracks,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
-                use_wyz_tracker=use_wyz_tracker,
-                mld_type="$88" if model == "mld128" else "$83",
-                mld_is_128=(model == "mld128"),
-                name=output_name,
-            )
+                print(_("Assembling PLUS3 disk..."))
+            files = [
+                os.path.join(args.output_path, "DISK"),
+                os.path.join(args.output_path, f"{target_name}.BIN"),
+            ]
+            track_list = []
+            for b in blocks:
+                btype = b[0]
+                bpath = b[4]
+                if btype == "SCR":
+                    files.append(bpath)
+                elif btype == "TRK":
+                    track_list.append(bpath)
+
+            track_list_aux = []
+            res = True
+            try:
+                for t in track_list:
+                    tb = os.path.splitext(t)[0] + ".BIN"
+                    add_size_header(t, tb)
+                    track_list_aux.append(tb)
+
+                files += track_list_aux
+
+                make_plus3_dsk(
+                    filename=os.path.join(args.output_path, target_name + ".DSK"),
+                    filelist=files,
+                    label=target_name,
+                    disk_720=args.disk_720,
+                    verbose=(verbose >= 1),
+                )
+            except OSError:
+                res = False
+
+            try:
+                for t in track_list_aux:
+                    if os.path.exists(t):
+                        os.remove(t)
+            except OSError:
+                raise CompileError("ERROR: could not create DSK file")
+            finally:
+                if not res:
+                    raise CompileError("ERROR: could not create DSK file")
+
+        ######################################################################
+        if model == "mld" or model == "mld128":
+            print(_(f"{model.upper()} generation completed ({stage_timer})"))
         else:
-            if verbose > 0:
-                print(_("Assembling Spectrum 48k TAP..."))
-            output_name = output_name[:10]
-            do_asm_48(
-                sjasmplus_path=args.sjasmplus_path,
-                output_path=args.output_path,
-                verbose=(verbose >= 1),
-                tap_name=output_name,
-                index=index,
-                blocks=available_banks,
-                banks=spectrum_banks,
-                size_interpreter=asm_size,
-                bank0_offset=bank0_offset,
-                sfx_asm=sfx,
-                tokens=l_tokens,
-                chars=l_chars,
-                charw=l_charw,
-                loading_scr=loading_scr,
-                unused_opcodes=unused_opcodes,
-                pause_start_value=args.pause_after_load,
-                name=output_name,
-            )
-    except ValueError as e1:
-        sys.exit(_("ERROR: Error assembling source."), e1)
-    except OSError as e2:
-        sys.exit(_("ERROR: Error assembling source."), e2)
+            print(_(f"TAP/DSK generation completed ({stage_timer})"))
+        return target_name
 
     ######################################################################
-    if model == "plus3":
-        if verbose > 0:
-            print(_("Assembling PLUS3 disk..."))
-        files = [
-            os.path.join(args.output_path, "DISK"),
-            os.path.join(args.output_path, f"{output_name}.BIN"),
-        ]
-        track_list = []
-        for b in blocks:
-            btype = b[0]
-            bpath = b[4]
-            if btype == "SCR":
-                files.append(bpath)
-            elif btype == "TRK":
-                track_list.append(bpath)
-
-        track_list_aux = []
-        res = True
+
+    scheduler = StageScheduler()
+    scheduler.add("preprocess", preprocess_stage, outputs=("source", "line_map", "source_files"))
+    scheduler.add("parse", parse_stage, ("source", "line_map"), ("parsed_code",))
+    scheduler.add(
+        "texts",
+        texts_stage,
+        ("parsed_code",),
+        ("code", "token_bytes", "text_bytes", "force_slice_texts"),
+        interruptible=True,  # Ctrl-C keeps the best tokens found so far
+    )
+    scheduler.add("opcodes", opcodes_stage, ("parsed_code",), ("unused_opcodes",))
+    # CPU bound, on other processes so they don't wait for the texts, split
+    # in as many groups as jobs
+    num_groups = min(len(screen_jobs), args.jobs if args.jobs > 0 else (os.cpu_count() or 1))
+    compressed_images = []
+    for n in range(num_groups):
+        compressed_images.append(f"compressed_images_{n}")
+        scheduler.add(
+            f"compress_images_{n}",
+            functools.partial(compress_screens, screen_jobs[n::num_groups]),
+            outputs=(compressed_images[-1],),
+            process=True,
+        )
+    scheduler.add("images", images_stage, compressed_images, ("image_blocks",))
+    scheduler.add(
+        "tracks",
+        tracks_stage,
+        outputs=(
+            "track_blocks",
+            "has_tracks",
+            "wyz_instruments",
+            "wyz_tracks",
+            "wyz_tracks_sizes",
+            "track_deps",
+        ),
+    )
+    scheduler.add(
+        "wyz",
+        wyz_stage,
+        ("has_tracks", "wyz_instruments", "wyz_tracks", "wyz_tracks_sizes"),
+        ("wyz_player_bin",),
+    )
+    scheduler.add(
+        "interpreter",
+        interpreter_stage,
+        ("token_bytes", "text_bytes", "has_tracks", "unused_opcodes"),
+        ("interpreter",),
+    )
+    scheduler.add(
+        "layout",
+        layout_stage,
+        (
+            "code",
+            "force_slice_texts",
+            "interpreter",
+            "image_blocks",
+            "track_blocks",
+            "has_tracks",
+            "wyz_player_bin",
+        ),
+        ("index", "available_banks", "spectrum_banks", "bank0_offset", "memory_map"),
+    )
+    scheduler.add(
+        "output",
+        output_stage,
+        (
+            "index",
+            "available_banks",
+            "spectrum_banks",
+            "bank0_offset",
+            "interpreter",
+            "token_bytes",
+            "has_tracks",
+            "unused_opcodes",
+            "image_blocks",
+            "track_blocks",
+        ),
+        ("target_name",),
+    )
+    profile = args.profile_json is not None
+    trace_memory = profile and args.profile_memory and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    if profile:
+        record_external_calls(True)
+    profile_start = (time.perf_counter(), time.process_time())
+    try:
+        stage_values = scheduler.run(
+            profile=profile, cprofile=args.cprofile is not None
+        )
+    except CodegenError as e:
+        raise CompileError(str(e)) from e
+    finally:
+        profile_end = (time.perf_counter(), time.process_time())
+        external_calls = record_external_calls(False)
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    output_name = stage_values["target_name"]
+
+    if profile:
         try:
-            for t in track_list:
-                tb, _ = os.path.splitext(t)
-                tb += ".BIN"
-                add_size_header(t, tb)
-                track_list_aux.append(tb)
-
-            files += track_list_aux
-
-            make_plus3_dsk(
-                filename=os.path.join(args.output_path, output_name + ".DSK"),
-                filelist=files,
-                label=output_name,
-                disk_720=args.disk_720,
-                verbose=(verbose >= 1),
+            write_profile(
+                args.profile_json,
+                args,
+                scheduler,
+                external_calls,
+                profile_end[0] - profile_start[0],
+                profile_end[1] - profile_start[1],
+                peak_memory,
             )
         except OSError:
-            res = False
-
+            raise CompileError(_("ERROR: Can't write the profile file."))
+    if args.cprofile is not None and scheduler.profilers:
+        stats = pstats.Stats(scheduler.profilers[0])
+        for profiler in scheduler.profilers[1:]:
+            stats.add(profiler)
         try:
-            for t in track_list_aux:
-                if os.path.exists(t):
-                    os.remove(tb)
+            stats.dump_stats(args.cprofile)
         except OSError:
-            sys.exit("ERROR: could not create DSK file")
-        finally:
-            if not res:
-                sys.exit("ERROR: could not create DSK file")
+            raise CompileError(_("ERROR: Can't write the cProfile file."))
 
-    ######################################################################
-    if model == "mld" or model == "mld128":
-        print(_(f"{model.upper()} generation completed ({tmp_timer})"))
+    if verbose >= 1:
+        if verbose >= 2:
+            for stage in scheduler.stages:
+                print(
+                    _("Stage %(name)s: %(time).2f s.")
+                    % {"name": stage.name, "time": scheduler.get_duration(stage.name)}
+                )
+        path, seconds = scheduler.get_critical_path()
+        print(
+            _("Critical path: %(path)s (%(time).2f s.)")
+            % {"path": " -> ".join(path), "time": seconds}
+        )
+
+    # Every file read by the build, for the dependencies file
+    dependencies = (
+        stage_values["source_files"] + image_deps + stage_values["track_deps"]
+    )
+
+    if model == "plus3":
+        target = output_name + ".DSK"
+    elif model == "mld" or model == "mld128":
+        target = output_name + ".MLD"
     else:
-        print(_(f"TAP/DSK generation completed ({tmp_timer})"))
+        target = output_name + ".tap"
+
+    for dependency in (
+        args.import_tokens_file,
+        args.update_tokens_file,
+        args.import_charset,
+        args.sfx_asm_file,
+        args.load_scr_file,
+    ):
+        if dependency is not None:
+            dependencies.append(dependency)
+    if args.update_tokens_file is not None:
+        dependencies.append(get_tokens_meta_path(args.update_tokens_file))
+
+    if args.deps_file is not None:
+        # The compiler itself, so a new version rebuilds the adventure
+        compiler_path = os.path.dirname(os.path.abspath(__file__))
+        for compiler_dir in (compiler_path, os.path.join(compiler_path, "cyd")):
+            for name in sorted(os.listdir(compiler_dir)):
+                if name.endswith((".py", ".asm")):
+                    dependencies.append(os.path.join(compiler_dir, name))
+        try:
+            write_deps_file(
+                args.deps_file,
+                [os.path.join(args.output_path, target)],
+                [d for d in dependencies if os.path.exists(d)],
+                command=command,
+                compiler=VERSION,
+            )
+        except OSError:
+            raise CompileError(_("ERROR: Can't write the dependencies file."))
+
+    with open(os.path.join(args.output_path, target), "rb") as f:
+        files = {target: f.read()}
+
     print(_(f"Compilation successful in {timer}"))
-    sys.exit(0)
+    return BuildResult(
+        target=target,
+        files=files,
+        memory_map=stage_values["memory_map"],
+        index=stage_values["index"],
+        interpreter_size=stage_values["interpreter"].size,
+        dependencies=dependencies,
+    )
+
+
+def get_input_paths(args):
+    """
+    Returns the files and directories given on the options of a build.
+
+    Args:
+        args: Options, as returned by the parser of get_arg_parser()
+    """
+    paths = [args.input]
+    if args.images_path is not None:
+        paths += [args.images_path, os.path.join(args.images_path, "images.json")]
+    if args.tracks_path is not None:
+        paths.append(args.tracks_path)
+    for path in (
+        args.import_tokens_file,
+        args.update_tokens_file,
+        args.import_charset,
+        args.sfx_asm_file,
+        args.load_scr_file,
+    ):
+        if path is not None:
+            paths.append(path)
+    return [os.path.abspath(p) for p in paths]
+
+
+def report_error(error):
+    """Prints the messages of a CompileError."""
+    if error.diagnostics:
+        for stage, message in error.diagnostics:
+            emit_error(stage, message)
+    else:
+        print(error.message, file=sys.stderr)
+
+
+def watch(args, command=None, interval=0.5):
+    """
+    Compiles an adventure each time one of its files changes.
+
+    The builds run on this process, so the parsing tables, the assembled
+    interpreters and the compressed texts of the previous build are reused,
+    and only the images that changed are compressed again. Errors are shown
+    and the files are watched again. It never returns, stop it with Ctrl+C.
+
+    Args:
+        args: Options, as returned by the parser of get_arg_parser()
+        command: Arguments of the compiler, stored on the dependencies file
+        interval: Seconds between checks of the files
+    """
+    _ = gettext.gettext
+    watched = get_input_paths(args)
+    while True:
+        try:
+            result = build(args, command)
+            watched = get_input_paths(args) + [os.path.abspath(d) for d in result.dependencies]
+        except CompileError as e:
+            report_error(e)
+        print(_("Waiting for changes (Ctrl+C to stop)..."), flush=True)
+        changed = wait_for_changes(watched, interval)
+        print(
+            _("Changed: %(files)s") % {"files": ", ".join(os.path.basename(p) for p in changed)}
+        )
+
+
+def compile(source, options=None, log=None):
+    """
+    Compiles an adventure on the current process, keeping the files in memory.
+
+    Args:
+        source: Path of the .cyd file
+        options: Dict with the options of the command line, by the name of
+            their long form with underscores (for example "images_path" for
+            --images-path), and "model", "sjasmplus_path" and "output_path".
+            The missing ones take their default values. Without an output
+            path, the files are written on a temporary directory.
+        log: File where the messages are written, by default they are kept
+            on the log attribute of the result or the exception
 
+    Returns:
+        BuildResult
+
+    Raises:
+        CompileError: If the adventure can't be compiled
+        ValueError: If an option doesn't exist
+    """
+    init_gettext()
+    _ = gettext.gettext
+    options = dict(options or {})
+    actions = {a.dest: a for a in get_arg_parser()._actions if a.dest != "help"}
+    values = {dest: action.default for dest, action in actions.items()}
+    values["model"] = "48k"
+    values["input"] = source
+    for key, value in options.items():
+        if key not in actions or key == "input":
+            raise ValueError(f"Unknown option {key}")
+        if isinstance(value, str) and actions[key].type is not None:
+            try:
+                value = actions[key].type(value)
+            except FileNotFoundError as f1:
+                raise CompileError(_("ERROR: File not found:") + f"{f1}") from f1
+            except NotADirectoryError as f2:
+                raise CompileError(_("ERROR: Not a valid path:") + f"{f2}") from f2
+            except (ValueError, argparse.ArgumentTypeError) as e:
+                raise CompileError(_("ERROR: Invalid value of %(option)s.") % {"option": key}) from e
+        values[key] = value
+
+    output = io.StringIO() if log is None else log
+    tmp_dir = None
+    try:
+        if "output_path" not in options:
+            tmp_dir = tempfile.mkdtemp(prefix="cydc_")
+            values["output_path"] = tmp_dir
+        with contextlib.redirect_stdout(output):
+            result = build(argparse.Namespace(**values))
+    except CompileError as e:
+        if log is None:
+            e.log = output.getvalue()
+        raise
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    if log is None:
+        result.log = output.getvalue()
+    return result
+
+
+def main(argv=None):
+    """
+    Main function
+
+    Args:
+        argv: Arguments of the command line (default: sys.argv[1:])
+    """
+
+    if sys.version_info[0] < 3:  # Python 2
+        sys.exit(_("ERROR: Invalid python version"))
+
+    init_gettext()
+    _ = gettext.gettext
+
+    arg_parser = get_arg_parser()
+
+    try:
+        args = arg_parser.parse_args(argv)
+    except FileNotFoundError as f1:
+        sys.exit(_("ERROR: File not found:") + f"{f1}")
+    except NotADirectoryError as f2:
+        sys.exit(_("ERROR: Not a valid path:") + f"{f2}")
+
+    command = sys.argv[1:] if argv is None else list(argv)
+    if args.watch:
+        try:
+            watch(args, command=command)
+        except KeyboardInterrupt:
+            sys.exit(0)
+    try:
+        build(args, command=command)
+    except CompileError as e:
+        if e.diagnostics:
+            for stage, message in e.diagnostics:
+                emit_error(stage, message)
+            sys.exit(1)
+        sys.exit(e.message)
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,379 @@
+# -- coding: utf-8 -*-
+#
+# Choose Your Destiny.
+#
+# Copyright (C) 2025 Sergio Chico <cronomantic@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+# Environment variable that overrides the default cache location.
+CACHE_DIR_ENV = "CYDC_CACHE_DIR"
+
+
+def get_cache_dir(subdir=None):
+    """
+    Returns the directory used by the compiler to store persistent caches.
+
+    The location can be forced with the CYDC_CACHE_DIR environment variable,
+    otherwise the usual per-user cache directory of the platform is used.
+
+    Args:
+        subdir: Optional subdirectory inside the cache directory
+
+    Returns:
+        Absolute path of the cache directory (it may not exist yet)
+    """
+    base = os.environ.get(CACHE_DIR_ENV)
+    if not base:
+        if os.name == "nt":
+            root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        else:
+            root = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+                os.path.expanduser("~"), ".cache"
+            )
+        base = os.path.join(root, "cydc")
+    if subdir:
+        base = os.path.join(base, subdir)
+    return os.path.abspath(base)
+
+
+def write_atomic(path, data):
+    """
+    Writes a file so concurrent readers never see it half written.
+
+    Args:
+        path: Destination file
+        data: Bytes to write
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_pickle(path, version, key):
+    """
+    Loads a cached object written with save_pickle().
+
+    Args:
+        path: Cache file
+        version: Format version expected by the caller
+        key: Key the entry must have been stored with
+
+    Returns:
+        The cached object, or None if missing, stale or unreadable
+    """
+    try:
+        with open(path, "rb") as f:
+            entry = pickle.load(f)
+    except Exception:
+        # Missing, truncated or written by an incompatible version
+        return None
+    if not isinstance(entry, dict):
+        return None
+    if entry.get("version") != version or entry.get("key") != key:
+        return None
+    return entry.get("data")
+
+
+def save_pickle(path, version, key, data):
+    """
+    Stores an object on disk tagged with a format version and a key.
+
+    Failing to write the cache is never an error: it only costs time on the
+    next run.
+
+    Args:
+        path: Cache file
+        version: Format version of the stored data
+        key: Key identifying the inputs used to produce the data
+        data: Object to store
+
+    Returns:
+        True if the entry was written
+    """
+    entry = dict(version=version, key=key, data=data)
+    try:
+        write_atomic(path, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+    except (OSError, pickle.PicklingError):
+        return False
+    return True
+
+
+def hash_files(h, paths):
+    """
+    Feeds the name and contents of each file to a hashlib object.
+
+    Args:
+        h: hashlib object to update
+        paths: Iterable of file paths
+    """
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            h.update(f.read())
+
+
+class BuildCache(object):
+    """
+    Content-addressed store for build artifacts.
+
+    Each entry is a directory named after its key holding one file per
+    artifact. Hits refresh the entry timestamp, and when the total size goes
+    above max_size the least recently used entries are evicted.
+    """
+
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        Returns the artifacts stored with the key.
+
+        Args:
+            key: Hex digest identifying the entry
+
+        Returns:
+            Dictionary of artifact name to bytes, or None on a miss
+        """
+        entry = self._entry_path(key)
+        if not os.path.isdir(entry):
+            return None
+        files = {}
+        try:
+            for name in os.listdir(entry):
+                if name.endswith(".tmp"):
+                    continue
+                with open(os.path.join(entry, name), "rb") as f:
+                    files[name] = f.read()
+            os.utime(entry)
+        except OSError:
+            return None
+        return files
+
+    def put(self, key, files):
+        """
+        Stores the artifacts under the key and evicts old entries.
+
+        Args:
+            key: Hex digest identifying the entry
+            files: Dictionary of artifact name to bytes
+
+        Returns:
+            True if the entry was written
+        """
+        entry = self._entry_path(key)
+        try:
+            for name, data in files.items():
+                write_atomic(os.path.join(entry, name), data)
+            os.utime(entry)
+        except OSError:
+            return False
+        self.evict()
+        return True
+
+    def entries(self):
+        """Returns (mtime, size, path) of every entry, oldest first."""
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                size = 0
+                for f in os.listdir(path):
+                    size += os.path.getsize(os.path.join(path, f))
+                result.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        result.sort()
+        return result
+
+    def evict(self):
+        """Removes the least recently used entries above max_size."""
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for _mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+DEPS_VERSION = 1
+
+
+def _get_file_stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, 0 if os.path.isdir(path) else st.st_size]
+
+
+def write_deps_file(path, targets, dependencies, command=None, compiler=None):
+    """
+    Writes the list of files a build consumed.
+
+    If the name ends with ".json", a manifest with the stamp of each
+    dependency, the command line and the compiler version is written, which
+    deps_are_up_to_date() can check. Otherwise a Make rule is written.
+
+    Args:
+        path: Destination file
+        targets: Files produced by the build
+        dependencies: Files and directories read by the build
+        command: Arguments of the compiler
+        compiler: Version of the compiler
+    """
+    dependencies = list(dict.fromkeys(os.path.abspath(d) for d in dependencies))
+    targets = [os.path.abspath(t) for t in targets]
+    if path.lower().endswith(".json"):
+        manifest = dict(
+            version=DEPS_VERSION,
+            compiler=compiler,
+            command=command,
+            targets=targets,
+            dependencies={d: _get_file_stamp(d) for d in dependencies if os.path.exists(d)},
+        )
+        data = json.dumps(manifest, indent=2)
+    else:
+        def escape(p):
+            return p.replace("\\", "/").replace(" ", "\\ ").replace("$", "$$")
+
+        data = " ".join(escape(t) for t in targets) + ":"
+        data += "".join(f" \\\n  {escape(d)}" for d in dependencies if not os.path.isdir(d))
+        data += "\n"
+    write_atomic(path, data.encode("utf-8"))
+
+
+def deps_are_up_to_date(path, command=None, compiler=None):
+    """
+    Checks a manifest written by write_deps_file() against the disk.
+
+    Args:
+        path: Manifest file
+        command: Arguments of the compiler for the new build
+        compiler: Version of the compiler for the new build, None to skip the check
+
+    Returns:
+        True if the targets exist and no dependency, argument or compiler
+        version changed since the manifest was written
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if not isinstance(manifest, dict) or manifest.get("version") != DEPS_VERSION:
+            return False
+        if manifest.get("command") != command:
+            return False
+        if compiler is not None and manifest.get("compiler") != compiler:
+            return False
+        for target in manifest["targets"]:
+            if not os.path.isfile(target):
+                return False
+        for dependency, stamp in manifest["dependencies"].items():
+            if _get_file_stamp(dependency) != stamp:
+                return False
+    except (OSError, ValueError, KeyError, AttributeError):
+        return False
+    return True
+
+
+def read_deps_file(path):
+    """
+    Returns the dependencies listed on a manifest written by write_deps_file().
+
+    Args:
+        path: Manifest file
+
+    Returns:
+        List of paths, empty if the manifest is missing or not valid
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != DEPS_VERSION:
+            return []
+        return list(manifest["dependencies"])
+    except (OSError, ValueError, KeyError, AttributeError):
+        return []
+
+
+def get_file_stamps(paths):
+    """
+    Returns the stamp of each file or directory, None for the missing ones.
+
+    Args:
+        paths: Iterable of paths
+
+    Returns:
+        Dictionary of path to stamp
+    """
+    stamps = {}
+    for path in paths:
+        try:
+            stamps[path] = _get_file_stamp(path)
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+def wait_for_changes(paths, interval=0.5):
+    """
+    Blocks until a file or directory changes, is created or is removed.
+
+    Once a change is seen, it waits for the stamps to stay the same during
+    an interval, so an editor that saves a file in several writes only
+    causes one rebuild.
+
+    Args:
+        paths: Iterable of paths to watch
+        interval: Seconds between checks
+
+    Returns:
+        List of the paths that changed
+    """
+    paths = list(dict.fromkeys(paths))
+    stamps = get_file_stamps(paths)
+    current = stamps
+    while current == stamps:
+        time.sleep(interval)
+        current = get_file_stamps(paths)
+    while True:
+        time.sleep(interval)
+        latest = get_file_stamps(paths)
+        if latest == current:
+            break
+        current = latest
+    return [p for p in paths if current[p] != stamps[p]]
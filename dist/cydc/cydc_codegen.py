@@ -17,9 +17,67 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys
 from cydc_font import CydcFont
 
+# Longest text made by joining others
+MAX_MERGED_TEXT = 256
+
+# Operations on the stack calculated on compile time, p1 is the value pushed
+# first. They give the same results as the interpreter.
+_BINARY_OPERATIONS = {
+    "ADD": lambda p1, p2: min(p1 + p2, 0xFF),
+    "SUB": lambda p1, p2: max(p1 - p2, 0),
+    "AND": lambda p1, p2: p1 & p2,
+    "OR": lambda p1, p2: p1 | p2,
+    "CP_EQ": lambda p1, p2: int(p1 == p2),
+    "CP_NE": lambda p1, p2: int(p1 != p2),
+    "CP_LE": lambda p1, p2: int(p1 <= p2),
+    "CP_ME": lambda p1, p2: int(p1 >= p2),
+    "CP_LT": lambda p1, p2: int(p1 < p2),
+    "CP_MT": lambda p1, p2: int(p1 > p2),
+    "SHIFT_L": lambda p1, p2: (p1 << p2) & 0xFF,
+    "SHIFT_R": lambda p1, p2: p1 >> p2,
+}
+_UNARY_OPERATIONS = {
+    "NOT": lambda p1: p1 ^ 1,
+    "NOT_B": lambda p1: p1 ^ 0xFF,
+}
+
+# Instructions that take their parameter from the stack, and the ones with
+# it on the code after a PUSH_D or a PUSH_I
+_POP_FUSIONS = {
+    "POP_INK": ("INK_D", "INK_I"),
+    "POP_PAPER": ("PAPER_D", "PAPER_I"),
+    "POP_BORDER": ("BORDER_D", "BORDER_I"),
+    "POP_BRIGHT": ("BRIGHT_D", "BRIGHT_I"),
+    "POP_FLASH": ("FLASH_D", "FLASH_I"),
+    "POP_PRINT": ("PRINT_D", "PRINT_I"),
+    "POP_CHAR": ("CHAR_D", "CHAR_I"),
+    "POP_PICTURE": ("PICTURE_D", "PICTURE_I"),
+    "POP_DISPLAY": ("DISPLAY_D", "DISPLAY_I"),
+    "POP_SFX": ("SFX_D", "SFX_I"),
+    "POP_TRACK": ("TRACK_D", "TRACK_I"),
+    "POP_PLAY": ("PLAY_D", "PLAY_I"),
+    "POP_LOOP": ("LOOP_D", "LOOP_I"),
+}
+
+# Instructions that take several parameters from the stack, and the ones
+# with the last of them on the code after that many PUSH_D, tried in order
+_STACK_FUSIONS = {
+    "POP_MENUCONFIG": ((4, "MENUCONFIG"),),
+    "POP_AT": ((2, "AT"),),
+    "POP_FILLATTR": ((5, "FILLATTR"),),
+    "POP_ALL_PUTATTR": ((4, "PUTATTR"), (2, "POP_PUTATTR")),
+    "POP_ALL_BLIT": ((6, "BLIT"), (4, "POP_BLIT")),
+}
+
+# Instructions that only set the colors or the position
+_SETTINGS = {"INK_D": "INK", "PAPER_D": "PAPER", "AT": "AT"}
+
+
+class CodegenError(Exception):
+    """Error in the code that stops its generation."""
+
 
 class CydcCodegen(object):
     BANK_SIZE = 16 * 1024
@@ -159,10 +217,14 @@ class CydcCodegen(object):
         self.symbols = {}
         self.variables = {}
         self.constants = {}
+        self.constants_key = None
         self.code = []
+        self.pieces = []
+        self.slice_text = False
         self.bank_offset_list = [0xC000]
         self.bank_size_list = [16 * 1024]
         self.optimize = True
+        self.optimizer_stats = []
 
     def set_bank_offset_list(self, offset_list):
         if offset_list is not None:
@@ -172,51 +234,23 @@ class CydcCodegen(object):
         if size_list is not None:
             self.bank_size_list = size_list
 
-    def constant_calculation(self, constants, is_word=False):
+    def constant_calculation(self, constants, is_word=False, lines=None):
+        lines = lines or {}
+        # Kept for the next calls with the same declarations
+        key = tuple((k, tuple(v)) for (k, v) in constants.items())
+        if key == self.constants_key:
+            return dict(self.constants)
         f_constants = {}
-        while len(constants) > 0:
-            tmp_const = constants.copy()
-            # Get flattened constants (without reference to other constants)
-            for k in constants.keys():
-                is_flattened = True
-                for c in constants[k]:
-                    if isinstance(c, tuple):
-                        if c[0] == "C_REPL":
-                            is_flattened = False
-                    else:
-                        sys.exit(self._(f"ERROR: Invalid constant {k}!"))
-                if is_flattened:
-                    c = tmp_const.pop(k)
-                    f_constants[k] = c
-            constants = tmp_const
-            # Replace references on non flattened constants
-            for k in constants.keys():
-                l = []
-                for c in constants[k]:
-                    if isinstance(c, tuple):
-                        if c[0] == "C_REPL":
-                            k2 = c[1]
-                            v2 = f_constants.get(k2)
-                            if v2 is None:  # Non flattened reference found
-                                l.append(c)
-                            elif isinstance(v2, list):
-                                l += v2
-                            else:
-                                l.append(v2)
-                        else:
-                            l.append(c)
-                    else:
-                        sys.exit(self._(f"ERROR: Invalid constant {k}, {c}!"))
-                constants[k] = l
-
-        # Calculate constants
-        for k in f_constants.keys():
+        # Each constant is calculated after the ones it references
+        for k in self._sort_constants(constants, lines):
             stack = []
-            for c in f_constants[k]:
+            for c in constants[k]:
                 if isinstance(c, tuple) and len(c) in range(1, 3):
                     op = c[0]
                     try:
-                        if op == "C_VAL":
+                        if op == "C_REPL":
+                            stack.append(f_constants[c[1]])
+                        elif op == "C_VAL":
                             stack.append(c[1])
                         elif op == "C_+":
                             b = stack.pop()
@@ -251,31 +285,93 @@ class CydcCodegen(object):
                             a = stack.pop()
                             stack.append(a >> b)
                         else:
-                            sys.exit(self._(f"ERROR: Invalid constant {k}, {op}!"))
+                            raise CodegenError(self._(f"ERROR: Invalid constant {k}, {op}!"))
                     except IndexError:
-                        sys.exit(
+                        raise CodegenError(
                             self._(f"ERROR: Invalid constant operation {k}, {op}!")
                         )
                 else:
-                    sys.exit(self._(f"ERROR: Invalid constant {k}, {c}!"))
+                    raise CodegenError(self._(f"ERROR: Invalid constant {k}, {c}!"))
             if len(stack) != 1:
-                sys.exit(self._(f"ERROR: Invalid constant operation {k}!"))
+                raise CodegenError(self._(f"ERROR: Invalid constant operation {k}!"))
             else:
                 c = stack.pop()
                 if isinstance(c, int):
                     if c >= 0:
                         f_constants[k] = c
                     else:
-                        sys.exit(
+                        raise CodegenError(
                             self._(
                                 f"ERROR: Invalid constant value {k}, must not be negative!"
                             )
                         )
                 else:
-                    sys.exit(self._(f"ERROR: Invalid constant value {k}, {c}!"))
+                    raise CodegenError(self._(f"ERROR: Invalid constant value {k}, {c}!"))
+        self.constants_key = key
+        self.constants = dict(f_constants)
         return f_constants
 
-    def constant_expression_calculation(self, expression, constants, is_word=False):
+    def _sort_constants(self, constants, lines):
+        """Sorts the constants after the ones they reference, rejecting cycles."""
+
+        def location(k):
+            # Line number, or location formatted by the parser ("file.cyd:42")
+            line = lines.get(k)
+            if line is None:
+                return k
+            elif isinstance(line, int):
+                return self._("{k} (line {line})").format(k=k, line=line)
+            return f"{k} ({line})"
+
+        references = {}
+        for k, expression in constants.items():
+            references[k] = []
+            for c in expression:
+                if not isinstance(c, tuple):
+                    raise CodegenError(self._(f"ERROR: Invalid constant {k}, {c}!"))
+                if c[0] == "C_REPL":
+                    if c[1] not in constants:
+                        raise CodegenError(
+                            self._(
+                                "ERROR: Constant {constant} used on {location} does not exists!"
+                            ).format(constant=c[1], location=location(k))
+                        )
+                    references[k].append(c[1])
+
+        # Depth-first search without recursion, long chains are common
+        order = []
+        visiting = set()
+        visited = set()
+        for root in constants:
+            if root in visited:
+                continue
+            stack = [(root, iter(references[root]))]
+            visiting.add(root)
+            while stack:
+                (k, pending) = stack[-1]
+                for k2 in pending:
+                    if k2 in visiting:
+                        path = [c for (c, _) in stack]
+                        path = path[path.index(k2) :] + [k2]
+                        raise CodegenError(
+                            self._("ERROR: Circular reference on constants: {path}!").format(
+                                path=" -> ".join(location(c) for c in path)
+                            )
+                        )
+                    if k2 not in visited:
+                        visiting.add(k2)
+                        stack.append((k2, iter(references[k2])))
+                        break
+                else:
+                    stack.pop()
+                    visiting.discard(k)
+                    visited.add(k)
+                    order.append(k)
+        return order
+
+    def constant_expression_calculation(self, expression, constants=None, is_word=False):
+        if constants is None:
+            constants = self.constants
         stack = []
         for c in expression:
             if isinstance(c, tuple) and len(c) in range(1, 3):
@@ -286,7 +382,7 @@ class CydcCodegen(object):
                         if a is not None:
                             stack.append(a)
                         else:
-                            sys.exit(self._(f"ERROR: Constant {c[1]} does not exists!"))
+                            raise CodegenError(self._(f"ERROR: Constant {c[1]} does not exists!"))
                     elif op == "C_VAL":
                         stack.append(c[1])
                     elif op == "C_+":
@@ -322,15 +418,15 @@ class CydcCodegen(object):
                         a = stack.pop()
                         stack.append(a >> b)
                     else:
-                        sys.exit(self._(f"ERROR: Invalid constant expression, {op}!"))
+                        raise CodegenError(self._(f"ERROR: Invalid constant expression, {op}!"))
                 except IndexError:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Invalid constant expression operation {op}!")
                     )
             else:
-                sys.exit(self._(f"ERROR: Invalid constant expression {c}!"))
+                raise CodegenError(self._(f"ERROR: Invalid constant expression {c}!"))
         if len(stack) != 1:
-            sys.exit(self._(f"ERROR: Invalid constant expression operation!"))
+            raise CodegenError(self._(f"ERROR: Invalid constant expression operation!"))
         else:
             c = stack.pop()
             if isinstance(c, int):
@@ -338,7 +434,7 @@ class CydcCodegen(object):
                     if c in range(0, 1 << 16) and is_word:
                         return c
                     else:
-                        sys.exit(
+                        raise CodegenError(
                             self._(
                                 f"ERROR: Invalid constant expression value {c} is not a word!"
                             )
@@ -347,17 +443,18 @@ class CydcCodegen(object):
                     if c in range(0, 1 << 8):
                         return c
                     else:
-                        sys.exit(
+                        raise CodegenError(
                             self._(
                                 f"ERROR: Invalid constant expression value {c} is not a byte!"
                             )
                         )
             else:
-                sys.exit(self._(f"ERROR: Invalid constant expression value {c}!"))
+                raise CodegenError(self._(f"ERROR: Invalid constant expression value {c}!"))
 
     def code_extract_declarations(self, code):
         variables = {}
         constants = {}
+        constant_lines = {}
         arrays = {}
         labels = {}
         code_tmp = []
@@ -367,74 +464,76 @@ class CydcCodegen(object):
                 p = t[2]  # get value
                 q = t[1]  # get symbol
                 if variables.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Constant {q} is already declared as variable")
                     )
                 elif labels.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Variable {q} is already declared as label")
                     )
                 elif arrays.get(q) is not None:
-                    sys.exit(self._(f"ERROR: Label {q} is already declared as array"))
+                    raise CodegenError(self._(f"ERROR: Label {q} is already declared as array"))
                 elif constants.get(q) is None:
                     constants[q] = p  # Add to cosntants table
+                    if len(t) > 3:
+                        constant_lines[q] = t[3]
                 else:
-                    sys.exit(self._(f"ERROR: Constant {q} declared two times!"))
+                    raise CodegenError(self._(f"ERROR: Constant {q} declared two times!"))
             elif opcode == "DECLARE":
                 p = t[1]  # get variable number
                 q = t[2]  # get symbol
                 if constants.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Variable {q} is already declared as constant")
                     )
                 elif labels.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Variable {q} is already declared as label")
                     )
                 elif arrays.get(q) is not None:
-                    sys.exit(self._(f"ERROR: Label {q} is already declared as array"))
+                    raise CodegenError(self._(f"ERROR: Label {q} is already declared as array"))
                 elif variables.get(q) is None:
                     variables[q] = p  # Add to variable table
                 else:
-                    sys.exit(self._(f"ERROR: Variable {q} declared two times!"))
+                    raise CodegenError(self._(f"ERROR: Variable {q} declared two times!"))
             elif opcode == "ARRAY":
                 p = t[2]  # get constant list
                 q = t[1]  # get symbol
                 if variables.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Array {q} is already declared as variable")
                     )
                 elif labels.get(q) is not None:
-                    sys.exit(self._(f"ERROR: Array {q} is already declared as label"))
+                    raise CodegenError(self._(f"ERROR: Array {q} is already declared as label"))
                 elif constants.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Array {q} is already declared as constant")
                     )
                 elif arrays.get(q) is None:
                     arrays[q] = 0
                     code_tmp.append(t)
                 else:
-                    sys.exit(self._(f"ERROR: Array {q} declared two times!"))
+                    raise CodegenError(self._(f"ERROR: Array {q} declared two times!"))
             elif opcode == "LABEL":
                 q = t[1]  # get symbol
                 if variables.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Label {q} is already declared as variable")
                     )
                 elif constants.get(q) is not None:
-                    sys.exit(
+                    raise CodegenError(
                         self._(f"ERROR: Label {q} is already declared as constant")
                     )
                 elif arrays.get(q) is not None:
-                    sys.exit(self._(f"ERROR: Label {q} is already declared as array"))
+                    raise CodegenError(self._(f"ERROR: Label {q} is already declared as array"))
                 elif labels.get(q) is None:
                     labels[q] = 0  # Add to symbol table
                     code_tmp.append(t)
                 else:
-                    sys.exit(self._(f"ERROR: Label {q} declared two times!"))
+                    raise CodegenError(self._(f"ERROR: Label {q} declared two times!"))
             else:  # Append any other code
                 code_tmp.append(t)
-        constants = self.constant_calculation(constants)
+        constants = self.constant_calculation(constants, lines=constant_lines)
         code = []
         for instruction in code_tmp:
             if (
@@ -453,9 +552,9 @@ class CydcCodegen(object):
                     elif instruction[2] is None:
                         array_len = len(instruction[3])
                     else:
-                        sys.exit(self._(f"ERROR: Invalid array declaration"))
+                        raise CodegenError(self._(f"ERROR: Invalid array declaration"))
                     if array_len not in range(1, 257):
-                        sys.exit(
+                        raise CodegenError(
                             self._(
                                 f"ERROR: The array {instruction[1]} has an invalid size."
                             )
@@ -474,13 +573,13 @@ class CydcCodegen(object):
                                 )
                             )
                         else:
-                            sys.exit(
+                            raise CodegenError(
                                 self._(
                                     f"ERROR: Invalid array declaration {instruction[1]}"
                                 )
                             )
                     if len(lc) > array_len:
-                        sys.exit(
+                        raise CodegenError(
                             self._(
                                 f"ERROR: The array {instruction[1]} is too small for the supplied initialization data."
                             )
@@ -489,7 +588,7 @@ class CydcCodegen(object):
                         lc += [0 for x in range(array_len - len(lc))]
                     tup = (instruction[0], instruction[1], lc)
                 else:
-                    sys.exit(self._(f"ERROR: Invalid array declaration"))
+                    raise CodegenError(self._(f"ERROR: Invalid array declaration"))
             else:
                 tup = ()
                 for c in instruction:
@@ -504,11 +603,11 @@ class CydcCodegen(object):
                                 t = variables.get(c)
                                 if t is None:
                                     # print(variables)
-                                    sys.exit(
+                                    raise CodegenError(
                                         self._(f"ERROR: Variable {c} does not exists!")
                                     )
                                 elif (t + disp) not in range(256):
-                                    sys.exit(
+                                    raise CodegenError(
                                         self._(
                                             f"ERROR: Multiple assignation of variable {c} is out of bounds!"
                                         )
@@ -548,6 +647,75 @@ class CydcCodegen(object):
         return (code, variables, constants)
 
     def code_simple_optimize(self, code):
+        # Each pass returns the code with its changes, and all of them are
+        # run again while any of them keeps finding something.
+        passes = [
+            ("constant folding", self.code_fold_constants),
+            ("instruction fusion", self.code_fuse_instructions),
+            ("jump threading", self.code_thread_jumps),
+            ("dead code", self.code_remove_dead_code),
+            ("unused labels", self.code_remove_unused_labels),
+            ("redundant settings", self.code_remove_redundant_settings),
+            ("text merging", self.code_merge_texts),
+        ]
+        stats = {name: [0, 0] for name, _ in passes}
+        run = True
+        while run:
+            run = False
+            for name, optimization in passes:
+                code_tmp = optimization(code)
+                if code_tmp != code:
+                    stats[name][0] += len(code) - len(code_tmp)
+                    stats[name][1] += self._code_size(code) - self._code_size(code_tmp)
+                    code = code_tmp
+                    run = True
+        self.optimizer_stats = [(name, s[0], s[1]) for name, s in stats.items()]
+
+        # Append an END just in case...
+        if len(code) == 0 or code[-1][0] != "END":
+            code.append(("END",))
+        return code
+
+    def _code_size(self, code):
+        size = 0
+        for c in code:
+            if c[0] == "TEXT":
+                size += len(c[1]) + 1
+            elif c[0] == "ARRAY":
+                size += len(c[2]) + 2
+            elif c[0] != "LABEL":
+                size += len(c)
+        return size
+
+    def code_fold_constants(self, code):
+        code_tmp = []
+        for c in code:
+            operation = _BINARY_OPERATIONS.get(c[0])
+            if operation is not None and self._pushed_constants(code_tmp, 2):
+                p2 = code_tmp.pop()[1]
+                p1 = code_tmp.pop()[1]
+                code_tmp.append(("PUSH_D", operation(p1, p2)))
+            elif c[0] in _UNARY_OPERATIONS and self._pushed_constants(code_tmp, 1):
+                p1 = code_tmp.pop()[1]
+                code_tmp.append(("PUSH_D", _UNARY_OPERATIONS[c[0]](p1)))
+            elif c[0] in ("IF_GOTO", "IF_N_GOTO") and self._pushed_constants(code_tmp, 1):
+                # The jump is always or never taken
+                p1 = code_tmp.pop()[1]
+                if (p1 != 0) == (c[0] == "IF_GOTO"):
+                    code_tmp.append(("GOTO",) + c[1:])
+            else:
+                code_tmp.append(c)
+        return code_tmp
+
+    def _pushed_constants(self, code, num):
+        if len(code) < num:
+            return False
+        for c in code[len(code) - num :]:
+            if c[0] != "PUSH_D" or not isinstance(c[1], int) or c[1] not in range(256):
+                return False
+        return True
+
+    def code_fuse_instructions(self, code):
         code_tmp = []
         skip = False
         for i, c in enumerate(code):
@@ -589,313 +757,154 @@ class CydcCodegen(object):
                         c = ("PUSH_I", c[1])
                         skip = True
                     code_tmp.append(c)
-                elif next[0] == "POP_INK":
-                    if c[0] == "PUSH_D":
-                        c = ("INK_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("INK_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_PAPER":
-                    if c[0] == "PUSH_D":
-                        c = ("PAPER_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("PAPER_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_BORDER":
-                    if c[0] == "PUSH_D":
-                        c = ("BORDER_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("BORDER_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_BRIGHT":
-                    if c[0] == "PUSH_D":
-                        c = ("BRIGHT_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("BRIGHT_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_FLASH":
-                    if c[0] == "PUSH_D":
-                        c = ("FLASH_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("FLASH_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_PRINT":
-                    if c[0] == "PUSH_D":
-                        c = ("PRINT_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("PRINT_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_CHAR":
-                    if c[0] == "PUSH_D":
-                        c = ("CHAR_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("CHAR_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_PICTURE":
-                    if c[0] == "PUSH_D":
-                        c = ("PICTURE_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("PICTURE_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_DISPLAY":
-                    if c[0] == "PUSH_D":
-                        c = ("DISPLAY_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("DISPLAY_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_SFX":
-                    if c[0] == "PUSH_D":
-                        c = ("SFX_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("SFX_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_TRACK":
-                    if c[0] == "PUSH_D":
-                        c = ("TRACK_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("TRACK_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_PLAY":
-                    if c[0] == "PUSH_D":
-                        c = ("PLAY_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("PLAY_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
-                elif next[0] == "POP_LOOP":
-                    if c[0] == "PUSH_D":
-                        c = ("LOOP_D", c[1])
-                        skip = True
-                    elif c[0] == "PUSH_I":
-                        c = ("LOOP_I", c[1])
-                        skip = True
-                    code_tmp.append(c)
                 elif next[0] == "IF_N_GOTO":
                     if c[0] == "NOT":
-                        c = ("IF_GOTO", next[1], next[3])
+                        c = ("IF_GOTO", next[1], next[2], next[3])
                         skip = True
                     code_tmp.append(c)
+                elif next[0] in _POP_FUSIONS and c[0] in ("PUSH_D", "PUSH_I"):
+                    c = (_POP_FUSIONS[next[0]][c[0] == "PUSH_I"], c[1])
+                    skip = True
+                    code_tmp.append(c)
                 else:
                     code_tmp.append(c)
             else:
                 code_tmp.append(c)
-        # MENUCONFIG
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 5:
-                for i in range(4, len(code_tmp)):
-                    t0 = code_tmp[i - 4]
-                    t1 = code_tmp[i - 3]
-                    t2 = code_tmp[i - 2]
-                    t3 = code_tmp[i - 1]
-                    t4 = code_tmp[i]
-                    if (
-                        t4[0] == "POP_MENUCONFIG"
-                        and t3[0] == "PUSH_D"
-                        and t2[0] == "PUSH_D"
-                        and t1[0] == "PUSH_D"
-                        and t0[0] == "PUSH_D"
-                    ):
-                        l = []
-                        if (i - 4) > 0:
-                            l += code_tmp[: i - 4]
-                        l.append(("MENUCONFIG", t0[1], t1[1], t2[1], t3[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
-        # AT
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 3:
-                for i in range(2, len(code_tmp)):
-                    t0 = code_tmp[i - 2]
-                    t1 = code_tmp[i - 1]
-                    t2 = code_tmp[i]
-                    if t2[0] == "POP_AT" and t1[0] == "PUSH_D" and t0[0] == "PUSH_D":
-                        l = []
-                        if (i - 2) > 0:
-                            l += code_tmp[: i - 2]
-                        l.append(("AT", t0[1], t1[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
-        # FILLATTR
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 6:
-                for i in range(5, len(code_tmp)):
-                    t0 = code_tmp[i - 5]
-                    t1 = code_tmp[i - 4]
-                    t2 = code_tmp[i - 3]
-                    t3 = code_tmp[i - 2]
-                    t4 = code_tmp[i - 1]
-                    t5 = code_tmp[i]
-                    if (
-                        t5[0] == "POP_FILLATTR"
-                        and t4[0] == "PUSH_D"
-                        and t3[0] == "PUSH_D"
-                        and t2[0] == "PUSH_D"
-                        and t1[0] == "PUSH_D"
-                        and t0[0] == "PUSH_D"
-                    ):
-                        l = []
-                        if (i - 5) > 0:
-                            l += code_tmp[: i - 5]
-                        l.append(("FILLATTR", t0[1], t1[1], t2[1], t3[1], t4[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
-        # PUTATTR
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 5:
-                for i in range(4, len(code_tmp)):
-                    t0 = code_tmp[i - 4]
-                    t1 = code_tmp[i - 3]
-                    t2 = code_tmp[i - 2]
-                    t3 = code_tmp[i - 1]
-                    t4 = code_tmp[i]
-                    if (
-                        t4[0] == "POP_ALL_PUTATTR"
-                        and t3[0] == "PUSH_D"
-                        and t2[0] == "PUSH_D"
-                        and t1[0] == "PUSH_D"
-                        and t0[0] == "PUSH_D"
-                    ):
-                        l = []
-                        if (i - 4) > 0:
-                            l += code_tmp[: i - 4]
-                        l.append(("PUTATTR", t0[1], t1[1], t2[1], t3[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
-        # POP_PUTATTR
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 3:
-                for i in range(2, len(code_tmp)):
-                    t0 = code_tmp[i - 2]
-                    t1 = code_tmp[i - 1]
-                    t2 = code_tmp[i]
-                    if (
-                        t2[0] == "POP_ALL_PUTATTR"
-                        and t1[0] == "PUSH_D"
-                        and t0[0] == "PUSH_D"
-                    ):
-                        l = []
-                        if (i - 2) > 0:
-                            l += code_tmp[: i - 2]
-                        l.append(("POP_PUTATTR", t0[1], t1[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
-        # BLIT
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 7:
-                for i in range(6, len(code_tmp)):
-                    t0 = code_tmp[i - 6]
-                    t1 = code_tmp[i - 5]
-                    t2 = code_tmp[i - 4]
-                    t3 = code_tmp[i - 3]
-                    t4 = code_tmp[i - 2]
-                    t5 = code_tmp[i - 1]
-                    t6 = code_tmp[i]
-                    if (
-                        t6[0] == "POP_ALL_BLIT"
-                        and t5[0] == "PUSH_D"
-                        and t4[0] == "PUSH_D"
-                        and t3[0] == "PUSH_D"
-                        and t2[0] == "PUSH_D"
-                        and t1[0] == "PUSH_D"
-                        and t0[0] == "PUSH_D"
-                    ):
-                        l = []
-                        if (i - 6) > 0:
-                            l += code_tmp[: i - 6]
-                        l.append(("BLIT", t0[1], t1[1], t2[1], t3[1], t4[1], t5[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
-        # POP_BLIT
-        run = True
-        while run:
-            run = False
-            if len(code_tmp) >= 5:
-                for i in range(4, len(code_tmp)):
-                    t0 = code_tmp[i - 4]
-                    t1 = code_tmp[i - 3]
-                    t2 = code_tmp[i - 2]
-                    t3 = code_tmp[i - 1]
-                    t4 = code_tmp[i]
-                    if (
-                        t4[0] == "POP_ALL_BLIT"
-                        and t3[0] == "PUSH_D"
-                        and t2[0] == "PUSH_D"
-                        and t1[0] == "PUSH_D"
-                        and t0[0] == "PUSH_D"
-                    ):
-                        l = []
-                        if (i - 4) > 0:
-                            l += code_tmp[: i - 4]
-                        l.append(("POP_BLIT", t0[1], t1[1], t2[1], t3[1]))
-                        if (i + 1) < len(code_tmp):
-                            l += code_tmp[i + 1 :]
-                        code_tmp = l
-                        run = True
-                        break
+        # MENUCONFIG, AT, FILLATTR, PUTATTR, BLIT...
+        code = code_tmp
+        code_tmp = []
+        for c in code:
+            for num, opcode in _STACK_FUSIONS.get(c[0], ()):
+                if len(code_tmp) >= num and all(
+                    p[0] == "PUSH_D" for p in code_tmp[len(code_tmp) - num :]
+                ):
+                    c = (opcode,) + tuple(p[1] for p in code_tmp[len(code_tmp) - num :])
+                    del code_tmp[len(code_tmp) - num :]
+                    break
+            code_tmp.append(c)
+        return code_tmp
 
-        # Append an END just in case...
-        last_opcode = code_tmp[-1]
-        if last_opcode[0] != "END":
-            code_tmp.append(("END",))
-        # for c in code:
-        #    print(c)
-        # print(code)
-        # print()
-        # for c in code_tmp:
-        #     print(c)
+    def _next_labels(self, code, i):
+        labels = set()
+        while i < len(code) and code[i][0] == "LABEL":
+            labels.add(code[i][1])
+            i += 1
+        return labels
+
+    def code_thread_jumps(self, code):
+        # First instruction after each label
+        targets = {}
+        labels = []
+        for c in code:
+            if c[0] == "LABEL":
+                labels.append(c[1])
+            else:
+                for label in labels:
+                    targets[label] = c
+                labels = []
+
+        def final_label(label):
+            seen = set()
+            t = targets.get(label)
+            while t is not None and t[0] == "GOTO" and label not in seen:
+                seen.add(label)
+                label = t[1]
+                t = targets.get(label)
+            return label
+
+        code_tmp = []
+        i = 0
+        while i < len(code):
+            c = code[i]
+            if c[0] in ("GOTO", "GOSUB", "IF_GOTO", "IF_N_GOTO"):
+                label = final_label(c[1])
+                if c[0] == "GOTO" and ({c[1], label} & self._next_labels(code, i + 1)):
+                    # Jump to the next instruction
+                    i += 1
+                    continue
+                next = code[i + 1] if (i + 1) < len(code) else ("END",)
+                if (
+                    c[0] in ("IF_GOTO", "IF_N_GOTO")
+                    and next[0] == "GOTO"
+                    and ({c[1], label} & self._next_labels(code, i + 2))
+                ):
+                    # Skipping a GOTO is taking it with the opposite condition
+                    opcode = "IF_N_GOTO" if c[0] == "IF_GOTO" else "IF_GOTO"
+                    c = (opcode, final_label(next[1])) + next[2:]
+                    i += 1
+                else:
+                    c = (c[0], label) + c[2:]
+            code_tmp.append(c)
+            i += 1
+        return code_tmp
+
+    def code_remove_dead_code(self, code):
+        # Nothing after END, RETURN or GOTO runs until the next label, but
+        # the arrays are kept.
+        code_tmp = []
+        dead = False
+        for c in code:
+            if c[0] == "LABEL":
+                dead = False
+            if not dead or c[0] == "ARRAY":
+                code_tmp.append(c)
+            if c[0] in ("END", "RETURN", "GOTO"):
+                dead = True
+        return code_tmp
+
+    def code_remove_unused_labels(self, code):
+        references = set()
+        for c in code:
+            if c[0] not in ("LABEL", "ARRAY", "TEXT"):
+                references.update(p for p in c[1:] if isinstance(p, str))
+        return [c for c in code if c[0] != "LABEL" or c[1] in references]
+
+    def code_remove_redundant_settings(self, code):
+        # Known value of the colors and the position, and the last setting
+        # of each one that nothing has used yet, to remove it if it's
+        # replaced. INK 8 and PAPER 8 only set the transparency, so they
+        # don't replace the previous color.
+        code_tmp = []
+        values = {}
+        unused = {}
+        for c in code:
+            setting = _SETTINGS.get(c[0])
+            if setting is not None:
+                value = c[1:]
+                if values.get(setting) == value:
+                    continue
+                if unused.get(setting) is not None and (setting == "AT" or value[0] != 8):
+                    code_tmp[unused[setting]] = None
+                values[setting] = value
+                unused[setting] = len(code_tmp)
+            elif c[0] in ("BRIGHT_D", "BRIGHT_I", "FLASH_D", "FLASH_I"):
+                pass
+            elif c[0] in ("TEXT", "NEWLINE", "PRINT_D", "PRINT_I", "CHAR_D", "CHAR_I"):
+                # Printing uses the settings and moves the position
+                unused = {}
+                values.pop("AT", None)
+            else:
+                unused = {}
+                values = {}
+            code_tmp.append(c)
+        return [c for c in code_tmp if c is not None]
+
+    def code_merge_texts(self, code):
+        # Only after a space, because the interpreter prints each text by
+        # words, and a word split on two texts would be joined.
+        code_tmp = []
+        for c in code:
+            if c[0] == "TEXT" and len(code_tmp) > 0 and code_tmp[-1][0] == "TEXT":
+                previous = code_tmp[-1][1]
+                if (
+                    isinstance(previous, list)
+                    and isinstance(c[1], list)
+                    and previous[-2:] == [255 - ord(" "), 245]
+                    and len(previous) + len(c[1]) <= MAX_MERGED_TEXT
+                ):
+                    code_tmp[-1] = ("TEXT", previous[:-1] + c[1])
+                    continue
+            code_tmp.append(c)
         return code_tmp
 
     def check_code_paramenters(self, code):
@@ -950,127 +959,142 @@ class CydcCodegen(object):
             code_tmp.append(t)
         return code_tmp
 
-    def code_translate(self, code, slice_text=False):
-        code_banks = []
-        code_tmp = []
+    def code_translate(self, code):
+        # Bytes of each instruction, with the references to labels and arrays
+        # left as (position, symbol) so they can be placed on any layout.
+        pieces = []
         labels = {}
         arrays = {}
-        offset = 0
-        bank = 0
         for t in code:
             opcode = t[0]  # get opcode type
             if opcode == "LABEL":
                 q = t[1]  # get symbol
                 if arrays.get(q) is not None:
-                    sys.exit(self._(f"ERROR: Label {q} is already declared as array"))
+                    raise CodegenError(self._(f"ERROR: Label {q} is already declared as array"))
                 elif labels.get(q) is None:
-                    labels[q] = (bank, offset)  # Add to symbol table
+                    labels[q] = 0  # Add to symbol table
+                    pieces.append(("LABEL", q, None))
                 else:
-                    sys.exit(self._(f"ERROR: Label {q} declared two times!"))
+                    raise CodegenError(self._(f"ERROR: Label {q} declared two times!"))
             elif opcode == "ARRAY":
                 p = t[2]  # get constant list
                 q = t[1]  # get symbol
                 if labels.get(q) is not None:
-                    sys.exit(self._(f"ERROR: Array {q} is already declared as label"))
+                    raise CodegenError(self._(f"ERROR: Array {q} is already declared as label"))
                 elif arrays.get(q) is None:
-                    # if we have not space on the current bank, change to the next
-                    if (len(p) + 3 + offset + 4) >= self._get_bank_size(bank):
-                        bank += 1
-                        offset = 0  # reset offset counter
-                        code_tmp += [
-                            self.opcodes["GOTO"],
-                            bank,
-                        ] + self._convert_address(offset, bank)
-                        # Jump to next bank
-                        code_banks.append(code_tmp)  # add new bank
-                        code_tmp = []
-                    arrays[q] = (
-                        bank,
-                        offset + 1,
-                    )  # Add to symbol table (skipping the SKIP_ARRAY opcode)
-                    c = [self.opcodes.get("SKIP_ARRAY"), len(p) - 1] + p
-                    code_tmp += c
-                    offset += len(c)
+                    arrays[q] = 0
+                    pieces.append(("ARRAY", q, [self.opcodes.get("SKIP_ARRAY"), len(p) - 1] + p))
                 else:
-                    sys.exit(self._(f"ERROR: Array {q} declared two times!"))
+                    raise CodegenError(self._(f"ERROR: Array {q} declared two times!"))
             else:
                 # transform to byte representation
                 q = self.opcodes.get(opcode)
                 if q is None:
-                    sys.exit(self._(f"ERROR: Invalid opcode {opcode}!"))
+                    raise CodegenError(self._(f"ERROR: Invalid opcode {opcode}!"))
                 if opcode == "TEXT":
-                    p = t[1]  # Get text
-                    while len(p) > 1:  # A string of less than 1 character is not valid
-                        l = self._get_bank_size(bank) - offset - 5  # remaining size
-                        if len(p) >= l:  # Too big!, we slice it...
-                            # print(f"DEBUG: Text:{len(p)} - space:{l}")
-                            # print(f"DEBUG: Text too big! {self.BANK_SIZE - offset} {len(code_tmp)}")
-                            bank += 1
-                            offset = 0  # reset offset counter
-                            if slice_text and l > 0:
-                                # print(f"DEBUG: Slice! {l-1}")
-                                code_tmp.append(q)
-                                code_tmp += p[0 : l - 1] + [
-                                    245
-                                ]  # Adding end of string character
-                                p = p[l - 1 :]
-                            code_tmp += [
-                                self.opcodes["GOTO"],
-                                bank,
-                            ] + self._convert_address(
-                                offset, bank
-                            )  # adding goto to next bank
-                            code_banks.append(code_tmp)  # add new bank
-                            code_tmp = []
-                        else:
-                            code_tmp.append(q)  # Add opcode
-                            code_tmp += p  # add list of the text
-                            offset += len(p) + 1
-                            p = []
+                    pieces.append(("TEXT", None, t[1]))
                 else:
-                    # if we have not space on the current bank, change to the next
-                    if (len(t) + offset + 4) >= self._get_bank_size(bank):
-                        # print(f"DEBUG: :{len(t) + offset + 4}")
-                        # print("Change bank!")
+                    data = [q] + list(t[1:])
+                    references = []
+                    for i, c in enumerate(data):
+                        if isinstance(c, str):  # Bank and address of a label or array
+                            if data[i + 1 : i + 3] != [0, 0]:
+                                raise CodegenError(
+                                    self._("ERROR: Invalid reference to {c} on {opcode}!").format(
+                                        c=c, opcode=opcode
+                                    )
+                                )
+                            references.append((i, c))
+                    pieces.append(("CODE", references, data))
+        return pieces
+
+    def code_layout(self, pieces, slice_text=False):
+        code_banks = []
+        code_tmp = []
+        symbols = {}
+        fixups = []
+        offset = 0
+        bank = 0
+        for kind, value, data in pieces:
+            if kind == "LABEL":
+                symbols[value] = (bank, offset)
+            elif kind == "ARRAY":
+                # if we have not space on the current bank, change to the next
+                if (len(data) + 1 + offset + 4) >= self._get_bank_size(bank):
+                    bank += 1
+                    offset = 0  # reset offset counter
+                    code_tmp += [
+                        self.opcodes["GOTO"],
+                        bank,
+                    ] + self._convert_address(offset, bank)
+                    # Jump to next bank
+                    code_banks.append(code_tmp)  # add new bank
+                    code_tmp = []
+                # Skipping the SKIP_ARRAY opcode
+                symbols[value] = (bank, offset + 1)
+                code_tmp += data
+                offset += len(data)
+            elif kind == "TEXT":
+                q = self.opcodes["TEXT"]
+                p = data
+                while len(p) > 1:  # A string of less than 1 character is not valid
+                    l = self._get_bank_size(bank) - offset - 5  # remaining size
+                    if len(p) >= l:  # Too big!, we slice it...
                         bank += 1
                         offset = 0  # reset offset counter
+                        if slice_text and l > 0:
+                            code_tmp.append(q)
+                            code_tmp += p[0 : l - 1] + [
+                                245
+                            ]  # Adding end of string character
+                            p = p[l - 1 :]
                         code_tmp += [
                             self.opcodes["GOTO"],
                             bank,
-                        ] + self._convert_address(offset, bank)
-                        # Jump to next bank
+                        ] + self._convert_address(
+                            offset, bank
+                        )  # adding goto to next bank
                         code_banks.append(code_tmp)  # add new bank
                         code_tmp = []
-                    code_tmp.append(q)  # append opcode byte
-                    q = list(t)  # transform tuple on list
-                    code_tmp += q[1:]  # add the rest of parameters
-                    offset += len(t)  # Add new length
+                    else:
+                        code_tmp.append(q)  # Add opcode
+                        code_tmp += p  # add list of the text
+                        offset += len(p) + 1
+                        p = []
+            else:
+                # if we have not space on the current bank, change to the next
+                if (len(data) + offset + 4) >= self._get_bank_size(bank):
+                    bank += 1
+                    offset = 0  # reset offset counter
+                    code_tmp += [
+                        self.opcodes["GOTO"],
+                        bank,
+                    ] + self._convert_address(offset, bank)
+                    # Jump to next bank
+                    code_banks.append(code_tmp)  # add new bank
+                    code_tmp = []
+                for i, symbol in value:
+                    fixups.append((len(code_banks), len(code_tmp) + i, symbol))
+                code_tmp += data
+                offset += len(data)
         if len(code_tmp) > 0:
             code_banks.append(code_tmp)
-        return (code_banks, labels | arrays)
+        self.symbol_replacement(code_banks, fixups, symbols)
+        return (code_banks, symbols)
 
-    def symbol_replacement(self, code, symbols):
-        code_tmp = []
-        queue = []
-        for c in code:
-            if len(queue) > 0 and c == 0:
-                c = queue.pop()
-            elif isinstance(c, str):  # Merged labels & arrays
-                t = symbols.get(c)
-                if t is None:
-                    sys.exit(self._(f"ERROR: Label {c} does not exists!"))
-                else:  # label found
-                    c = t[0]  # Extract bank
-                    queue = self._convert_address(
-                        t[1], c
-                    )  # Convert offset to bank address
-                    queue.reverse()
-            code_tmp.append(c)
-        return code_tmp
+    def symbol_replacement(self, code_banks, fixups, symbols):
+        for bank, position, symbol in fixups:
+            t = symbols.get(symbol)
+            if t is None:
+                raise CodegenError(self._("ERROR: Label {c} does not exists!").format(c=symbol))
+            # Bank and address of the label
+            code_banks[bank][position : position + 3] = [t[0]] + self._convert_address(
+                t[1], t[0]
+            )
 
     def _word_to_list(self, value):
         if value > 0xFFFF:
-            sys.exit(self._("ERROR: Invalid offset"))
+            raise CodegenError(self._("ERROR: Invalid offset"))
         return [(value & 0xFF), ((value >> 8) & 0xFF)]
 
     def _convert_address(self, address, bank=None):
@@ -1092,7 +1116,7 @@ class CydcCodegen(object):
 
     def _get_index_offset(self, idx, offset):
         if offset > 0x7FFFFF:  # Max 8 Mb
-            sys.exit(self._("ERROR: Invalid offset"))
+            raise CodegenError(self._("ERROR: Invalid offset"))
         hl = (offset >> 16) & 0xFF
         lh = (offset >> 8) & 0xFF
         ll = offset & 0xFF
@@ -1126,7 +1150,16 @@ class CydcCodegen(object):
         return (col, width)
 
     def generate_code(self, code, slice_text=False, show_debug=False):
+        self.translate_code(code, slice_text, show_debug)
+        return self.layout_code()
 
+    def translate_code(self, code, slice_text=False, show_debug=False):
+        """
+        Translates the code to bytes, before knowing where it will be placed.
+
+        Only needs to be done once, layout_code() places the result on the
+        banks set with set_bank_offset_list() and set_bank_size_list().
+        """
         (code, self.variables, self.constants) = self.code_extract_declarations(code)
         if show_debug:
             print("\nConstants resolved:\n-------------------")
@@ -1135,8 +1168,13 @@ class CydcCodegen(object):
         if code is None or len(code) == 0:
             code = [("END",)]
 
+        self.optimizer_stats = []
         if self.optimize:
             code = self.code_simple_optimize(code)
+            if show_debug:
+                print("\nOptimizer passes:\n-------------------")
+                for name, instructions, size in self.optimizer_stats:
+                    print(f"{name}: {instructions} instructions, {size} bytes")
 
         if show_debug:
             print("\nVirtual machine opcode:\n-------------------")
@@ -1144,9 +1182,17 @@ class CydcCodegen(object):
                 print(c)
 
         self.code = self.check_code_paramenters(self.code)
-        (code, self.symbols) = self.code_translate(code, slice_text)
+        self.pieces = self.code_translate(code)
+        self.slice_text = slice_text
+
+    def layout_code(self):
+        """
+        Places the translated code on the banks.
 
-        self.code = [self.symbol_replacement(c, self.symbols) for c in code]
+        Returns:
+            List with the bytes of the code of each bank
+        """
+        (self.code, self.symbols) = self.code_layout(self.pieces, self.slice_text)
         return self.code
 
     def get_unused_opcodes(self, code):
@@ -1161,6 +1207,10 @@ class CydcCodegen(object):
             "RETURN",
             "END",
         ]
+        # The same code that translate_code() will generate
+        (code, _, _) = self.code_extract_declarations(code)
+        if len(code) == 0:
+            code = [("END",)]
         code = self.code_simple_optimize(code)
         used_opcodes = {c[0] for c in code if c[0] not in excluded_ops}
         all_opcodes = {c for c in self.opcodes.keys() if c not in excluded_ops}
@@ -18,8 +18,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import re
+
 from ply import lex as lex
 
+# Runs of line breaks, counted like the NEWLINE_CHAR rules do
+_NEWLINES_RE = re.compile(r"[\r\n]+")
+
 
 class CydcLexer(object):
     def __init__(self):
@@ -103,6 +108,13 @@ class CydcLexer(object):
         self.unicode_subtitute_chars = {
             k: v for (k, v) in zip(subtitute_chars_keys, subtitute_chars_values)
         }
+        # Translation table for the texts, from lower to higher precedence
+        self.text_table = dict(self.unicode_subtitute_chars)
+        self.text_table.update({ord(k): v for (k, v) in self.subtitute_chars.items()})
+        self.text_table.update(
+            {ord(c): chr(i + 16) for (i, c) in enumerate(self.special_chars)}
+        )
+        self.text_table[ord("\n")] = "\r"
 
     states = (("rawtext", "exclusive"),)
 
@@ -275,9 +287,16 @@ class CydcLexer(object):
     # --- RAWTEXT state: accumulate raw text, ignore code keywords ---
     t_rawtext_ignore = " \t"
 
-    def t_rawtext_NEWLINE_CHAR(self, t):
-        r"(\n|\r|\r\n)+"
-        t.lexer.lineno += self._count_newlines(t.value.count("\r"), t.value.count("\n"))
+    def t_rawtext_text(self, t):
+        r"(?:[^\[]|\[(?!\[))+"
+        # The whole run up to the next [[ at once, the text is emitted there
+        if "\r" in t.value:
+            for newlines in _NEWLINES_RE.findall(t.value):
+                t.lexer.lineno += self._count_newlines(
+                    newlines.count("\r"), newlines.count("\n")
+                )
+        else:
+            t.lexer.lineno += t.value.count("\n")
         return None
 
     def t_rawtext_error(self, t):
@@ -421,28 +440,13 @@ class CydcLexer(object):
 
     def _replace_chars(self, old_string):
         """Replace carriage returns and special characters"""
-        new_string = ""
-        for char in old_string:
-            if ord(char) > 127:
-                try:
-                    char = self.special_chars.index(char) + 16
-                except ValueError:
-                    if char in self.subtitute_chars:
-                        char = self.subtitute_chars[char]
-                    elif ord(char) in self.unicode_subtitute_chars:
-                        char = self.unicode_subtitute_chars[ord(char)]
-                    else:
-                        char = ord(char)
-            elif char == "\n":
-                char = ord("\r")
-            if not isinstance(char, int):
-                char = ord(char)
-            new_string += chr(char)
-        return new_string
+        return old_string.translate(self.text_table)
 
     def _parse_string(self, old_string, current_line):
         """parse to check if string is correct"""
         new_string = self._replace_chars(old_string)
+        if new_string.isascii():
+            return "TEXT", ("TEXT", new_string)
         pos = 0
         line = current_line
         errors = []
@@ -463,13 +467,7 @@ class CydcLexer(object):
                 pos += 1
             else:
                 pos += 1
-        if len(errors) > 0:
-            token_type = "ERROR_TEXT"
-            token_value = ("ERROR_TEXT", errors)
-        else:
-            token_type = "TEXT"
-            token_value = ("TEXT", new_string)
-        return token_type, token_value
+        return "ERROR_TEXT", ("ERROR_TEXT", errors)
 
     def _count_newlines(self, num_r, num_n):
         if num_n == 0 and num_r == 0:
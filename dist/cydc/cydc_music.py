@@ -19,7 +19,7 @@
 import os
 
 from cydc_utils import (
-    bytes2str,
+    get_incbin_asm,
     run_assembler,
     get_asm_template,
     file_must_be_generated,
@@ -56,9 +56,12 @@ def create_wyz_player_bank(
 
     tracks_asm = ""
     ttable = "TABLA_SONG:\n"
+    song_paths = []
     for k in tracks.keys():
+        song_path = os.path.join(track_path, f"wyz_song_{k}__.bin").replace(os.sep, "/")
+        song_paths.append(song_path)
         ttable += f"    DW SONG_{k}\n"
-        tracks_asm += f"SONG_{k}:\n" + bytes2str(tracks[k]) + "\n"
+        tracks_asm += f"SONG_{k}:\n" + get_incbin_asm(song_path, tracks[k]) + "\n"
     ttable += "\n"
     tracks_asm += "\n"
 
@@ -76,15 +79,18 @@ def create_wyz_player_bank(
     asm += f'    SAVEBIN "{path_dest}",WYZ_CALL,WYZ_LEN\n'
     asm += f"    END\n"
 
-    res = run_assembler(
-        asm_path=sjasmplus_path,
-        asm=asm,
-        filename=path_orig,
-        listing=verbose,
-        capture_output=False,
-    )
-    if os.path.exists(path_orig):
-        os.remove(path_orig)
+    try:
+        res = run_assembler(
+            asm_path=sjasmplus_path,
+            asm=asm,
+            filename=path_orig,
+            listing=verbose,
+            capture_output=False,
+        )
+    finally:
+        for path in [path_orig] + song_paths:
+            if os.path.exists(path):
+                os.remove(path)
 
     if res and os.path.exists(path_dest):
         with open(path_dest, "rb") as f:
@@ -22,6 +22,17 @@ import re
 from typing import List, Set, Tuple, Dict, NamedTuple
 
 
+# Lexical state at a point of a source file, following the rules of the lexer
+STATE_TEXT = 0  # Text, outside [[ ]]
+STATE_CODE = 1  # Inside a [[ ]] code block
+STATE_COMMENT = 2  # Inside a /* */ comment of a code block
+
+
+# Lines of the source files already read by any preprocessor, by path.
+# Entries are reused while the (mtime, size) stamp of the file is the same.
+_source_cache: Dict[str, Tuple[Tuple[int, int], List[str]]] = {}
+
+
 class SourceLocation(NamedTuple):
     """Tracks the original source location of a line."""
     filename: str
@@ -62,9 +73,18 @@ class CydcPreprocessor:
         re.IGNORECASE | re.MULTILINE
     )
     
-    # Pattern to match code block delimiters
-    CODE_OPEN = re.compile(r'\[\[')
-    CODE_CLOSE = re.compile(r'\]\]')
+    # Delimiters that end each lexical state, and the state that follows them
+    STATE_DELIMITERS = {
+        STATE_TEXT: re.compile(r'\[\['),
+        STATE_CODE: re.compile(r'\]\]|/\*'),
+        STATE_COMMENT: re.compile(r'\*/'),
+    }
+    NEXT_STATE = {
+        '[[': STATE_CODE,
+        ']]': STATE_TEXT,
+        '/*': STATE_COMMENT,
+        '*/': STATE_CODE,
+    }
     
     def __init__(self, max_depth: int = 20, base_path: str = None, max_errors: int = 20):
         """
@@ -79,6 +99,10 @@ class CydcPreprocessor:
         self.max_errors_reached = False
         self.base_path = base_path
         self.included_files: Set[str] = set()
+        self.source_files: List[str] = []  # Processed files, in order of inclusion
+        # Maps each processed file -> lexical state at the start of each line,
+        # plus a last entry with the state at the end of the file
+        self.line_states: Dict[str, List[int]] = {}
         self.errors: List[PreprocessorError] = []
         self.line_map: Dict[int, SourceLocation] = {}  # Maps output line -> original source location
         self._output_line_num = 1  # Track current output line number
@@ -140,42 +164,56 @@ class CydcPreprocessor:
                 filepath
             )
     
-    def _is_include_in_code_block(self, lines: List[str], line_idx: int, include_match) -> bool:
+    def _read_lines(self, filepath: str) -> Tuple[List[str], str]:
         """
-        Check if an INCLUDE directive at the given line is inside a code block [[ ]].
+        Read a source file split in lines, reusing the last read if unchanged.
         
         Args:
-            lines: All lines in the file
-            line_idx: Index of the line to check (0-based)
-            include_match: The regex match object for the INCLUDE directive
+            filepath: Path to the file to read
             
         Returns:
-            True if the INCLUDE is inside a code block, False otherwise
+            Tuple of (lines with their line endings, normalized path)
+            
+        Raises:
+            PreprocessorError: If file cannot be read
         """
-        line = lines[line_idx]
-        include_pos = include_match.start()
-        
-        # Count [[ and ]] on this line before the INCLUDE
-        line_before_include = line[:include_pos]
-        
-        # Count opening and closing brackets on this line before INCLUDE
-        opens_before = len(self.CODE_OPEN.findall(line_before_include))
-        closes_before = len(self.CODE_CLOSE.findall(line_before_include))
-        
-        # Track nesting level from start of file
-        nesting_level = 0
-        
-        # Process all lines before this one
-        for i in range(line_idx):
-            opens = len(self.CODE_OPEN.findall(lines[i]))
-            closes = len(self.CODE_CLOSE.findall(lines[i]))
-            nesting_level += opens - closes
+        normalized_path = self._normalize_path(filepath)
+        try:
+            st = os.stat(normalized_path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        cached = _source_cache.get(normalized_path)
+        if stamp is not None and cached is not None and cached[0] == stamp:
+            return cached[1], normalized_path
         
-        # Add the brackets before INCLUDE on current line
-        nesting_level += opens_before - closes_before
+        content, normalized_path = self._read_file(filepath)
+        lines = content.splitlines(keepends=True)
+        if stamp is not None:
+            _source_cache[normalized_path] = (stamp, lines)
+        return lines, normalized_path
+    
+    def _scan_state(self, line: str, state: int, end: int = None) -> int:
+        """
+        Advance the lexical state over a line.
         
-        # INCLUDE is valid if we're inside a code block (nesting_level > 0)
-        return nesting_level > 0
+        Args:
+            line: Line to scan
+            state: Lexical state at the start of the line
+            end: Position where the scan stops (default: end of the line)
+            
+        Returns:
+            Lexical state at the end position
+        """
+        if end is None:
+            end = len(line)
+        pos = 0
+        while True:
+            match = self.STATE_DELIMITERS[state].search(line, pos, end)
+            if match is None:
+                return state
+            state = self.NEXT_STATE[match.group()]
+            pos = match.end()
     
     def _process_file(
         self, 
@@ -205,7 +243,7 @@ class CydcPreprocessor:
             )
         
         # Read the file
-        content, normalized_path = self._read_file(filepath)
+        lines, normalized_path = self._read_lines(filepath)
         
         # Check for circular includes
         if normalized_path in self.included_files:
@@ -216,6 +254,7 @@ class CydcPreprocessor:
         
         # Mark file as included
         self.included_files.add(normalized_path)
+        self.source_files.append(normalized_path)
         
         # Get directory of current file for resolving relative includes
         current_dir = os.path.dirname(normalized_path)
@@ -225,15 +264,29 @@ class CydcPreprocessor:
         
         # Process the file line by line
         result_lines = []
-        lines = content.splitlines(keepends=True)
+        
+        # Lexical state kept in a single forward scan of the file
+        states = []
+        self.line_states[normalized_path] = states
+        state = STATE_TEXT
         
         for line_num, line in enumerate(lines, start=1):
+            states.append(state)
+            line_state = state
+            state = self._scan_state(line, line_state)
+            
             # Check if this line contains an include directive
             match = self.INCLUDE_PATTERN.search(line)
-            
+            include_state = None
             if match:
+                include_state = self._scan_state(line, line_state, match.start())
+            
+            if include_state == STATE_COMMENT:
+                # Commented out, keep the line as it is
+                result_lines.append((line, SourceLocation(display_name, line_num)))
+            elif match:
                 # Validate that INCLUDE is inside a code block
-                if not self._is_include_in_code_block(lines, line_num - 1, match):
+                if include_state != STATE_CODE:
                     self._append_error(
                         PreprocessorError(
                             f"INCLUDE directive must be inside [[ ]] code blocks",
@@ -289,6 +342,7 @@ class CydcPreprocessor:
                 # Regular line, add it with its source location
                 result_lines.append((line, SourceLocation(display_name, line_num)))
         
+        states.append(state)
         return result_lines
     
     def preprocess(self, filepath: str) -> Tuple[str, Dict[int, SourceLocation]]:
@@ -307,6 +361,8 @@ class CydcPreprocessor:
         """
         # Reset state
         self.included_files.clear()
+        self.source_files.clear()
+        self.line_states.clear()
         self.errors.clear()
         self.max_errors_reached = False
         self.line_map.clear()
@@ -0,0 +1,430 @@
+# -- coding: utf-8 -*-
+#
+# Choose Your Destiny.
+#
+# Copyright (C) 2025 Sergio Chico <cronomantic@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compile server.
+
+A long-lived process that runs the compiler on request, so consecutive
+builds skip the startup of Python and keep warm the imported modules, the
+parsing tables and the assembled interpreters. It listens on a local
+socket (a named pipe on Windows) whose address and key are written on
+the cache directory, and exits after some time without requests.
+
+The client side only needs the standard library, so make_adventure and
+the GUI can use it without loading the compiler.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+try:
+    from cydc_cache import get_cache_dir, write_atomic
+except ImportError:  # Imported from the cydc package by the front ends
+    from .cydc_cache import get_cache_dir, write_atomic
+
+# Version of the protocol between clients and server
+SERVER_VERSION = 1
+# File on the cache directory with the address of the running server
+ENDPOINT_FILENAME = "server.json"
+# Seconds without requests before the server exits
+IDLE_TIMEOUT = 30 * 60
+# Environment variables of the client applied to each build
+FORWARDED_ENV = ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG", "CYD_LANG")
+
+
+def get_endpoint_path():
+    """Returns the path of the file with the address of the server."""
+    return os.path.join(get_cache_dir(), ENDPOINT_FILENAME)
+
+
+def get_code_key():
+    """
+    Returns a key of the sources of the compiler.
+
+    A server only accepts builds from clients that see the same sources, so
+    an updated compiler is never served by an old process.
+    """
+    base = os.path.dirname(os.path.abspath(__file__))
+    stamps = []
+    for root, dirs, files in os.walk(base):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                stamps.append(f"{os.path.relpath(path, base)}:{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(stamps)
+
+
+def _read_endpoint():
+    try:
+        with open(get_endpoint_path(), "r", encoding="utf-8") as f:
+            endpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(endpoint, dict) or endpoint.get("version") != SERVER_VERSION:
+        return None
+    return endpoint
+
+
+def _new_address():
+    if os.name == "nt":
+        return rf"\\.\pipe\cydc-{os.getpid()}-{secrets.token_hex(4)}"
+    return os.path.join(get_cache_dir(), f"server-{os.getpid()}.sock")
+
+
+class _ConnectionWriter(io.TextIOBase):
+    """Text stream that sends what is written to the client."""
+
+    def __init__(self, conn, stream, lock):
+        self.conn = conn
+        self.stream = stream
+        self.lock = lock
+        self.pid = os.getpid()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if os.getpid() != self.pid:
+            return len(text)  # Worker process forked during a build
+        with self.lock:
+            self.conn.send((self.stream, str(text)))
+        return len(text)
+
+
+class CompileServer(object):
+    """
+    Compiles adventures on request, one at a time.
+
+    Args:
+        idle_timeout: Seconds without requests before exiting
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.address = None
+        self.authkey = None
+        self.code_key = None
+        self.running = False
+        self.busy = False
+        self.builds = 0
+        self.last_request = time.monotonic()
+
+    def serve(self):
+        """Serves requests until stopped or idle for too long."""
+        import cydc  # Loaded once for every build, the point of the server
+
+        self.address = _new_address()
+        self.authkey = secrets.token_bytes(32)
+        self.code_key = get_code_key()
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        listener = Listener(self.address, authkey=self.authkey)
+        endpoint = dict(
+            version=SERVER_VERSION,
+            address=self.address,
+            authkey=self.authkey.hex(),
+            code=self.code_key,
+            pid=os.getpid(),
+        )
+        write_atomic(get_endpoint_path(), json.dumps(endpoint).encode("utf-8"))
+        self.running = True
+        self.last_request = time.monotonic()
+        watchdog = threading.Thread(target=self._watchdog, daemon=True)
+        watchdog.start()
+        try:
+            while self.running:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    continue
+                with conn:
+                    self.busy = True
+                    try:
+                        self.handle(conn)
+                    except (OSError, EOFError):
+                        pass  # The client went away
+                    finally:
+                        self.busy = False
+                        self.last_request = time.monotonic()
+        finally:
+            self.running = False
+            listener.close()
+            endpoint = _read_endpoint()
+            if endpoint is not None and endpoint.get("address") == self.address:
+                with contextlib.suppress(OSError):
+                    os.remove(get_endpoint_path())
+
+    def handle(self, conn):
+        """Answers a request of a client."""
+        request = conn.recv()
+        if request[0] == "ping":
+            conn.send(("ok", dict(pid=os.getpid(), builds=self.builds)))
+        elif request[0] == "stop":
+            self.running = False
+            conn.send(("ok", None))
+        elif request[0] == "compile":
+            (_kind, argv, cwd, env) = request
+            conn.send(("exit", self.compile(conn, argv, cwd, env)))
+        else:
+            conn.send(("error", f"Unknown request {request[0]}"))
+
+    def compile(self, conn, argv, cwd, env):
+        """
+        Runs the compiler with the arguments of the command line.
+
+        Args:
+            conn: Connection where the output is sent
+            argv: Arguments of the compiler
+            cwd: Working directory of the client
+            env: Environment variables of the client to apply
+
+        Returns:
+            Exit code of the compiler
+        """
+        import cydc
+
+        lock = threading.Lock()
+        stdout = _ConnectionWriter(conn, "stdout", lock)
+        stderr = _ConnectionWriter(conn, "stderr", lock)
+        if "--watch" in argv:
+            # It would keep the server busy forever
+            stderr.write("ERROR: The compile server can't run in watch mode.\n")
+            return 2
+        saved_cwd = os.getcwd()
+        saved_env = {k: os.environ.get(k) for k in env}
+        code = 0
+        try:
+            os.chdir(cwd)
+            for k, v in env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    cydc.main(list(argv))
+                except SystemExit as e:
+                    if e.code is None:
+                        code = 0
+                    elif isinstance(e.code, int):
+                        code = e.code
+                    else:
+                        print(e.code, file=sys.stderr)
+                        code = 1
+                except Exception:
+                    # A bug on the compiler must not bring the server down
+                    traceback.print_exc()
+                    code = 1
+        finally:
+            os.chdir(saved_cwd)
+            for k, v in saved_env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            self.builds += 1
+        return code
+
+    def _watchdog(self):
+        while self.running:
+            time.sleep(min(1.0, self.idle_timeout))
+            endpoint = _read_endpoint()
+            replaced = endpoint is None or endpoint.get("address") != self.address
+            idle = time.monotonic() - self.last_request > self.idle_timeout
+            if replaced or (idle and not self.busy):
+                self.running = False
+                # Wake up the listener with a request of our own
+                with contextlib.suppress(OSError, EOFError, AuthenticationError):
+                    with Client(self.address, authkey=self.authkey) as conn:
+                        conn.send(("ping",))
+                        conn.recv()
+
+
+def connect():
+    """
+    Connects to the running server.
+
+    Returns:
+        Connection, or None if there is no server for these sources
+    """
+    endpoint = _read_endpoint()
+    if endpoint is None or endpoint.get("code") != get_code_key():
+        return None
+    try:
+        return Client(endpoint["address"], authkey=bytes.fromhex(endpoint["authkey"]))
+    except (OSError, EOFError, ValueError, KeyError, AuthenticationError):
+        return None
+
+
+def _request(request):
+    conn = connect()
+    if conn is None:
+        return None
+    with conn:
+        try:
+            conn.send(request)
+            return conn.recv()
+        except (OSError, EOFError):
+            return None
+
+
+def is_server_running():
+    """Returns True if a server for these sources answers."""
+    return _request(("ping",)) is not None
+
+
+def stop_server():
+    """Asks the running server to exit, returns True if there was one."""
+    return _request(("stop",)) is not None
+
+
+def compile_on_server(argv, cwd=None, output=None):
+    """
+    Runs a build on the server.
+
+    Args:
+        argv: Arguments of the compiler, like on the command line
+        cwd: Directory the relative paths are based on (default: current one)
+        output: Function called with ("stdout" or "stderr", text) for the
+            output of the compiler (default: written to sys.stdout/sys.stderr)
+
+    Returns:
+        Exit code of the compiler, or None if no server is available
+    """
+    if output is None:
+
+        def output(stream, text):
+            f = sys.stderr if stream == "stderr" else sys.stdout
+            f.write(text)
+            f.flush()
+
+    conn = connect()
+    if conn is None:
+        return None
+    env = {k: os.environ.get(k) for k in FORWARDED_ENV}
+    with conn:
+        try:
+            conn.send(("compile", list(argv), os.path.abspath(cwd or os.getcwd()), env))
+            while True:
+                (kind, value) = conn.recv()
+                if kind == "exit":
+                    return value
+                if kind in ("stdout", "stderr"):
+                    output(kind, value)
+        except (OSError, EOFError):
+            return None
+
+
+def start_server(python_path=None, idle_timeout=IDLE_TIMEOUT, wait=0.0):
+    """
+    Launches a server in the background, if none is running.
+
+    Args:
+        python_path: Python executable (default: the current one)
+        idle_timeout: Seconds without requests before it exits
+        wait: Seconds to wait until it answers
+
+    Returns:
+        True if a server is running
+    """
+    if is_server_running():
+        return True
+    command = [
+        python_path or sys.executable,
+        os.path.abspath(__file__),
+        "--idle-timeout",
+        str(idle_timeout),
+    ]
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = (
+            subprocess.DETACHED_PROCESS
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+            | subprocess.CREATE_NO_WINDOW
+        )
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+            **kwargs,
+        )
+    except OSError:
+        return False
+    deadline = time.monotonic() + wait
+    while True:
+        if is_server_running():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        sys.argv[0], description="Choose Your Destiny Compile Server"
+    )
+    arg_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        help="seconds without requests before exiting",
+    )
+    arg_parser.add_argument(
+        "--stop", action="store_true", help="stop the running server"
+    )
+    arg_parser.add_argument(
+        "--status", action="store_true", help="show if a server is running"
+    )
+    args = arg_parser.parse_args()
+
+    if args.stop:
+        sys.exit(0 if stop_server() else 1)
+    if args.status:
+        info = _request(("ping",))
+        if info is None:
+            print("No compile server running.")
+            sys.exit(1)
+        print(f"Compile server running, pid {info[1]['pid']}, {info[1]['builds']} builds.")
+        sys.exit(0)
+    if is_server_running():
+        sys.exit("ERROR: A compile server is already running.")
+    CompileServer(args.idle_timeout).serve()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
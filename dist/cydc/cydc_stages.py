@@ -0,0 +1,330 @@
+# -- coding: utf-8 -*-
+#
+# Choose Your Destiny.
+#
+# Copyright (C) 2025 Sergio Chico <cronomantic@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import cProfile
+import signal
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+
+class Stage(object):
+    """
+    Step of a build, with the values it needs and the ones it produces.
+
+    Args:
+        name: Name of the stage
+        func: Function called with the inputs as keyword arguments
+        inputs: Names of the values the function needs
+        outputs: Names of the values returned, a tuple if there are several
+        process: Run it on a process instead of a thread, the function and
+            its inputs must be picklable
+        interruptible: The stage finishes early with what it has when
+            StageScheduler.interrupted is set, instead of Ctrl-C stopping
+            the build
+    """
+
+    def __init__(
+        self, name, func, inputs=(), outputs=None, process=False, interruptible=False
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = (name,) if outputs is None else tuple(outputs)
+        self.process = process
+        self.interruptible = interruptible
+
+
+def get_data_size(value):
+    """
+    Returns the approximate size of the data held by a value.
+
+    Bytes and strings count their length, numbers one each and containers
+    the sum of their items. Other objects are not measured.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, dict):
+        return sum(get_data_size(k) + get_data_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(get_data_size(v) for v in value)
+    return 0
+
+
+def _init_process_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent
+
+
+def _run_profiled(func, kwargs, cprofile=False):
+    """Runs a stage on a thread, measuring its CPU time and memory peak."""
+    profiler = cProfile.Profile() if cprofile else None
+    base = 0
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    cpu = time.thread_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = func(**kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    stats = dict(cpu=time.thread_time() - cpu, peak_memory=None)
+    if tracemalloc.is_tracing():
+        stats["peak_memory"] = tracemalloc.get_traced_memory()[1] - base
+    return (result, stats, profiler)
+
+
+def _run_profiled_process(func, kwargs, trace_memory=False):
+    """Runs a stage on a child process, measuring its CPU time and memory peak."""
+    if trace_memory:
+        tracemalloc.start()
+    cpu = time.process_time()
+    result = func(**kwargs)
+    stats = dict(cpu=time.process_time() - cpu, peak_memory=None)
+    if trace_memory:
+        stats["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return (result, stats, None)
+
+
+class StageScheduler(object):
+    """
+    Runs the stages of a build as soon as their inputs are ready.
+
+    Stages that don't depend on each other run at the same time, on a pool
+    of threads, or of processes for the ones that keep the interpreter busy.
+    After running, the time spent by each stage and the critical path, the
+    chain of stages that sets the duration of the build, are available.
+
+    When profiling, the stages run one at a time, so the CPU time and the
+    memory peak of each one are measured alone, and they are left in stats.
+
+    Ctrl-C only reaches the thread calling run(). If an interruptible stage
+    is running, interrupted is set and the build goes on, so the stage can
+    finish early with what it has. Otherwise, or on a second Ctrl-C, the
+    KeyboardInterrupt is raised once the running stages finish.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.producers = {}
+        self.times = {}
+        self.start = None
+        self.stats = {}
+        self.profilers = []
+        self.interrupted = threading.Event()
+
+    def add(
+        self, name, func, inputs=(), outputs=None, process=False, interruptible=False
+    ):
+        """
+        Adds a stage, see Stage for the arguments.
+
+        Raises:
+            ValueError: If the name or an output is already used
+        """
+        stage = Stage(name, func, inputs, outputs, process, interruptible)
+        if any(s.name == name for s in self.stages):
+            raise ValueError(f"Duplicated stage {name}")
+        for output in stage.outputs:
+            if output in self.producers:
+                raise ValueError(f"Value {output} is produced by several stages")
+        for output in stage.outputs:
+            self.producers[output] = stage
+        self.stages.append(stage)
+        return stage
+
+    def get_dependencies(self, stage):
+        """Returns the stages whose outputs are inputs of a stage."""
+        deps = []
+        for value in stage.inputs:
+            producer = self.producers.get(value)
+            if producer is not None and producer not in deps:
+                deps.append(producer)
+        return deps
+
+    def get_order(self, values=None):
+        """
+        Returns the stages in an order where each one goes after its dependencies.
+
+        Args:
+            values: Names of the values available before running, to check
+                that every input is produced
+
+        Raises:
+            ValueError: If an input is never produced or there is a cycle
+        """
+        if values is not None:
+            for stage in self.stages:
+                for value in stage.inputs:
+                    if value not in self.producers and value not in values:
+                        raise ValueError(
+                            f"Input {value} of stage {stage.name} is never produced"
+                        )
+        order = []
+        done = set()
+        pending = list(self.stages)
+        while pending:
+            ready = [s for s in pending if all(d in done for d in self.get_dependencies(s))]
+            if not ready:
+                names = ", ".join(s.name for s in pending)
+                raise ValueError(f"Cycle between the stages {names}")
+            for stage in ready:
+                order.append(stage)
+                done.add(stage)
+                pending.remove(stage)
+        return order
+
+    def run(self, values=None, profile=False, cprofile=False):
+        """
+        Runs every stage.
+
+        Args:
+            values: Dict with the values available before running
+            profile: Run the stages one at a time and measure each one, the
+                memory peaks are measured if tracemalloc is tracing
+            cprofile: Collect cProfile statistics of the stages run on
+                threads, left in profilers
+
+        Returns:
+            Dict with the initial values and the outputs of every stage
+
+        Raises:
+            ValueError: If the stages can't be ordered
+            KeyboardInterrupt: On Ctrl-C, unless an interruptible stage was running
+            Any exception raised by a stage, after the running ones finish
+        """
+        values = dict(values or {})
+        self.get_order(values)
+        self.times = {}
+        self.stats = {}
+        self.profilers = []
+        self.interrupted.clear()
+        profile = profile or cprofile
+        start = self.start = time.perf_counter()
+        threads = ThreadPoolExecutor(1 if profile else max(1, len(self.stages)))
+        processes = None
+        num_processes = sum(1 for s in self.stages if s.process)
+        if num_processes > 0:
+            processes = ProcessPoolExecutor(
+                1 if profile else num_processes, initializer=_init_process_worker
+            )
+        running = {}
+        pending = list(self.stages)
+        try:
+            while pending or running:
+                for stage in list(pending):
+                    if profile and running:
+                        break
+                    if all(v in values for v in stage.inputs):
+                        pending.remove(stage)
+                        kwargs = {v: values[v] for v in stage.inputs}
+                        self.times[stage.name] = [time.perf_counter() - start, None]
+                        if not profile:
+                            executor = processes if stage.process else threads
+                            running[executor.submit(stage.func, **kwargs)] = stage
+                            continue
+                        self.stats[stage.name] = dict(input_size=get_data_size(list(kwargs.values())))
+                        if stage.process:
+                            future = processes.submit(
+                                _run_profiled_process, stage.func, kwargs, tracemalloc.is_tracing()
+                            )
+                        else:
+                            future = threads.submit(_run_profiled, stage.func, kwargs, cprofile)
+                        running[future] = stage
+                try:
+                    done, _not_done = wait(running, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    first = not self.interrupted.is_set()
+                    self.interrupted.set()
+                    if first and any(s.interruptible for s in running.values()):
+                        continue
+                    raise
+                for future in done:
+                    stage = running.pop(future)
+                    self.times[stage.name][1] = time.perf_counter() - start
+                    result = future.result()
+                    if profile:
+                        (result, stats, profiler) = result
+                        self.stats[stage.name].update(stats)
+                        self.stats[stage.name]["output_size"] = get_data_size(result)
+                        if profiler is not None:
+                            self.profilers.append(profiler)
+                    if len(stage.outputs) == 1:
+                        result = (result,)
+                    elif len(stage.outputs) == 0:
+                        result = ()
+                    if len(result) != len(stage.outputs):
+                        raise ValueError(f"Stage {stage.name} returned a wrong number of values")
+                    values.update(zip(stage.outputs, result))
+        finally:
+            for future in running:
+                future.cancel()
+            threads.shutdown(wait=True)
+            if processes is not None:
+                processes.shutdown(wait=True)
+        return values
+
+    def get_duration(self, name):
+        """Returns the seconds spent by a stage on the last run."""
+        (begin, end) = self.times[name]
+        return end - begin
+
+    def get_critical_path(self):
+        """
+        Returns the chain of dependent stages that took the longest on the last run.
+
+        Returns:
+            (list of stage names, seconds spent by them)
+        """
+        finish = {}
+        previous = {}
+        for stage in self.get_order():
+            if self.times.get(stage.name, (None, None))[1] is None:
+                continue
+            best = None
+            for dep in self.get_dependencies(stage):
+                if dep.name in finish and (best is None or finish[dep.name] > finish[best]):
+                    best = dep.name
+            previous[stage.name] = best
+            finish[stage.name] = self.get_duration(stage.name)
+            if best is not None:
+                finish[stage.name] += finish[best]
+        if not finish:
+            return ([], 0.0)
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.insert(0, name)
+            name = previous[name]
+        return (path, total)
@@ -0,0 +1,133 @@
+# -- coding: utf-8 -*-
+#
+# Choose Your Destiny.
+#
+# Copyright (C) 2025 Sergio Chico <cronomantic@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+
+TAP_FLAG_HEADER = 0x00
+TAP_FLAG_DATA = 0xFF
+TAP_TYPE_PROGRAM = 0
+TAP_NAME_SIZE = 10
+TAP_NO_AUTOSTART = 0x8000
+
+
+def get_tap_block(data, flag=TAP_FLAG_DATA):
+    """
+    Returns a block as stored in a TAP file.
+
+    Args:
+        data: Bytes of the block
+        flag: Flag byte, 0 for headers and 255 for data
+
+    Returns:
+        bytes with the length, the flag, the data and the checksum
+    """
+    data = bytes(data)
+    if len(data) + 2 > 0xFFFF:
+        raise ValueError("Block too big for a TAP file")
+    checksum = flag
+    for b in data:
+        checksum ^= b
+    return struct.pack("<HB", len(data) + 2, flag) + data + bytes([checksum])
+
+
+def get_tap_header(file_type, name, length, param1, param2):
+    """
+    Returns the header block that goes before a block with a name.
+
+    Args:
+        file_type: 0 for BASIC programs, 3 for code
+        name: Name of the file, cut or padded with spaces to 10 characters
+        length: Length of the data block
+        param1: Autostart line for programs, start address for code
+        param2: Length of the program without variables, 32768 for code
+
+    Returns:
+        bytes of the header block
+    """
+    name = name.encode("latin-1", errors="replace")[:TAP_NAME_SIZE]
+    data = bytes([file_type]) + name.ljust(TAP_NAME_SIZE, b" ")
+    data += struct.pack("<HHH", length, param1, param2)
+    return get_tap_block(data, TAP_FLAG_HEADER)
+
+
+def read_tap(data):
+    """
+    Splits the contents of a TAP file in blocks.
+
+    Args:
+        data: Bytes of the TAP file
+
+    Returns:
+        List of (flag, data) tuples
+
+    Raises:
+        ValueError: If a block is truncated or its checksum is wrong
+    """
+    blocks = []
+    pos = 0
+    while pos < len(data):
+        if pos + 2 > len(data):
+            raise ValueError("Truncated TAP block")
+        (size,) = struct.unpack_from("<H", data, pos)
+        block = bytes(data[pos + 2 : pos + 2 + size])
+        if size < 2 or len(block) != size:
+            raise ValueError("Truncated TAP block")
+        checksum = 0
+        for b in block:
+            checksum ^= b
+        if checksum != 0:
+            raise ValueError("Wrong checksum on TAP block")
+        blocks.append((block[0], block[1:-1]))
+        pos += 2 + size
+    return blocks
+
+
+class TapFile(object):
+    """
+    TAP file built in memory, so the blocks that don't need assembling
+    are written without running the assembler.
+    """
+
+    def __init__(self):
+        self.blocks = []
+
+    def add_program(self, name, data, autostart=TAP_NO_AUTOSTART):
+        """
+        Adds a BASIC program with its header, like SAVETAP ..., BASIC does.
+
+        Args:
+            name: Name of the program
+            data: Bytes of the program, without variables
+            autostart: Line to run after loading
+        """
+        self.blocks.append(
+            get_tap_header(TAP_TYPE_PROGRAM, name, len(data), autostart, len(data))
+        )
+        self.blocks.append(get_tap_block(data))
+
+    def add_data(self, data, flag=TAP_FLAG_DATA):
+        """Adds a block without header, like SAVETAP ..., HEADLESS does."""
+        self.blocks.append(get_tap_block(data, flag))
+
+    def get_bytes(self):
+        return b"".join(self.blocks)
+
+    def write(self, path):
+        with open(path, "wb") as f:
+            f.write(self.get_bytes())
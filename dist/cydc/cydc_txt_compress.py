@@ -22,7 +22,12 @@
 # Copyright (C) 2010, 2013, 2018-2020, 2022 José Manuel Ferrer Ortiz
 
 
+import hashlib
+import multiprocessing
+import os
+import signal
 import sys
+from collections import Counter
 
 try:
     import progressbar
@@ -34,13 +39,108 @@ except ImportError:
 
 NUM_TOKENS = 128
 
+# Token search engines: "indexed" keeps a table of the repeated substrings and
+# updates it as tokens are replaced, "classic" counts all of them on each pass.
+# Both choose the same tokens.
+TOKEN_ENGINES = ("indexed", "classic")
+
+
+def _get_separator(strings):
+    """
+    Returns a character that doesn't appear on any of the given strings.
+    """
+    used = set()
+    for string in strings:
+        used.update(string)
+    code = 0
+    while chr(code) in used:
+        code += 1
+    return chr(code)
+
+
+# Version of the metadata stored next to the tokens for incremental updates
+TOKENS_META_VERSION = 1
+# Fraction of the savings a token must keep to be reused by update_tokens()
+TOKEN_KEEP_RATIO = 0.5
+
+
+def get_tokens_meta_path(tokens_file):
+    """
+    Returns the path of the metadata that goes with a tokens file.
+    """
+    return os.path.splitext(tokens_file)[0] + ".meta.json"
+
+
+def get_texts_fingerprint(strings):
+    """
+    Returns the digest and length of every text, to find out later how much they changed.
+    strings: Texts to compress
+    """
+    fingerprint = []
+    for string in strings:
+        digest = hashlib.sha1(string.encode("utf-8", "surrogatepass")).hexdigest()
+        fingerprint.append([digest[:16], len(string)])
+    return fingerprint
+
+
+def get_texts_drift(fingerprint, strings):
+    """
+    Returns the percentage of characters of the texts that changed since the
+    fingerprint was taken, counting both the removed and the new texts.
+    fingerprint: Result of get_texts_fingerprint() on the old texts
+    strings: Current texts
+    """
+    old = Counter((digest, length) for (digest, length) in fingerprint)
+    new = Counter((digest, length) for (digest, length) in get_texts_fingerprint(strings))
+    changed = 0
+    for (_digest, length), count in ((old - new) + (new - old)).items():
+        changed += length * count
+    total = max(
+        sum(length * count for (_digest, length), count in old.items()),
+        sum(length * count for (_digest, length), count in new.items()),
+        1,
+    )
+    return 100.0 * changed / total
+
+
+# Compressor and texts of the worker processes of a parallel sweep
+_sweep_state = None
+
+
+def _init_sweep_worker(compressor, texts, repeated):
+    global _sweep_state
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent
+    _sweep_state = (compressor, texts, repeated)
+
+
+def _sweep_worker(max_len_token):
+    (compressor, texts, repeated) = _sweep_state
+    return (max_len_token,) + compressor._generate_tokens(
+        list(texts), max_len_token, repeated
+    )
+
 
 class CydcTextCompressor(object):
-    def __init__(self, gettext, superset_limit, verbose=False):
+    def __init__(
+        self, gettext, superset_limit, verbose=False, engine="indexed", jobs=1
+    ):
+        """
+        gettext: Module or translation used for the messages
+        superset_limit: Number of tokens for which supersets are searched
+        verbose: Show the progress of the search
+        engine: Token search engine, one of TOKEN_ENGINES
+        jobs: Number of processes searching in parallel, 0 to use every CPU
+        """
+        if engine not in TOKEN_ENGINES:
+            raise ValueError(f"Unknown token search engine: {engine}")
         self._ = gettext.gettext
         self.superset_limit = superset_limit
         self.verbose = verbose
         self.num_tokens = NUM_TOKENS
+        self.engine = engine
+        self.jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+        # Max token length of the best tokens found by compress()
+        self.best_max_length = None
 
     def _token_counter(self, strings, min_len, max_len):
         """
@@ -68,18 +168,199 @@ class CydcTextCompressor(object):
                         tokens[token] = 1
         return (savings, tokens)
 
-    def _generate_tokens(self, strings, max_len_token):
+    def _count_repeated(self, strings, max_len):
         """
-        Returns the optimal abbreviations, and the lengths of the strings after the substitution.
-        strings: Strings to compress
+        Returns the character combinations that appear more than once on the given strings,
+        as a list indexed by length of dictionaries with the number of appearances.
+        A combination can only repeat if the one a character shorter also does, so
+        each length only extends the positions of the previous one.
+        strings: strings to process
+        max_len: Max length of the combinations
+        """
+        separator = _get_separator(strings)
+        text = separator.join(strings)
+        positions = range(len(text) - 1)
+        repeated = [{}, {}]
+        for length in range(2, max_len + 1):
+            counter = Counter(text[pos : pos + length] for pos in positions)
+            level = {
+                token: count
+                for token, count in counter.items()
+                if count > 1 and len(token) == length and separator not in token
+            }
+            repeated.append(level)
+            positions = [pos for pos in positions if text[pos : pos + length] in level]
+        return repeated
+
+    @staticmethod
+    def _first_in_text(text, tokens):
+        """
+        Returns the token that the classic engine would have counted first.
+        text: Strings to compress joined by a separator
+        tokens: Candidate tokens
+        """
+        if len(tokens) == 1:
+            return next(iter(tokens))
+        return min(tokens, key=lambda token: (text.find(token), len(token)))
+
+    @staticmethod
+    def _find_supersets(text, token, occurrences, max_len):
+        """
+        Returns the repeated combinations that contain the token.
+        Growing a combination never makes it more frequent, so the search around
+        each appearance of the token stops as soon as one isn't repeated.
+        text: Strings to compress joined by a separator
+        token: Token to extend
+        occurrences: Repeated combinations and their appearances
+        max_len: Max length of the combinations
+        """
+        supersets = set()
+        len_text = len(text)
+        len_token = len(token)
+        pos = text.find(token)
+        while pos >= 0:
+            end = pos + len_token
+            for start in range(pos, max(end - max_len, 0) - 1, -1):
+                if start < pos:
+                    s_set = text[start:end]
+                    if s_set not in occurrences:
+                        break
+                    supersets.add(s_set)
+                for stop in range(end + 1, min(start + max_len, len_text) + 1):
+                    s_set = text[start:stop]
+                    if s_set not in occurrences:
+                        break
+                    supersets.add(s_set)
+            pos = text.find(token, pos + 1)
+        return supersets
+
+    def _search_tokens_indexed(self, strings, max_len_token, repeated, num_tokens):
+        """
+        Returns the same abbreviations as _search_tokens_classic(), keeping a table of
+        the repeated combinations that is only corrected around the replaced tokens.
+        strings: Strings to compress, the tokens are removed from them
         max_len_token: Max token lenght
+        repeated: Result of _count_repeated() on the strings
+        num_tokens: Max number of tokens to find
+        """
+
+        # Combinations appearing more than once, the rest never save anything
+        occurrences = {}
+        # Combinations grouped by the savings they give
+        buckets = {}
+        for length in range(2, min(max_len_token, len(repeated) - 1) + 1):
+            level = repeated[length]
+            occurrences.update(level)
+            for token, count in level.items():
+                saving = (count - 1) * (length - 1)
+                if saving in buckets:
+                    buckets[saving].add(token)
+                else:
+                    buckets[saving] = {token}
+
+        separator = _get_separator(strings)
+        optimum_tokens = []
+        for i in range(num_tokens):
+            if not buckets:
+                break  # No more savings
+            saving = max(buckets)
+            text = separator.join(strings)
+            token = self._first_in_text(text, buckets[saving])
+            if i < self.superset_limit:
+                # Find supersets that save more than the token
+                occ_token = occurrences[token]
+                waste = len(token) - 1
+                max_savings_up = saving
+                super_sets = []
+                for s_set in self._find_supersets(
+                    text, token, occurrences, max_len_token
+                ):
+                    occ_s_set = occurrences[s_set]
+                    savings_up = (occ_s_set - 1) * (len(s_set) - 1) + (
+                        (occ_token - occ_s_set) * waste
+                    )
+                    if savings_up > max_savings_up:
+                        max_savings_up = savings_up
+                        super_sets = [s_set]
+                    elif super_sets and savings_up == max_savings_up:
+                        super_sets.append(s_set)
+                if super_sets:
+                    # Ties are resolved like the classic engine sorts them
+                    best = max(
+                        (occurrences[s_set] - 1) * (len(s_set) - 1)
+                        for s_set in super_sets
+                    )
+                    token = self._first_in_text(
+                        text,
+                        [
+                            s_set
+                            for s_set in super_sets
+                            if (occurrences[s_set] - 1) * (len(s_set) - 1) == best
+                        ],
+                    )
+            len_token = len(token)
+            optimum_tokens.append(
+                (token, (occurrences[token] - 1) * (len_token - 1), occurrences[token])
+            )
+            # Remove token appearances on the string
+            c = 0
+            new_strings = []
+            while c < len(strings):
+                string = strings[c]
+                pos = string.find(token)
+                if pos >= 0:
+                    # Combinations overlapping a removed appearance are lost. If one
+                    # isn't repeated, the longer ones with the same start aren't either
+                    len_string = len(string)
+                    prev_end = 0
+                    while pos >= 0:
+                        end = pos + len_token
+                        for start in range(max(prev_end, pos - max_len_token + 1), end):
+                            for stop in range(
+                                max(start + 2, pos + 1),
+                                min(start + max_len_token, len_string) + 1,
+                            ):
+                                lost = string[start:stop]
+                                count = occurrences.get(lost)
+                                if count is None:
+                                    break
+                                waste = stop - start - 1
+                                saving = (count - 1) * waste
+                                bucket = buckets[saving]
+                                bucket.discard(lost)
+                                if not bucket:
+                                    del buckets[saving]
+                                if count > 2:
+                                    occurrences[lost] = count - 1
+                                    saving -= waste
+                                    if saving in buckets:
+                                        buckets[saving].add(lost)
+                                    else:
+                                        buckets[saving] = {lost}
+                                else:
+                                    del occurrences[lost]
+                        prev_end = end
+                        pos = string.find(token, end)
+                    parts = string.split(token)
+                    strings[c] = parts[0]
+                    for p in range(1, len(parts)):
+                        new_strings.append(parts[p])
+                c += 1
+            strings += new_strings
+        return optimum_tokens
+
+    def _search_tokens_classic(self, strings, max_len_token, num_tokens):
+        """
+        Returns the optimal abbreviations counting every substring again on each pass.
+        strings: Strings to compress, the tokens are removed from them
+        max_len_token: Max token lenght
+        num_tokens: Max number of tokens to find
         """
 
-        len_after = 0  # Max string lenght after token substitution
         min_len_token = 2  # Minimal token lenght
         # Tomamos las mejores tokens
         optimum_tokens = []  # Optimal tokens
-        for i in range(self.num_tokens):
+        for i in range(num_tokens):
             # Calculate how many appearances some combination has
             (savings, occurrences) = self._token_counter(
                 strings, min_len_token, max_len_token
@@ -119,7 +400,6 @@ class CydcTextCompressor(object):
             saving = savings[token]
             # print ((token, saving, occurrences[token]))
             optimum_tokens.append((token, saving, occurrences[token]))
-            len_after += len(token)
             # Remove token appearances on the string
             c = 0
             new_strings = []
@@ -131,6 +411,32 @@ class CydcTextCompressor(object):
                         new_strings.append(parts[p])
                 c += 1
             strings += new_strings
+        return optimum_tokens
+
+    def _generate_tokens(self, strings, max_len_token, repeated=None, num_tokens=None):
+        """
+        Returns the optimal abbreviations, and the lengths of the strings after the substitution.
+        strings: Strings to compress
+        max_len_token: Max token lenght
+        repeated: Result of _count_repeated() on the strings, for the indexed engine
+        num_tokens: Max number of tokens to find, all of them by default
+        """
+
+        if num_tokens is None:
+            num_tokens = self.num_tokens
+        if self.engine == "classic":
+            optimum_tokens = self._search_tokens_classic(
+                strings, max_len_token, num_tokens
+            )
+        else:
+            if repeated is None:
+                repeated = self._count_repeated(strings, max_len_token)
+            optimum_tokens = self._search_tokens_indexed(
+                strings, max_len_token, repeated, num_tokens
+            )
+        len_after = 0  # Max string lenght after token substitution
+        for token in optimum_tokens:
+            len_after += len(token[0])
         for string in strings:
             len_string = len(string) + 1
             len_after += len_string
@@ -150,7 +456,104 @@ class CydcTextCompressor(object):
             new_tokens.append(token[0])
         return (new_tokens, len_after)
 
-    def compress(self, strings, min_length, max_length, final_tokens=None):
+    def _sweep(self, texts, lengths, repeated):
+        """
+        Yields (max_len_token, tokens, len_after) for every maximum token length.
+        With several jobs the lengths are searched in parallel and returned as
+        soon as they are finished.
+        texts: Strings to compress
+        lengths: Maximum token lengths to try
+        repeated: Result of _count_repeated() on the strings, for the indexed engine
+        """
+        if self.jobs == 1 or len(lengths) < 2:
+            for max_len_token in lengths:
+                yield (max_len_token,) + self._generate_tokens(
+                    list(texts), max_len_token, repeated
+                )
+            return
+        pool = multiprocessing.Pool(
+            min(self.jobs, len(lengths)),
+            _init_sweep_worker,
+            (self, texts, repeated),
+        )
+        try:
+            # Longest searches first to balance the load of the workers
+            yield from pool.imap_unordered(_sweep_worker, reversed(lengths))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def get_token_savings(self, strings, tokens):
+        """
+        Returns the bytes saved by each token, replacing them in order like compress() does.
+        strings: Texts to compress
+        tokens: Tokens to evaluate
+        """
+        texts = list(strings)
+        savings = []
+        for posToken, token in enumerate(tokens):
+            code = chr(posToken + 128)
+            count = 0
+            for posString, string in enumerate(texts):
+                parts = string.split(token)
+                if len(parts) > 1:
+                    count += len(parts) - 1
+                    texts[posString] = code.join(parts)
+            # Like the search, the first appearance pays for storing the token
+            savings.append((count - 1) * (len(token) - 1))
+        return savings
+
+    def update_tokens(self, strings, tokens, savings, max_len_token):
+        """
+        Returns the tokens for texts that changed a little since the tokens were found.
+        The tokens that keep saving at least TOKEN_KEEP_RATIO of what they saved
+        before, and something if they did, are kept in the same order and the
+        search only looks for the rest.
+        strings: Texts to compress
+        tokens: Tokens found for the previous texts
+        savings: Bytes saved by each token on the previous texts
+        max_len_token: Max token lenght used to find the tokens
+        """
+        new_savings = self.get_token_savings(strings, tokens)
+        kept = []
+        for token, saving, new_saving in zip(tokens, savings, new_savings):
+            if new_saving >= saving * TOKEN_KEEP_RATIO and (
+                new_saving > 0 or new_saving >= saving
+            ):
+                kept.append(token)
+            elif self.verbose:
+                print(
+                    self._("Token [%(token)s] saves %(new)d bytes instead of %(old)d, replaced.")
+                    % {"token": token, "new": new_saving, "old": saving}
+                )
+        free = self.num_tokens - len(kept)
+        if free == 0:
+            return kept
+        # Search on the text left between the kept tokens
+        fragments = list(strings)
+        for token in kept:
+            new_fragments = []
+            for c in range(len(fragments)):
+                parts = fragments[c].split(token)
+                fragments[c] = parts[0]
+                new_fragments += parts[1:]
+            fragments += new_fragments
+        (new_tokens, _len_after) = self._generate_tokens(
+            fragments, max_len_token, num_tokens=free
+        )
+        return kept + new_tokens
+
+    def compress(self, strings, min_length, max_length, final_tokens=None, stop=None):
+        """
+        Returns the compressed texts, the token table and the tokens used.
+        strings: Texts to compress
+        min_length: Shortest max token length to try
+        max_length: Longest max token length to try
+        final_tokens: Tokens to use instead of searching them
+        stop: threading.Event that ends the search between lengths when it is
+              set, keeping the best tokens found so far like Ctrl-C does
+        """
         if self.verbose:
             print(self._("Replacing special characters..."))
 
@@ -168,22 +571,35 @@ class CydcTextCompressor(object):
                 print(self._("Generating text tokens..."))
 
             minLength = 999999
+            lengths = range(min_length, max_length + 1)
             if self.verbose or not pbarAvailable:
-                l_range = range(min_length, max_length + 1)
+                l_range = range(len(lengths))
             else:
                 progress = progressbar.ProgressBar()
-                l_range = progress(range(min_length, max_length + 1))
-            for maxLenToken in l_range:
-                try:
-                    (posibles, len_token) = self._generate_tokens(
-                        list(texts), maxLenToken
-                    )
-                except KeyboardInterrupt:
-                    break
+                l_range = progress(range(len(lengths)))
+            repeated = None
+            if self.engine == "indexed":
+                repeated = self._count_repeated(texts, max_length)
+            results = {}
+            sweep = self._sweep(texts, lengths, repeated)
+            try:
+                for _i in l_range:
+                    if stop is not None and stop.is_set() and results:
+                        break  # Keep the best result found so far
+                    (maxLenToken, posibles, len_token) = next(sweep)
+                    results[maxLenToken] = (posibles, len_token)
+            except KeyboardInterrupt:
+                pass  # Keep the best result found so far
+            finally:
+                sweep.close()
+            # Same choice whatever the order the lengths were completed
+            for maxLenToken in sorted(results):
+                (posibles, len_token) = results[maxLenToken]
                 if len_token < minLength:
                     tokens = posibles  # Token set with maximum reduction
                     minLength = len_token  # Max. reduction archieved
                     maxLen = maxLenToken  # Max. lenght tokens
+            self.best_max_length = maxLen
             print(lenBefore - minLength, self._("bytes saved from text compression"))
             if self.verbose:
                 print()
@@ -125,11 +125,10 @@ class Plus3DosFilesystem(object):
             if not p3fs_error_check(err):
                 self.diewith(file, err)
                 return False
-            for c in file.data:
-                err = fpo.p3fs_putc(c)
-                if not p3fs_error_check(err):
-                    self.diewith(file, err)
-                    return False
+            err = fpo.p3fs_write(file.data)
+            if not p3fs_error_check(err):
+                self.diewith(file, err)
+                return False
 
             err = fpo.p3fs_close()
             if not p3fs_error_check(err):
@@ -98,10 +98,8 @@ class DSK_PDRIVER:
 
     def dsk_alform(self, track, filler):
         try:
-            filler = bytes([filler])
             self.fp.seek(track * self.secsize * self.sectors)
-            for _ in range(self.secsize * self.sectors):
-                self.fp.write(filler)
+            self.fp.write(bytes([filler]) * (self.secsize * self.sectors))
             return DSK_ERR.OK
         except IOError:
             return DSK_ERR.SYSERR
@@ -129,7 +127,9 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
         super().__init__()
         self.type = "raw"
         self.name = ""
+        # Track number -> offset of its sectors in self.image
         self.tracks = dict()
+        self.image = bytearray()
         self.filler = 0xFE
 
     def dsk_creat(self, name, type):
@@ -137,6 +137,7 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
         if self.type == "dsk":
             self.name = name
             self.tracks.clear()
+            self.image = bytearray()
             return DSK_ERR.OK
         else:
             return super().dsk_creat(name=name, type=type)
@@ -146,6 +147,7 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
         if self.type == "dsk":
             self.name = name
             self.tracks.clear()
+            self.image = bytearray()
             return DSK_ERR.OK
         else:
             return super().dsk_open(name=name, type=type)
@@ -153,22 +155,25 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
     def dsk_alform(self, track, filler):
         if self.type == "dsk":
             self.filler = filler & 0xFF
-            track_data = []
-            for s in range(self.sectors):
-                track_data.append(bytearray([self.filler for _ in range(self.secsize)]))
-            self.tracks[track] = track_data
+            track_size = self.sectors * self.secsize
+            offset = self.tracks.get(track)
+            if offset is None:
+                offset = len(self.image)
+                self.image.extend(bytes(track_size))
+                self.tracks[track] = offset
+            self.image[offset : offset + track_size] = bytes([self.filler]) * track_size
             return DSK_ERR.OK
         else:
             return super().dsk_alform(track=track, filler=filler)
 
     def dsk_lwrite(self, buf, sector):
         if self.type == "dsk":
-            track_pos = sector // self.sectors
-            sector_pos = sector % self.sectors
-            if len(self.tracks[track_pos][sector_pos]) != self.secsize:
+            offset = self.tracks.get(sector // self.sectors)
+            buf = memoryview(buf)[: self.secsize]
+            if offset is None or len(buf) != self.secsize:
                 return DSK_ERR.SYSERR
-            for p in range(self.secsize):
-                self.tracks[track_pos][sector_pos][p] = buf[p]
+            offset += (sector % self.sectors) * self.secsize
+            self.image[offset : offset + self.secsize] = buf
             return DSK_ERR.OK
         else:
             return super().dsk_lwrite(buf=buf, sector=sector)
@@ -188,25 +193,29 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
         num_tracks = max(self.tracks.keys()) + 1
         num_tracks = num_tracks // self.heads
         track_size = 0x100 + (self.sectors * self.secsize)
-        # print(f"->{num_tracks} {self.heads} {track_size}\n")
-
-        disk_image = bytearray()
-        disk_image += pack(
-            "<34s", "MV - CPCEMU Disk-File\r\nDisk-Info\r\n".encode("ascii")
+        data_size = self.sectors * self.secsize
+
+        disk_image = bytearray(0x100 + len(self.tracks) * track_size)
+        pack_into(
+            "<34s14sBBH",
+            disk_image,
+            0,
+            "MV - CPCEMU Disk-File\r\nDisk-Info\r\n".encode("ascii"),
+            "[Cronomantic]".encode("ascii"),
+            num_tracks,
+            self.heads,
+            track_size,
         )
-        disk_image += pack("<14s", "[Cronomantic]".encode("ascii"))
-        disk_image += pack("<BBH", num_tracks, self.heads, track_size)
-        disk_image += bytearray([0 for _ in range(0x100 - len(disk_image))])
 
-        for t in self.tracks.keys():
+        pos = 0x100
+        for t, offset in self.tracks.items():
             tr = t // self.heads
             si = t % self.heads
-            trk = self.tracks[t]
-
-            track_header = bytearray()
-            track_header += pack("<16s", "Track-Info\r\n".encode("ascii"))
-            track_header += pack(
-                "<BBBBBBBB",
+            pack_into(
+                "<16sBBBBBBBB",
+                disk_image,
+                pos,
+                "Track-Info\r\n".encode("ascii"),
                 tr,
                 si,
                 1,
@@ -216,10 +225,11 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
                 self.gap,
                 self.filler,
             )
-            track_data = bytearray()
-            for i, s in enumerate(trk):
-                track_header += pack(
+            for i in range(self.sectors):
+                pack_into(
                     "<BBBBBBBB",
+                    disk_image,
+                    pos + 24 + i * 8,
                     tr,
                     si,
                     i + 1,
@@ -229,13 +239,9 @@ class DSK_PDRIVER_EXT(DSK_PDRIVER):
                     0,
                     0,
                 )
-                track_data += s
-                # print(f"-Side {si} Track {tr} Sector {i + 1}: {track_header}\n")
-            disk_image += (
-                track_header
-                + bytearray([0 for _ in range(0x100 - len(track_header))])
-                + track_data
-            )
+            pos += 0x100
+            disk_image[pos : pos + data_size] = self.image[offset : offset + data_size]
+            pos += data_size
         return disk_image
 
 
@@ -672,6 +678,7 @@ class PLUS3FILE:
         n = 0
         err = DSK_ERR.OK
         blk = self.fs.lookup_block(self.fs.nextblock)
+        buf = memoryview(buf)
         # Firstly actually write the data
         while n < self.fs.blocksize:
             err = self.fs.drive.dsk_lwrite(buf[n : n + self.fs.geom.dg_secsize], blk)
@@ -751,6 +758,21 @@ class PLUS3FILE:
         self.bufptr += 1
         return DSK_ERR.OK
 
+    def p3fs_write(self, buf):
+        """Writes a whole buffer, like calling p3fs_putc() for each byte."""
+        buf = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            if self.bufptr >= self.fs.blocksize:
+                res = self.p3fs_flush()
+                if res != DSK_ERR.OK:
+                    return res
+            length = min(self.fs.blocksize - self.bufptr, len(buf) - pos)
+            self.buf[self.bufptr : self.bufptr + length] = buf[pos : pos + length]
+            self.bufptr += length
+            pos += length
+        return DSK_ERR.OK
+
 
 ################################################################################
 
@@ -887,10 +909,8 @@ def dsk_get_psh(secsize):
 
 # Helper memory functions to mimic memset and memcpy on bytearray
 def memset(buf, offset, length, value):
-    for i in range(offset, offset + length):
-        buf[i] = value
+    buf[offset : offset + length] = bytes([value]) * length
 
 
 def memcpy(dest, d_offset, src, s_offset, length):
-    for i in range(length):
-        dest[d_offset + i] = src[s_offset + i]
+    dest[d_offset : d_offset + length] = bytes(src[s_offset : s_offset + length])
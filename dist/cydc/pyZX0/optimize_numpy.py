@@ -0,0 +1,191 @@
+import numpy as np
+
+from pyZX0.optimize import (Block, INITIAL_OFFSET, elias_gamma_needed_bits, offset_ceiling,
+                            optimize as optimize_reference)
+
+# Initial capacity of the block pool, it grows if the live blocks don't fit
+POOL_SIZE = 1 << 21
+NO_BLOCK = -1
+
+
+class BlockPool:
+    # Array-backed storage of Block instances, referenced by their position in the arrays.
+    # Unreachable blocks are reclaimed by collect(), which also renumbers the survivors.
+    def __init__(self, size):
+        self.bits = np.empty(size, dtype=np.int64)
+        self.index = np.empty(size, dtype=np.int64)
+        self.offset = np.empty(size, dtype=np.int64)
+        self.chain = np.empty(size, dtype=np.int64)
+        self.size = 0
+
+    def add(self, bits, index, offset, chain):
+        start = self.size
+        self.size += len(bits)
+        self.bits[start:self.size] = bits
+        self.index[start:self.size] = index
+        self.offset[start:self.size] = offset
+        self.chain[start:self.size] = chain
+        return np.arange(start, self.size)
+
+    def reserve(self, count, roots):
+        # Makes room for count new blocks, keeping everything reachable from roots
+        if self.size + count <= len(self.bits):
+            return
+        self.collect(roots)
+        if self.size + count > len(self.bits) // 2:
+            capacity = 2 * (self.size + count)
+            for name in ("bits", "index", "offset", "chain"):
+                array = np.empty(capacity, dtype=np.int64)
+                array[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, array)
+
+    def collect(self, roots):
+        reachable = np.zeros(self.size, dtype=bool)
+        pending = np.concatenate([r[r >= 0] for r in roots])
+        while pending.size:
+            pending = pending[~reachable[pending]]
+            reachable[pending] = True
+            pending = self.chain[pending]
+            pending = pending[pending >= 0]
+
+        renumber = np.cumsum(reachable) - 1
+        size = int(renumber[-1]) + 1 if self.size else 0
+        chain = self.chain[:self.size][reachable]
+        self.chain[:size] = np.where(chain >= 0, renumber[chain], NO_BLOCK)
+        for array in (self.bits, self.index, self.offset):
+            array[:size] = array[:self.size][reachable]
+        self.size = size
+
+        for r in roots:
+            used = r >= 0
+            r[used] = renumber[r[used]]
+
+    def get_block(self, block):
+        # Returns the Block instances of the chain ending at the block
+        blocks = []
+        while block != NO_BLOCK:
+            blocks.append(block)
+            block = int(self.chain[block])
+        optimal = None
+        for block in reversed(blocks):
+            optimal = Block(int(self.bits[block]), int(self.index[block]), int(self.offset[block]), optimal)
+        return optimal
+
+
+def get_best_length(optimal_bits, elias_gamma, index, max_length):
+    # Equivalent to the incremental best_length table of the reference optimizer: for each
+    # length, the longest length not above it with the lowest cost
+    lengths = np.arange(2, max_length + 1)
+    bits = optimal_bits[index - lengths] + elias_gamma[lengths - 1]
+    best = bits == np.minimum.accumulate(bits)
+    best_length = np.zeros(max_length + 1, dtype=np.int64)
+    best_length[2:] = np.maximum.accumulate(np.where(best, lengths, 0))
+    return best_length
+
+
+def optimize(input_data, skip, offset_limit):
+    # Same algorithm as pyZX0.optimize.optimize(), but every offset of an index is processed at once.
+    # Offsets only share the optimal blocks of previous indexes, so the result is identical.
+    input_size = len(input_data)
+    if input_size < 3 or skip >= input_size:
+        return optimize_reference(input_data, skip, offset_limit)
+
+    window_size = offset_ceiling(input_size - 1, offset_limit) + 1
+    data = np.frombuffer(bytes(input_data), dtype=np.uint8)
+    elias_gamma = np.array([elias_gamma_needed_bits(v) for v in range(max(input_size, 256) + 2)],
+                           dtype=np.int64)
+    offsets = np.arange(window_size, dtype=np.int64)
+    offset_bits = np.zeros(window_size, dtype=np.int64)
+    offset_bits[1:] = elias_gamma[(offsets[1:] - 1) // 128 + 1] + 8
+
+    pool = BlockPool(POOL_SIZE)
+
+    # Per offset state: the last literal and the last match blocks
+    last_literal = np.full(window_size, NO_BLOCK, dtype=np.int64)
+    last_literal_bits = np.zeros(window_size, dtype=np.int64)
+    last_literal_index = np.zeros(window_size, dtype=np.int64)
+    last_match = np.full(window_size, NO_BLOCK, dtype=np.int64)
+    last_match_bits = np.zeros(window_size, dtype=np.int64)
+    last_match_index = np.zeros(window_size, dtype=np.int64)
+    match_length = np.zeros(window_size, dtype=np.int64)
+
+    optimal = np.full(input_size, NO_BLOCK, dtype=np.int64)
+    optimal_bits = np.zeros(input_size, dtype=np.int64)
+
+    # Kickstart the algorithm by assigning a fake block
+    last_match[INITIAL_OFFSET] = pool.add([-1], skip - 1, INITIAL_OFFSET, NO_BLOCK)[0]
+    last_match_bits[INITIAL_OFFSET] = -1
+    last_match_index[INITIAL_OFFSET] = skip - 1
+
+    no_bits = np.iinfo(np.int64).max
+    for index in range(skip, input_size):
+        max_offset = offset_ceiling(index, offset_limit)
+        window = slice(1, max_offset + 1)
+        pool.reserve(3 * max_offset, (last_literal, last_match, optimal))
+
+        literal = last_literal[window]
+        literal_bits = last_literal_bits[window]
+        literal_index = last_literal_index[window]
+        match = last_match[window]
+        match_bits = last_match_bits[window]
+        match_index = last_match_index[window]
+        length = match_length[window]
+        candidate = np.full(max_offset, NO_BLOCK, dtype=np.int64)
+        candidate_bits = np.full(max_offset, no_bits, dtype=np.int64)
+
+        if index != skip and index >= max_offset:
+            # input_data[index - offset] for each offset, in increasing order of offset
+            matches = data[index - max_offset:index][::-1] == data[index]
+        else:
+            matches = np.zeros(max_offset, dtype=bool)
+
+        # Literals after the last match
+        length[~matches] = 0
+        found = np.flatnonzero(~matches & (match >= 0))
+        if found.size:
+            distance = index - match_index[found]
+            bits = match_bits[found] + 1 + elias_gamma[distance] + distance * 8
+            blocks = pool.add(bits, index, 0, match[found])
+            literal[found] = blocks
+            literal_bits[found] = bits
+            literal_index[found] = index
+            candidate[found] = blocks
+            candidate_bits[found] = bits
+
+        found = np.flatnonzero(matches)
+        if found.size:
+            # Matches chained to the previous literal
+            repeat = found[literal[found] >= 0]
+            if repeat.size:
+                bits = literal_bits[repeat] + 1 + elias_gamma[index - literal_index[repeat]]
+                blocks = pool.add(bits, index, repeat + 1, literal[repeat])
+                match[repeat] = blocks
+                match_bits[repeat] = bits
+                match_index[repeat] = index
+                candidate[repeat] = blocks
+                candidate_bits[repeat] = bits
+
+            # Matches with a new offset chained to the best previous block
+            length[found] += 1
+            found = found[length[found] > 1]
+            if found.size:
+                best_length = get_best_length(optimal_bits, elias_gamma, index, int(length[found].max()))
+                best = best_length[length[found]]
+                bits = optimal_bits[index - best] + offset_bits[found + 1] + elias_gamma[best - 1]
+                better = (match[found] < 0) | (match_index[found] != index) | (match_bits[found] > bits)
+                found = found[better]
+                if found.size:
+                    bits = bits[better]
+                    blocks = pool.add(bits, index, found + 1, optimal[index - best[better]])
+                    match[found] = blocks
+                    match_bits[found] = bits
+                    match_index[found] = index
+                    candidate[found] = blocks
+                    candidate_bits[found] = bits
+
+        # The first offset with the fewest bits is the best one
+        best = int(np.argmin(candidate_bits))
+        optimal[index] = candidate[best]
+        optimal_bits[index] = candidate_bits[best]
+
+    return pool.get_block(int(optimal[input_size - 1]))
@@ -35,9 +35,13 @@ import subprocess
 # Import i18n from dist/cydc or src/cydc/cydc depending on location
 try:
     from cydc.cyd_i18n import setup_i18n, _
+    from cydc.cydc_cache import deps_are_up_to_date, read_deps_file, wait_for_changes
+    from cydc.cydc_server import compile_on_server, start_server
 except ImportError:
     sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dist'))
     from cydc.cyd_i18n import setup_i18n, _
+    from cydc.cydc_cache import deps_are_up_to_date, read_deps_file, wait_for_changes
+    from cydc.cydc_server import compile_on_server, start_server
 
 
 def run_exec(exec_path, parameter_list=[], capture_output=False):
@@ -71,6 +75,65 @@ def run_exec(exec_path, parameter_list=[], capture_output=False):
     return result
 
 
+def run_emulator(model, compiled_file, mode, tools_path, previous=None):
+    """Launches the compiled file on an emulator, like the GUI does.
+
+    Args:
+        model: Target model of the adventure
+        compiled_file: TAP, DSK or MLD file to open
+        mode: "default" to open it with the application of the system,
+            "internal" to use the ZEsarUX of the tools directory
+        tools_path: Path of the tools directory
+        previous: Process of the emulator launched before, closed first
+
+    Returns:
+        Process of the emulator, or None
+    """
+    if previous is not None and previous.poll() is None:
+        previous.terminate()
+    if mode == "default":
+        print(_("Opening {} with default application...").format(compiled_file))
+        try:
+            if os.name == "nt":
+                os.startfile(compiled_file)
+            elif sys.platform == "darwin":
+                return subprocess.Popen(["open", compiled_file])
+            else:
+                return subprocess.Popen(["xdg-open", compiled_file])
+        except OSError as exc:
+            print(_("Failed to open file: {}").format(exc))
+    elif mode == "internal":
+        zesarux_dir = os.path.join(tools_path, "zesarux")
+        zesarux = os.path.join(zesarux_dir, "zesarux.exe" if os.name == "nt" else "zesarux")
+        if not os.path.isfile(zesarux):
+            print(_("Zesarux not found at {}").format(zesarux))
+        elif model in ("mld", "mld128"):
+            print(_("Internal ZEsarUX launch is not configured for MLD cartridges. Use the default application or load the MLD manually."))
+        else:
+            machine_map = {"plus3": "P341", "128k": "128k", "48k": "48k"}
+            zparams = [
+                "--noconfigfile",
+                "--quickexit",
+                "--zoom",
+                "2",
+                "--realvideo",
+                "--nosplash",
+                "--forcevisiblehotkeys",
+                "--forceconfirmyes",
+                "--nowelcomemessage",
+                "--cpuspeed",
+                "100",
+                "--machine",
+                machine_map[model],
+                compiled_file,
+            ]
+            try:
+                return subprocess.Popen([zesarux] + zparams, cwd=zesarux_dir)
+            except OSError as exc:
+                print(_("Failed to launch Zesarux: {}").format(exc))
+    return None
+
+
 def dir_path(string):
     """_summary_
 
@@ -203,6 +266,12 @@ def main():
         help=_("path to the token json file"),
         default=os.path.join(curr_path, "tokens.json"),
     )
+    arg_parser.add_argument(
+        "-inc",
+        "--incremental-tokens",
+        action="store_true",
+        help=_("update the tokens of the token json file when the texts change, instead of reusing them as they are"),
+    )
     arg_parser.add_argument(
         "-chr",
         "--charset-file",
@@ -265,6 +334,14 @@ def main():
         help=_("limit for the superset search heuristic (default: %(default)d)"),
         default=100,
     )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar=_("JOBS"),
+        type=int,
+        help=_("number of processes searching abbreviations in parallel, 0 to use all the CPUs (default: %(default)d)"),
+        default=1,
+    )
     # token_group = arg_parser.add_mutually_exclusive_group()
     arg_parser.add_argument(
         "-T",
@@ -305,17 +382,56 @@ def main():
         action="store_true",
         help=_("exclude code of unused commands"),
     )
+    arg_parser.add_argument(
+        "--token-table",
+        action="store_true",
+        help=_("add a table with the address of each token to print them faster"),
+    )
     arg_parser.add_argument(
         "-code",
         "--show-bytecode",
         action="store_true",
         help=_("show the generated bytecode"),
     )
+    arg_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=_("don't use nor update the build cache"),
+    )
     arg_parser.add_argument(
         "--no-strict-colons",
         action="store_true",
         help=_("allow statements without colon separator (backwards compatibility mode)"),
     )
+    arg_parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help=_("compile even if no file has changed since the last build"),
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help=_("compile again each time a file of the adventure changes, until Ctrl+C is pressed"),
+    )
+    arg_parser.add_argument(
+        "-run",
+        "--run-emulator",
+        choices=["none", "default", "internal"],
+        default="none",
+        help=_("open the adventure after each successful build with the default application or the ZEsarUX of the tools directory"),
+    )
+    arg_parser.add_argument(
+        "--start-server",
+        action="store_true",
+        help=_("start the compile server if it isn't running, to speed up the next builds"),
+    )
+    arg_parser.add_argument(
+        "--no-server",
+        action="store_true",
+        help=_("don't use the compile server, run the compiler on a new process"),
+    )
     arg_parser.add_argument(
         "-pause",
         "--pause-after-load",
@@ -363,7 +479,9 @@ def main():
     # Setting parameters
     cydc_params = ["-img", f"{args.images_path}", "-trk", f"{args.tracks_path}"]
 
-    if not os.path.isfile(args.tokens_file):
+    if args.incremental_tokens:
+        cydc_params = ["-U", f"{args.tokens_file}"] + cydc_params
+    elif not os.path.isfile(args.tokens_file):
         cydc_params = ["-T", f"{args.tokens_file}"] + cydc_params
     else:
         cydc_params = ["-t", f"{args.tokens_file}"] + cydc_params
@@ -386,6 +504,9 @@ def main():
     if args.superset_limit:
         cydc_params = ["-s", f"{args.superset_limit}"] + cydc_params
 
+    if args.jobs != 1:
+        cydc_params = ["-j", f"{args.jobs}"] + cydc_params
+
     if args.verbose:
         cydc_params = ["-v"] + cydc_params
 
@@ -395,9 +516,15 @@ def main():
     if args.trim_interpreter:
         cydc_params = ["-trim"] + cydc_params
 
+    if args.token_table:
+        cydc_params = ["--token-table"] + cydc_params
+
     if args.show_bytecode:
         cydc_params = ["-code"] + cydc_params
 
+    if args.no_cache:
+        cydc_params = ["--no-cache"] + cydc_params
+
     if args.no_strict_colons:
         cydc_params = ["--no-strict-colons"] + cydc_params
 
@@ -413,7 +540,10 @@ def main():
     if args.image_lines:
         cydc_params = ["-il", f"{args.image_lines}"] + cydc_params
 
-    cydc_params = [cydc_path] + cydc_params
+    # Files used by the last build, to skip it if nothing changed
+    deps_file = os.path.join(args.output_path, f"{args.name}.deps.json")
+    cydc_params = ["--deps-file", deps_file] + cydc_params
+
     cydc_params += [
         args.model,
         input_file,
@@ -421,24 +551,78 @@ def main():
         # args.mkp3fs_path,
         args.output_path,
     ]
-
-    try:
-        print(_("Compiling the script..."))
-        #print(cydc_params)
-        run_exec(python_path, cydc_params)
-    except OSError as os1:
-        err = _("ERROR: Error running CYDC.") + str(os1)
-        sys.exit(err)
-
     if args.model == "plus3":
-        print(_("Cleaning..."))
-        files_to_clean = ["SCRIPT.DAT", "DISK", "CYD.BIN"]
-        for f in files_to_clean:
-            p = os.path.join(args.output_path, f)
-            if os.path.isfile(p):
-                os.remove(p)
-
-    sys.exit(0)
+        compiled_file = os.path.join(args.output_path, f"{args.name}.DSK")
+    elif args.model in ("mld", "mld128"):
+        compiled_file = os.path.join(args.output_path, f"{args.name}.MLD")
+    else:
+        compiled_file = os.path.join(args.output_path, f"{args.name}.tap")
+
+    up_to_date = not args.watch and not args.force and deps_are_up_to_date(deps_file, cydc_params)
+    if up_to_date:
+        print(_("Nothing to do, the adventure is up to date."))
+
+    if (args.start_server or args.watch) and not args.no_server and not up_to_date:
+        # The rebuilds of the watch mode reuse the work of the previous ones
+        start_server(python_path, wait=5.0 if args.watch else 0.0)
+
+    def compile_adventure():
+        """Runs the compiler, returns an error message or None."""
+        try:
+            print(_("Compiling the script..."))
+            #print(cydc_params)
+            code = None
+            if not args.no_server:
+                # Use the running compile server, if any
+                code = compile_on_server(cydc_params)
+            if code is None:
+                run_exec(python_path, [cydc_path] + cydc_params)
+            elif code != 0:
+                return _("ERROR: Error running CYDC.")
+        except OSError as os1:
+            return _("ERROR: Error running CYDC.") + str(os1)
+
+        if args.model == "plus3":
+            print(_("Cleaning..."))
+            files_to_clean = ["SCRIPT.DAT", "DISK", "CYD.BIN"]
+            for f in files_to_clean:
+                p = os.path.join(args.output_path, f)
+                if os.path.isfile(p):
+                    os.remove(p)
+        return None
+
+    if not args.watch:
+        if not up_to_date:
+            err = compile_adventure()
+            if err is not None:
+                sys.exit(err)
+        if args.run_emulator != "none" and os.path.isfile(compiled_file):
+            run_emulator(args.model, compiled_file, args.run_emulator, tools_path)
+        sys.exit(0)
+
+    emulator = None
+    build = args.force or not deps_are_up_to_date(deps_file, cydc_params)
+    try:
+        while True:
+            if build:
+                err = compile_adventure()
+                if err is not None:
+                    print(err)
+                elif args.run_emulator != "none":
+                    emulator = run_emulator(
+                        args.model, compiled_file, args.run_emulator, tools_path, emulator
+                    )
+            else:
+                print(_("Nothing to do, the adventure is up to date."))
+            # The files read by the last successful build, and the ones it
+            # may start reading
+            watched = [input_file, args.images_path, args.tracks_path]
+            print(_("Waiting for changes (Ctrl+C to stop)..."), flush=True)
+            changed = wait_for_changes(watched + read_deps_file(deps_file))
+            print(_("Changed: {}").format(", ".join(os.path.basename(p) for p in changed)))
+            build = True
+    except KeyboardInterrupt:
+        sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -82,9 +82,13 @@ from tkinter import ttk, filedialog, messagebox, scrolledtext, colorchooser
 # Import i18n from dist/cydc or src/cydc/cydc depending on location
 try:
     from cydc.cyd_i18n import setup_i18n, get_available_languages, set_language, get_language, _
+    from cydc.cydc_cache import deps_are_up_to_date
+    from cydc.cydc_server import compile_on_server, start_server
 except ImportError:
     sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'dist'))
     from cydc.cyd_i18n import setup_i18n, get_available_languages, set_language, get_language, _
+    from cydc.cydc_cache import deps_are_up_to_date
+    from cydc.cydc_server import compile_on_server, start_server
 
 
 # ── Internationalisation ──────────────────────────────────────────────────────
@@ -727,6 +731,11 @@ class MakeAdventureGUI:
         # Hide console window on Windows after successful GUI initialization
         hide_console_window()
 
+        # Keep a compile server running, so the builds skip the compiler startup
+        threading.Thread(
+            target=start_server, args=(self.paths["python_path"],), daemon=True
+        ).start()
+
         # Save settings on close
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
 
@@ -1136,6 +1145,10 @@ class MakeAdventureGUI:
         python_path = self.paths["python_path"]
         model = self.var_target.get()
 
+        # Files used by the last build, to skip it if nothing changed
+        deps_file = os.path.join(output_path, f"{game_name}.deps.json")
+        cydc_params = ["--deps-file", deps_file] + cydc_params
+
         cydc_params = [cydc_path] + cydc_params
         cydc_params += [model, input_file, sjasmplus, output_path]
 
@@ -1166,14 +1179,30 @@ class MakeAdventureGUI:
     ):
         """Run the compiler in a background thread."""
         success = False
+        deps_file = cydc_params[cydc_params.index("--deps-file") + 1]
+        if deps_are_up_to_date(deps_file, cydc_params[1:]):
+            self._log(_("Nothing to do, the adventure is up to date."))
+            self._run_emulator(model, game_name, output_path)
+            self.root.after(0, self._compile_finished)
+            return
         try:
-            result = run_exec(python_path, cydc_params)
-            if result.stdout:
-                self._log(result.stdout)
-            if result.stderr:
-                self._log(result.stderr)
-            if result.returncode != 0:
-                self._log(_("ERROR: Compiler exited with code {}.").format(result.returncode))
+            output = {"stdout": [], "stderr": []}
+            returncode = compile_on_server(
+                cydc_params[1:], output=lambda stream, text: output[stream].append(text)
+            )
+            if returncode is None:
+                # No compile server available, run the compiler on a new process
+                result = run_exec(python_path, cydc_params)
+                output = {"stdout": [result.stdout], "stderr": [result.stderr]}
+                returncode = result.returncode
+            stdout = "".join(output["stdout"])
+            stderr = "".join(output["stderr"])
+            if stdout:
+                self._log(stdout)
+            if stderr:
+                self._log(stderr)
+            if returncode != 0:
+                self._log(_("ERROR: Compiler exited with code {}.").format(returncode))
             else:
                 success = True
                 self._log("─────────────────────")
@@ -150,6 +150,11 @@ def get_source_files():
         "cydc/cydc_txt_compress.py",
         "cydc/cyd.py",
         "cydc/cydc_utils.py",
+        "cydc/cydc_cache.py",
+        "cydc/cydc_packing.py",
+        "cydc/cydc_stages.py",
+        "cydc/cydc_server.py",
+        "cydc/cydc_tap.py",
         "cydc/cydc_music.py",
         "cydc/cydc_csc.py",
         "cydc/plus3fs.py",
@@ -158,6 +163,7 @@ def get_source_files():
         "cydc/ply/yacc.py",
         "cydc/pyZX0/compress.py",
         "cydc/pyZX0/optimize.py",
+        "cydc/pyZX0/optimize_numpy.py",
         "cydc/pyZX0/pyzx0.py",
         "cydc/pyZX0/README.md",
         "cydc/pyZX0/LICENSE",
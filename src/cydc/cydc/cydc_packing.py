@@ -0,0 +1,191 @@
+# -- coding: utf-8 -*-
+#
+# Choose Your Destiny.
+#
+# Copyright (C) 2025 Sergio Chico <cronomantic@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Placement of the data blocks (images, tracks) on the memory banks.
+
+The banks are described by the free space left on each one, in the order
+they are used, so the reserved banks (like the one of the WyzTracker player)
+are left out and the smaller ones (bank 0 after the interpreter, the 8K
+bank of the +3) just have less space. A placement is the index of the bank
+of each block, in the order of the blocks.
+"""
+
+import sys
+
+# Search steps of the exact packing before giving up
+MAX_NODES = 200000
+
+
+def pack_best_fit(sizes, free):
+    """
+    Places each block, in their order, on the bank where it leaves less space.
+
+    Args:
+        sizes: Size of each block
+        free: Free space on each bank
+
+    Returns:
+        Placement of the blocks, or None if they don't fit
+    """
+    free = list(free)
+    placement = []
+    for size in sizes:
+        best_fit_index = -1
+        min_leftover = sys.maxsize
+        for i, available in enumerate(free):
+            if available >= size and min_leftover > available - size:
+                min_leftover = available - size
+                best_fit_index = i
+        if best_fit_index == -1:
+            return None
+        placement.append(best_fit_index)
+        free[best_fit_index] -= size
+    return placement
+
+
+def pack_first_fit_decreasing(sizes, free):
+    """
+    Places the blocks from the biggest to the smallest on the first bank
+    with space for them.
+
+    Returns:
+        Placement of the blocks, or None if they don't fit
+    """
+    free = list(free)
+    placement = [None] * len(sizes)
+    for i in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+        for j, available in enumerate(free):
+            if available >= sizes[i]:
+                placement[i] = j
+                free[j] -= sizes[i]
+                break
+        else:
+            return None
+    return placement
+
+
+def _get_candidates(free, size):
+    # Banks with space for the block, the fullest first. Banks with the same
+    # free space lead to the same placements, so only one is tried.
+    candidates = []
+    seen = set()
+    for i in sorted(range(len(free)), key=lambda i: free[i]):
+        if free[i] >= size and free[i] not in seen:
+            seen.add(free[i])
+            candidates.append(i)
+    return candidates
+
+
+def pack_exact(sizes, free, max_nodes=MAX_NODES):
+    """
+    Searches a placement of the blocks by branch and bound.
+
+    The blocks are tried from the biggest, and a branch is abandoned when
+    the remaining blocks are bigger than the space left on the banks where
+    any of them could go.
+
+    Args:
+        sizes: Size of each block
+        free: Free space on each bank
+        max_nodes: Search steps before giving up
+
+    Returns:
+        Placement of the blocks, or None if they don't fit or the search
+        gave up
+    """
+    if len(sizes) == 0:
+        return []
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    smallest = sizes[order[-1]]
+    free = list(free)
+    pending = sum(sizes)
+    placement = [None] * len(sizes)
+    if pending > sum(f for f in free if f >= smallest):
+        return None
+    stack = [_get_candidates(free, sizes[order[0]])]
+    nodes = 0
+    while stack:
+        i = order[len(stack) - 1]
+        if placement[i] is not None:  # Undo the last bank tried
+            free[placement[i]] += sizes[i]
+            pending += sizes[i]
+            placement[i] = None
+        if len(stack[-1]) == 0:
+            stack.pop()
+            continue
+        bank = stack[-1].pop(0)
+        free[bank] -= sizes[i]
+        pending -= sizes[i]
+        placement[i] = bank
+        if len(stack) == len(order):
+            return placement
+        nodes += 1
+        if nodes > max_nodes:
+            return None
+        if pending > sum(f for f in free if f >= smallest):
+            stack.append([])
+        else:
+            stack.append(_get_candidates(free, sizes[order[len(stack)]]))
+    return None
+
+
+def pack_blocks(sizes, free, min_banks=1, exact=True):
+    """
+    Places the blocks using as few banks as possible.
+
+    The banks are used from the first one, and at least min_banks of them
+    (the ones that already hold code). For each number of banks the
+    first-fit-decreasing placement is tried, then the exact search.
+
+    Args:
+        sizes: Size of each block
+        free: Free space on each bank that can be used
+        min_banks: Banks used in any case
+        exact: Try the exact search when the heuristic fails
+
+    Returns:
+        (placement, number of banks used), or None if they don't fit
+    """
+    total = sum(sizes)
+    for num_banks in range(min_banks, len(free) + 1):
+        banks = free[:num_banks]
+        if sum(banks) < total:
+            continue
+        placement = pack_first_fit_decreasing(sizes, banks)
+        if placement is None and exact:
+            placement = pack_exact(sizes, banks)
+        if placement is not None:
+            return (placement, num_banks)
+    return None
+
+
+def pack_blocks_best_fit(sizes, free, min_banks=1):
+    """
+    Places the blocks in their order with best fit, adding a bank each
+    time they don't fit. The placement used until now.
+
+    Returns:
+        (placement, number of banks used), or None if they don't fit
+    """
+    for num_banks in range(min_banks, len(free) + 1):
+        placement = pack_best_fit(sizes, free[:num_banks])
+        if placement is not None:
+            return (placement, num_banks)
+    return None
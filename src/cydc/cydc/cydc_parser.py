@@ -17,11 +17,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import hashlib
+
 from ply import yacc as yacc
 from ply import lex as lex
 from cydc_lexer import CydcLexer
+from cydc_cache import get_cache_dir, load_pickle, save_pickle
 from enum import Enum
 
+# Bump when the layout of the cached parsing tables changes
+PARSETAB_VERSION = 1
+PARSETAB_FILENAME = "parsetab.pickle"
+
 
 class SymbolType(Enum):
     LABEL = 1
@@ -34,8 +42,34 @@ class MaxErrorsReached(Exception):
     pass
 
 
+class _CachedProduction(object):
+    """Minimal production restored from the table cache, enough for LRParser."""
+
+    def __init__(self, owner, name, plen, func, pstr):
+        self.name = name
+        self.len = plen
+        self.func = func
+        self.str = pstr
+        self.callable = getattr(owner, func) if func else None
+
+    def __str__(self):
+        return self.str
+
+
+class _CachedTables(object):
+    """Stand-in for yacc.LRTable when the tables come from the cache."""
+
+    def __init__(self, productions, action, goto):
+        self.lr_productions = productions
+        self.lr_action = action
+        self.lr_goto = goto
+
+
 class CydcParser(object):
 
+    # Parsing tables already loaded or generated in this process, by grammar key
+    _tables = dict()
+
     def __init__(self, gettext=None, strict_colon_mode=True, max_errors=20):
         self.lexer = CydcLexer()
         self.tokens = self.lexer.get_tokens()
@@ -1413,10 +1447,12 @@ class CydcParser(object):
         statement : CONST ID EQUALS constexpression
         """
         if len(p) == 5 and self._declare_symbol(p[2], SymbolType.CONSTANT, p.lineno(2)):
+            # Source location for the errors found when calculating it
+            location = self._format_error_location(p.lineno(2))
             if isinstance(p[4], list):
-                p[0] = ("CONST", p[2], p[4])
+                p[0] = ("CONST", p[2], p[4], location)
             else:
-                p[0] = ("CONST", p[2], [p[4]])
+                p[0] = ("CONST", p[2], [p[4]], location)
         else:
             p[0] = None
 
@@ -2366,9 +2402,75 @@ class CydcParser(object):
 
         self.parser.errok()
 
-    def build(self):
+    def _grammar_key(self):
+        """
+        Hash of everything the LALR tables depend on: start symbol, tokens,
+        precedence and the rule docstrings in the order PLY numbers them.
+        """
+        pdict = dict((k, getattr(self, k)) for k in dir(self))
+        pinfo = yacc.ParserReflect(pdict, log=yacc.NullLogger())
+        pinfo.get_all()
+        h = hashlib.sha256()
+        h.update(repr(pinfo.start).encode("utf-8"))
+        h.update(repr(pinfo.tokens).encode("utf-8"))
+        h.update(repr(pinfo.prec).encode("utf-8"))
+        for _line, _module, name, doc in pinfo.pfuncs:
+            h.update(name.encode("utf-8"))
+            h.update((doc or "").encode("utf-8"))
+        return h.hexdigest()
+
+    def _load_tables(self, key, cache_file):
+        tables = CydcParser._tables.get(key)
+        if tables is None and cache_file is not None:
+            tables = load_pickle(cache_file, PARSETAB_VERSION, key)
+        if tables is None:
+            return None
+        try:
+            productions = [
+                _CachedProduction(self, name, plen, func, pstr)
+                for (name, plen, func, pstr) in tables["productions"]
+            ]
+        except AttributeError:
+            return None
+        CydcParser._tables[key] = tables
+        lrtab = _CachedTables(productions, tables["action"], tables["goto"])
+        return yacc.LRParser(lrtab, self.p_error)
+
+    def _save_tables(self, key, cache_file, parser):
+        tables = dict(
+            productions=[
+                (p.name, p.len, p.func, p.str) for p in parser.productions
+            ],
+            action=parser.action,
+            goto=parser.goto,
+        )
+        CydcParser._tables[key] = tables
+        if cache_file is not None:
+            save_pickle(cache_file, PARSETAB_VERSION, key, tables)
+
+    def build(self, use_cache=True, cache_file=None):
+        """
+        Builds the lexer and the LALR parser.
+
+        Generating the parsing tables is the most expensive part of the
+        startup, so they are kept in memory and in a pickled cache file,
+        and only regenerated when the grammar changes.
+
+        Args:
+            use_cache: Load/store the parsing tables from/to the cache
+            cache_file: Path of the cache file (default: user cache directory)
+        """
         self.lexer.build()
-        self.parser = yacc.yacc(module=self)
+        self.parser = None
+        if use_cache:
+            if cache_file is None:
+                cache_file = os.path.join(get_cache_dir(), PARSETAB_FILENAME)
+            key = self._grammar_key()
+            self.parser = self._load_tables(key, cache_file)
+        if self.parser is None:
+            self.parser = yacc.yacc(module=self)
+            if use_cache:
+                self._save_tables(key, cache_file, self.parser)
 
     def parse(self, input, verbose=False):
         if self.parser is None:
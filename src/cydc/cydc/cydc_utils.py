@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys, os, subprocess, json, time
+import sys, os, subprocess, json, time, hashlib, multiprocessing, signal
 
 from string import Template
 from mkp3fs import Plus3DosFilesystem
@@ -73,6 +73,28 @@ def get_asm_template(filename):
     return AsmTemplate(text)
 
 
+# Calls to external programs, recorded while profiling
+_external_calls = None
+
+
+def record_external_calls(enable=True):
+    """
+    Starts or stops recording the time spent on external programs.
+
+    Args:
+        enable: Start a new recording, or stop the current one
+
+    Returns:
+        List of the calls recorded until now, as dicts with the program,
+        the file processed, the start time (time.perf_counter()), and the
+        wall and CPU seconds spent (the CPU time is None on Windows)
+    """
+    global _external_calls
+    calls = _external_calls or []
+    _external_calls = [] if enable else None
+    return calls
+
+
 def run_assembler(asm_path, asm, filename, listing=True, capture_output=False):
     """_summary_
 
@@ -83,13 +105,15 @@ def run_assembler(asm_path, asm, filename, listing=True, capture_output=False):
     try:
         with open(filename, "w", encoding="utf-8") as f:
             f.write(asm)
-    except OSError:
-        sys.exit("ERROR: Can't write temp file.")
+    except OSError as e:
+        raise OSError("Can't write temp file.") from e
     asm_path = os.path.abspath(asm_path)  # Get the absolute path of the executable
     command_line = [asm_path, "--nologo", "-Wno-all"]
     if listing:
         command_line += ["--lst=" + (os.path.splitext(filename)[0] + ".lst")]
     command_line += [filename]
+    start = time.perf_counter()
+    start_times = os.times()
     try:
         stdout = None
         # stdout = subprocess.DEVNULL
@@ -108,6 +132,19 @@ def run_assembler(asm_path, asm, filename, listing=True, capture_output=False):
     finally:
         if os.path.isfile(filename):
             os.remove(filename)
+        if _external_calls is not None:
+            end_times = os.times()
+            cpu = end_times.children_user - start_times.children_user
+            cpu += end_times.children_system - start_times.children_system
+            _external_calls.append(
+                dict(
+                    program=os.path.basename(asm_path),
+                    file=os.path.basename(filename),
+                    start=start,
+                    wall=time.perf_counter() - start,
+                    cpu=None if os.name == "nt" else cpu,
+                )
+            )
     if result.returncode != 0:
         raise OSError(result.stderr)
     return result
@@ -122,29 +159,43 @@ def run_assembler(asm_path, asm, filename, listing=True, capture_output=False):
     # return chunk
 
 
+HEX_BYTES = tuple(f"${b:02X}" for b in range(256))
+
+
 def bytes2str(list_bytes=[], b_str=""):
-    """_summary_
+    """
+    Returns the bytes as DEFB lines of 16 bytes.
 
     Args:
-        list_bytes (list, optional): _description_. Defaults to [].
-        b_str (str, optional): _description_. Defaults to "".
+        list_bytes (list, optional): Bytes to convert. Defaults to [].
+        b_str (str, optional): Text to put before the lines. Defaults to "".
 
     Returns:
-        _type_: _description_
+        str: Assembler source
     """
-    cnt = 0
-    for c in list_bytes:
-        if cnt == 0:
-            b_str += f"    DEFB ${c:02X}"
-        else:
-            b_str += f", ${c:02X}"
-        cnt += 1
-        if cnt == 16:
-            cnt = 0
-            b_str += "\n"
-    if cnt != 0:
-        b_str += "\n"
-    return b_str
+    lines = [b_str]
+    for i in range(0, len(list_bytes), 16):
+        lines.append(
+            "    DEFB " + ", ".join([HEX_BYTES[c] for c in list_bytes[i : i + 16]]) + "\n"
+        )
+    return "".join(lines)
+
+
+def get_incbin_asm(path, data):
+    """
+    Writes the bytes to a binary file and returns the source that includes it,
+    so the assembler doesn't have to parse them as text.
+
+    Args:
+        path (str): Path of the file, the caller removes it after assembling
+        data (list): Bytes to write
+
+    Returns:
+        str: INCBIN line
+    """
+    with open(path, "wb") as f:
+        f.write(bytes(data))
+    return f'    INCBIN "{path}"\n'
 
 
 def get_image_config(fpath):
@@ -214,6 +265,195 @@ def compress_screen_file(fpath, num_lines=192, force_mirror=False, verbose=False
     return None
 
 
+# Increase it when the output of ScreenCompress changes to discard cached images
+CSC_CACHE_VERSION = 1
+CSC_CACHE_FILE = "image.csc"
+# Written next to each CSC file with the key of the image it comes from
+CSC_KEY_SUFFIX = ".key"
+
+
+def get_screen_key(scr_data, num_lines=192, force_mirror=False):
+    """
+    Returns the cache key of a compressed image.
+
+    Args:
+        scr_data: Contents of the SCR file
+        num_lines: Number of lines of the image to compress
+        force_mirror: If the mirror mode is forced
+
+    Returns:
+        Hex digest of the data and the compression parameters
+    """
+    h = hashlib.sha256()
+    h.update(f"CSC{CSC_CACHE_VERSION}:{num_lines}:{int(force_mirror)}:".encode("ascii"))
+    h.update(bytes(scr_data))
+    return h.hexdigest()
+
+
+def read_csc_file(csc_path, key):
+    """
+    Reads a CSC file written by write_csc_file() for the same image.
+
+    Returns:
+        The compressed data, or None if the file is missing or comes from
+        another image or parameters
+    """
+    try:
+        with open(csc_path + CSC_KEY_SUFFIX, "r", encoding="ascii") as f:
+            if f.read().strip() != key:
+                return None
+        with open(csc_path, "rb") as f:
+            return list(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_csc_file(csc_path, data, key):
+    """Writes a CSC file, and the key of its image next to it."""
+    with open(csc_path, "wb") as f:
+        f.write(bytearray(data))
+    with open(csc_path + CSC_KEY_SUFFIX, "w", encoding="ascii") as f:
+        f.write(key + "\n")
+
+
+def _init_screen_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent
+
+
+def _compress_screen(job):
+    (key, scr_data, num_lines, force_mirror) = job
+    csc = ScreenCompress(list(scr_data))
+    cb, txt = csc.convert_to_CSC(num_lines=num_lines, force_mirror=force_mirror)
+    return (key, cb, txt)
+
+
+def find_compressed_screens(screens, cache=None, verbose=False):
+    """
+    Gets the images that don't need to be compressed again.
+
+    Images with a CSC file written for the same contents and parameters, or
+    already in the cache, are read instead of compressed.
+
+    Args:
+        screens: List of (SCR file path, number of lines, force mirror mode),
+            optionally followed by the path of the CSC file to reuse or write
+        cache: BuildCache with the compressed images, None to disable it
+        verbose: Show the images reused
+
+    Returns:
+        (list with the compressed data of each image, None for the ones to
+        compress, list with the key of each image, list of the compression
+        jobs for compress_screens(), one for each different image)
+    """
+    results = [None] * len(screens)
+    keys = []
+    jobs = {}
+    for pos, screen in enumerate(screens):
+        (fpath, num_lines, force_mirror) = screen[:3]
+        csc_path = screen[3] if len(screen) > 3 else None
+        with open(fpath, "rb") as f:
+            scr_data = f.read()
+        key = get_screen_key(scr_data, num_lines, force_mirror)
+        keys.append(key)
+        if csc_path is not None:
+            results[pos] = read_csc_file(csc_path, key)
+            if results[pos] is not None:
+                if verbose:
+                    print(f"Using {csc_path}, it is up to date.")
+                continue
+        files = cache.get(key) if cache is not None else None
+        if files is not None and CSC_CACHE_FILE in files:
+            results[pos] = list(files[CSC_CACHE_FILE])
+            if verbose:
+                print(f"Using cached compression of {fpath}.")
+            if csc_path is not None:
+                write_csc_file(csc_path, results[pos], key)
+        elif key not in jobs:
+            jobs[key] = (key, scr_data, num_lines, force_mirror)
+    return (results, keys, list(jobs.values()))
+
+
+def compress_screens(jobs):
+    """
+    Compresses images to CSC format.
+
+    It doesn't print anything, so it can run on other processes, the
+    reports are returned for store_compressed_screens().
+
+    Args:
+        jobs: Compression jobs returned by find_compressed_screens()
+
+    Returns:
+        List of (key, compressed data, compression report) of each job
+    """
+    return [_compress_screen(job) for job in jobs]
+
+
+def store_compressed_screens(screens, results, keys, compressed, cache=None, verbose=False):
+    """
+    Completes the images found by find_compressed_screens() with the compressed ones.
+
+    The compressed images are added to the cache and written to their CSC
+    files.
+
+    Args:
+        screens: Images given to find_compressed_screens()
+        results: Compressed data of each image returned by it
+        keys: Key of each image returned by it
+        compressed: Images returned by compress_screens()
+        cache: BuildCache with the compressed images, None to disable it
+        verbose: Show the compression report of each image
+
+    Returns:
+        List with the compressed data of each image, in the same order
+    """
+    results = list(results)
+    for key, cb, txt in compressed:
+        positions = [
+            pos for pos in range(len(screens)) if results[pos] is None and keys[pos] == key
+        ]
+        if verbose:
+            print(f"Compressing file {screens[positions[0]][0]}...")
+            for line in txt.splitlines():
+                print(line)
+        if cache is not None:
+            cache.put(key, {CSC_CACHE_FILE: bytes(cb)})
+        for pos in positions:
+            results[pos] = cb
+            if len(screens[pos]) > 3 and screens[pos][3] is not None:
+                write_csc_file(screens[pos][3], cb, key)
+    return results
+
+
+def compress_screen_files(screens, cache=None, jobs=1, verbose=False):
+    """
+    Compresses SCR files to CSC format.
+
+    Images with a CSC file written for the same contents and parameters, or
+    already in the cache, are not compressed again, the rest are compressed
+    in a pool of processes.
+
+    Args:
+        screens: List of (SCR file path, number of lines, force mirror mode),
+            optionally followed by the path of the CSC file to reuse or write
+        cache: BuildCache with the compressed images, None to disable it
+        jobs: Number of processes compressing in parallel, 0 to use every CPU
+        verbose: Show the compression report of each image
+
+    Returns:
+        List with the compressed data of each image, in the same order
+    """
+    (results, keys, work) = find_compressed_screens(screens, cache, verbose)
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(work) < 2:
+        compressed = compress_screens(work)
+    else:
+        with multiprocessing.Pool(min(jobs, len(work)), _init_screen_worker) as pool:
+            compressed = pool.map(_compress_screen, work)
+    return store_compressed_screens(screens, results, keys, compressed, cache, verbose)
+
+
 def make_plus3_dsk(filename, label=None, filelist=[], disk_720=False, verbose=False):
     p3fs = Plus3DosDiskUtil(verbose=verbose)
     for filepath in filelist:
@@ -1,5 +1,12 @@
 from pyZX0.optimize import INITIAL_OFFSET, optimize
 
+try:
+    # Same results as the reference optimizer, only faster
+    from pyZX0.optimize_numpy import optimize
+    numpyAvailable = True
+except ImportError:
+    numpyAvailable = False
+
 MAX_OFFSET_ZX0 = 32640
 MAX_OFFSET_ZX7 = 2176
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the abbreviation search engines of CydcTextCompressor.
+
+Runs the search of every engine over the texts of the examples, checks that
+all of them choose the same tokens and shows the time spent by each one.
+
+Usage:
+    python benchmark_txt_compress.py              # Examples, lengths 3 to 30
+    python benchmark_txt_compress.py -L 10        # Shorter sweep
+    python benchmark_txt_compress.py game.cyd     # Other sources
+"""
+
+import argparse
+import gettext
+import sys
+import time
+from pathlib import Path
+
+# Add src to path for imports
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR / "src" / "cydc" / "cydc"))
+
+from cydc_parser import CydcParser
+from cydc_preprocessor import CydcPreprocessor
+from cydc_txt_compress import CydcTextCompressor, TOKEN_ENGINES
+
+
+def get_texts(path):
+    """Returns the texts of a source file, or None if it can't be parsed."""
+    preprocessor = CydcPreprocessor()
+    text, line_map = preprocessor.preprocess(str(path))
+    if preprocessor.errors:
+        return None
+    parser = CydcParser(strict_colon_mode=False)
+    parser.set_line_map(line_map)
+    parser.build()
+    code = parser.parse(input=text)
+    if parser.errors or code is None:
+        return None
+    return [value[1] for value in code if value[0] == "TEXT"]
+
+
+def run_engine(engine, texts, min_length, max_length, superset_limit):
+    """Runs the search for every maximum length like compress() does."""
+    compressor = CydcTextCompressor(gettext, superset_limit, engine=engine)
+    start = time.perf_counter()
+    repeated = None
+    if engine == "indexed":
+        repeated = compressor._count_repeated(texts, max_length)
+    results = []
+    for max_len in range(min_length, max_length + 1):
+        results.append(compressor._generate_tokens(list(texts), max_len, repeated))
+    return results, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("sources", nargs="*", help="source files (default: examples)")
+    arg_parser.add_argument("-l", "--min-length", type=int, default=3)
+    arg_parser.add_argument("-L", "--max-length", type=int, default=30)
+    arg_parser.add_argument("-s", "--superset-limit", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    sources = [Path(s) for s in args.sources]
+    if not sources:
+        sources = sorted((ROOT_DIR / "examples").glob("*/*.cyd"))
+
+    totals = dict.fromkeys(TOKEN_ENGINES, 0.0)
+    mismatches = 0
+    header = f"{'source':40} {'chars':>7}" + "".join(f" {e:>9}" for e in TOKEN_ENGINES)
+    print(header)
+    print("-" * len(header))
+    for path in sources:
+        texts = get_texts(path)
+        if not texts:
+            continue
+        results = {}
+        line = f"{str(path.relative_to(ROOT_DIR) if path.is_absolute() else path)[-40:]:40}"
+        line += f" {sum(len(t) for t in texts):7}"
+        for engine in TOKEN_ENGINES:
+            results[engine], elapsed = run_engine(
+                engine, texts, args.min_length, args.max_length, args.superset_limit
+            )
+            totals[engine] += elapsed
+            line += f" {elapsed:8.2f}s"
+        if any(r != results[TOKEN_ENGINES[0]] for r in results.values()):
+            mismatches += 1
+            line += "  MISMATCH"
+        print(line, flush=True)
+    print("-" * len(header))
+    print(f"{'total':48}" + "".join(f" {totals[e]:8.2f}s" for e in TOKEN_ENGINES))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the ZX0 optimizers used to compress the images.
+
+Compresses every image of the examples to CSC with the reference optimizer
+and the NumPy one, checks that the results are identical and shows the time
+spent by each one.
+
+Usage:
+    python benchmark_zx0.py                   # Images of the examples
+    python benchmark_zx0.py 000.scr 001.scr   # Other images
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR / "src" / "cydc" / "cydc"))
+
+from cydc_csc import ScreenCompress
+from pyZX0 import compress
+from pyZX0.optimize import optimize as optimize_reference
+from pyZX0.optimize_numpy import optimize as optimize_numpy
+
+OPTIMIZERS = (("numpy", optimize_numpy), ("reference", optimize_reference))
+
+
+def run_optimizer(optimizer, data):
+    """Compresses an image like cydc does, returning the CSC data and the time spent."""
+    start = time.perf_counter()
+    with patch.object(compress, "optimize", optimizer):
+        csc, _txt = ScreenCompress(list(data)).convert_to_CSC()
+    return csc, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("images", nargs="*", help="SCR files (default: examples)")
+    args = arg_parser.parse_args()
+
+    images = [Path(s) for s in args.images]
+    if not images:
+        images = sorted((ROOT_DIR / "examples").glob("*/IMAGES/*.scr"))
+
+    totals = {name: 0.0 for name, _optimizer in OPTIMIZERS}
+    mismatches = 0
+    header = f"{'image':40} {'size':>6}" + "".join(f" {name:>10}" for name in totals)
+    print(header)
+    print("-" * len(header))
+    for path in images:
+        data = path.read_bytes()
+        results = []
+        line = f"{str(path.relative_to(ROOT_DIR) if path.is_absolute() else path)[-40:]:40}"
+        for name, optimizer in OPTIMIZERS:
+            csc, elapsed = run_optimizer(optimizer, data)
+            results.append(csc)
+            totals[name] += elapsed
+            if len(results) == 1:
+                line += f" {len(csc):6}"
+            line += f" {elapsed:9.2f}s"
+        if any(r != results[0] for r in results):
+            mismatches += 1
+            line += "  MISMATCH"
+        print(line, flush=True)
+    print("-" * len(header))
+    print(f"{'total':47}" + "".join(f" {totals[name]:9.2f}s" for name in totals))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_cache import (
+    deps_are_up_to_date,
+    get_file_stamps,
+    read_deps_file,
+    wait_for_changes,
+    write_deps_file,
+)
+
+
+class TestDepsFile(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.images = self.dir / "IMAGES"
+        self.images.mkdir()
+        self.source = self.dir / "game.cyd"
+        self.source.write_text("[[ END ]]")
+        (self.images / "000.scr").write_bytes(bytes(6912))
+        self.target = self.dir / "game.tap"
+        self.target.write_bytes(b"tap")
+        self.manifest = str(self.dir / "game.deps.json")
+        self.command = ["48k", "game.cyd"]
+        self.dependencies = [str(self.source), str(self.images), str(self.images / "000.scr")]
+        write_deps_file(self.manifest, [str(self.target)], self.dependencies, self.command, "1.0")
+
+    def test_unchanged_build_is_up_to_date(self):
+        self.assertTrue(deps_are_up_to_date(self.manifest, self.command))
+        self.assertTrue(deps_are_up_to_date(self.manifest, self.command, "1.0"))
+        self.assertFalse(deps_are_up_to_date(self.manifest, self.command, "1.1"))
+        self.assertFalse(deps_are_up_to_date(self.manifest, ["128k", "game.cyd"]))
+        self.assertFalse(deps_are_up_to_date(str(self.dir / "missing.json"), self.command))
+
+    def test_changed_dependency(self):
+        self.source.write_text("[[ END: END ]]")
+        self.assertFalse(deps_are_up_to_date(self.manifest, self.command))
+
+    def test_new_file_in_directory(self):
+        (self.images / "001.scr").write_bytes(bytes(6912))
+        os.utime(self.images, ns=(0, os.stat(self.images).st_mtime_ns + 1))
+        self.assertFalse(deps_are_up_to_date(self.manifest, self.command))
+
+    def test_missing_target(self):
+        self.target.unlink()
+        self.assertFalse(deps_are_up_to_date(self.manifest, self.command))
+
+    def test_manifest_contents(self):
+        with open(self.manifest, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["targets"], [str(self.target)])
+        self.assertEqual(list(manifest["dependencies"]), self.dependencies)
+
+    def test_make_rule(self):
+        rule_file = str(self.dir / "game.d")
+        write_deps_file(rule_file, [str(self.target)], self.dependencies)
+        rule = Path(rule_file).read_text()
+        self.assertTrue(rule.startswith(f"{self.target.as_posix()}:"))
+        self.assertIn(self.source.as_posix(), rule)
+        self.assertNotIn(f" {self.images.as_posix()} ", rule + " ")
+
+    def test_read_manifest(self):
+        self.assertEqual(read_deps_file(self.manifest), self.dependencies)
+        self.assertEqual(read_deps_file(str(self.dir / "missing.json")), [])
+
+
+class TestWaitForChanges(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.source = self.dir / "game.cyd"
+        self.source.write_text("[[ END ]]")
+
+    def _change_later(self, func):
+        def change():
+            time.sleep(0.1)
+            func()
+
+        thread = threading.Thread(target=change)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_stamps(self):
+        missing = str(self.dir / "missing.cyd")
+        stamps = get_file_stamps([str(self.source), missing])
+        self.assertIsNone(stamps[missing])
+        self.assertEqual(stamps[str(self.source)][1], len("[[ END ]]"))
+
+    def test_changed_file(self):
+        other = self.dir / "other.cyd"
+        other.write_text("")
+        self._change_later(lambda: self.source.write_text("[[ END : END ]]"))
+        changed = wait_for_changes([str(self.source), str(other)], interval=0.02)
+        self.assertEqual(changed, [str(self.source)])
+
+    def test_created_file(self):
+        created = self.dir / "IMAGES"
+        self._change_later(created.mkdir)
+        self.assertEqual(wait_for_changes([str(created)], interval=0.02), [str(created)])
+
+
+if __name__ == "__main__":
+    unittest.main()
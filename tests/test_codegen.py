@@ -0,0 +1,341 @@
+"""
+Test suite for CydcCodegen - Constants and declarations.
+"""
+
+import gettext
+import os
+import tempfile
+import unittest
+import sys
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_codegen import CydcCodegen, CodegenError
+from cydc_parser import CydcParser
+from cydc_preprocessor import CydcPreprocessor
+
+
+class TestConstantCalculation(unittest.TestCase):
+    """Test the calculation of the constants."""
+
+    def setUp(self):
+        """Initialize code generator for each test."""
+        self.codegen = CydcCodegen(gettext)
+
+    def test_references_in_any_order(self):
+        """Test constants that use others declared later."""
+        constants = {
+            "c": [("C_REPL", "b"), ("C_VAL", 2), ("C_*",)],
+            "b": [("C_REPL", "a"), ("C_REPL", "a"), ("C_+",)],
+            "a": [("C_VAL", 3)],
+            "d": [("C_REPL", "c"), ("C_VAL", 1), ("C_<<",), ("C_REPL", "a"), ("C_-",)],
+        }
+        values = self.codegen.constant_calculation(constants)
+        self.assertEqual(values, {"a": 3, "b": 6, "c": 12, "d": 21})
+        self.assertEqual(
+            self.codegen.constant_expression_calculation([("C_REPL", "d"), ("C_VAL", 1), ("C_+",)]),
+            22,
+        )
+
+    def test_long_chain(self):
+        """Test a chain of constants longer than the recursion limit."""
+        constants = {"c0": [("C_VAL", 0)]}
+        for i in range(1, 5000):
+            constants[f"c{i}"] = [("C_REPL", f"c{i - 1}"), ("C_VAL", 1), ("C_+",)]
+        constants = dict(reversed(list(constants.items())))
+        self.assertEqual(self.codegen.constant_calculation(constants)["c4999"], 4999)
+
+    def test_results_are_reused(self):
+        """Test that the same declarations are only calculated once."""
+        constants = {"a": [("C_VAL", 3)], "b": [("C_REPL", "a")]}
+        self.codegen.constant_calculation(constants)
+        self.codegen._sort_constants = None  # Must not be called again
+        self.assertEqual(self.codegen.constant_calculation(dict(constants)), {"a": 3, "b": 3})
+
+    def test_circular_references(self):
+        """Test that cycles are reported with the lines of the constants."""
+        constants = {
+            "a": [("C_VAL", 1)],
+            "b": [("C_REPL", "c"), ("C_REPL", "a"), ("C_+",)],
+            "c": [("C_REPL", "b")],
+        }
+        with self.assertRaises(CodegenError) as cm:
+            self.codegen.constant_calculation(constants, lines={"a": 1, "b": 2, "c": 3})
+        self.assertIn("b (line 2) -> c (line 3) -> b (line 2)", str(cm.exception))
+        with self.assertRaises(CodegenError):
+            self.codegen.constant_calculation({"a": [("C_REPL", "a")]})
+
+    def test_wrong_constants(self):
+        """Test unknown references and invalid values."""
+        with self.assertRaises(CodegenError) as cm:
+            self.codegen.constant_calculation({"a": [("C_REPL", "x")]}, lines={"a": 7})
+        self.assertIn("a (line 7)", str(cm.exception))
+        with self.assertRaises(CodegenError):
+            self.codegen.constant_calculation({"a": [("C_VAL", 1), ("C_VAL", 2), ("C_-",)]})
+        with self.assertRaises(CodegenError):
+            self.codegen.constant_calculation({"a": [("C_VAL", 1), ("C_+",)]})
+
+    def test_lines_from_the_parser(self):
+        """Test that the declarations keep their lines for the errors."""
+        parser = CydcParser()
+        parser.build(use_cache=False)
+        code = parser.parse(input="[[\nCONST a = b\nCONST b = a\n]]Hi[[ END ]]")
+        with self.assertRaises(CodegenError) as cm:
+            self.codegen.generate_code(code)
+        self.assertIn("a (line 2) -> b (line 3) -> a (line 2)", str(cm.exception))
+
+    def test_source_locations_with_includes(self):
+        """Test that the errors show the file and line before the includes."""
+        with tempfile.TemporaryDirectory() as tmp:
+            Path(tmp, "lib.cyd").write_text("[[\n/* 1 */\n/* 2 */\n/* 3 */\n]]\n")
+            Path(tmp, "main.cyd").write_text(
+                '[[ INCLUDE "lib.cyd" ]]\n[[ CONST A = B + 1 ]]\n[[ CONST B = A + 1 ]]\n[[ END ]]\n'
+            )
+            (text, line_map) = CydcPreprocessor(base_path=tmp).preprocess(
+                os.path.join(tmp, "main.cyd")
+            )
+        parser = CydcParser()
+        parser.set_line_map(line_map)
+        parser.build(use_cache=False)
+        code = parser.parse(input=text)
+        with self.assertRaises(CodegenError) as cm:
+            self.codegen.generate_code(code)
+        self.assertIn("A (main.cyd:2) -> B (main.cyd:3) -> A (main.cyd:2)", str(cm.exception))
+
+
+class TestLayout(unittest.TestCase):
+    """Test the placement of the translated code on the banks."""
+
+    def setUp(self):
+        """Initialize code generator for each test."""
+        self.codegen = CydcCodegen(gettext)
+        self.code = []
+        for i in range(40):
+            self.code += [
+                ("LABEL", f"L{i}"),
+                ("TEXT", [1 + (i % 100)] * 100),
+                ("GOTO", f"L{(i + 2) % 40}", 0, 0),
+            ]
+        self.code += [("ARRAY", "a", None, [("CONSTANT", [("C_VAL", 7)])]), ("END",)]
+
+    def _set_banks(self, codegen, first_size):
+        codegen.set_bank_offset_list([0x10000 - 0x4000 - first_size, 0xC000])
+        codegen.set_bank_size_list([first_size, 0x4000])
+
+    def test_layouts_match_full_generation(self):
+        """Test that placing again the code gives the same bytes as generating it."""
+        self.codegen.translate_code(self.code, slice_text=True)
+        for size in (0x4000, 1000, 500):
+            with self.subTest(size=size):
+                self._set_banks(self.codegen, size)
+                chunks = self.codegen.layout_code()
+                codegen = CydcCodegen(gettext)
+                self._set_banks(codegen, size)
+                self.assertEqual(chunks, codegen.generate_code(self.code, slice_text=True))
+                self.assertEqual(self.codegen.symbols, codegen.symbols)
+
+    def test_references_between_banks(self):
+        """Test that the jumps get the bank and address of their labels."""
+        self.codegen.translate_code(self.code)
+        self._set_banks(self.codegen, 1000)
+        chunks = self.codegen.layout_code()
+        self.assertGreater(len(chunks), 1)
+        (bank, offset) = self.codegen.symbols["L39"]
+        self.assertGreater(bank, 0)
+        address = 0xC000 + offset
+        goto = [self.codegen.opcodes["GOTO"], bank, address & 0xFF, address >> 8]
+        found = [
+            i
+            for chunk in chunks
+            for i in range(len(chunk) - 3)
+            if chunk[i : i + 4] == goto
+        ]
+        self.assertTrue(found)
+
+    def test_if_goto_has_full_address(self):
+        """Test that the optimized IF_GOTO keeps the three bytes of the jump."""
+        code = [("PUSH_I", 1), ("NOT",), ("IF_N_GOTO", "L", 0, 0), ("LABEL", "L"), ("END",)]
+        chunks = self.codegen.generate_code(code)
+        ops = self.codegen.opcodes
+        self.assertEqual(chunks[0], [ops["PUSH_I"], 1, ops["IF_GOTO"], 0, 0x06, 0xC0, ops["END"]])
+
+
+class TestOptimizer(unittest.TestCase):
+    """Test the passes of the optimizer over the opcodes."""
+
+    def setUp(self):
+        """Initialize code generator for each test."""
+        self.codegen = CydcCodegen(gettext)
+
+    def _stats(self):
+        return {name: (i, b) for name, i, b in self.codegen.optimizer_stats}
+
+    def test_constant_folding(self):
+        """Test that the operations on constants give the values of the interpreter."""
+        cases = [
+            ([("PUSH_D", 200), ("PUSH_D", 100), ("ADD",)], 255),
+            ([("PUSH_D", 3), ("PUSH_D", 5), ("SUB",)], 0),
+            ([("PUSH_D", 3), ("PUSH_D", 5), ("CP_LT",)], 1),
+            ([("PUSH_D", 3), ("PUSH_D", 5), ("CP_MT",)], 0),
+            ([("PUSH_D", 5), ("PUSH_D", 5), ("CP_LE",), ("NOT",)], 0),
+            ([("PUSH_D", 1), ("NOT_B",)], 254),
+            ([("PUSH_D", 3), ("PUSH_D", 7), ("SHIFT_L",)], 128),
+            ([("PUSH_D", 1), ("PUSH_D", 2), ("PUSH_D", 3), ("ADD",), ("CP_NE",)], 1),
+        ]
+        for code, value in cases:
+            with self.subTest(code=code):
+                self.assertEqual(self.codegen.code_fold_constants(code), [("PUSH_D", value)])
+        code = [("PUSH_I", 1), ("PUSH_D", 2), ("ADD",)]
+        self.assertEqual(self.codegen.code_fold_constants(code), code)
+
+    def test_constant_conditions(self):
+        """Test jumps that are always or never taken."""
+        code = [
+            ("PUSH_D", 0),
+            ("IF_N_GOTO", "A", 0, 0),
+            ("PUSH_D", 2),
+            ("IF_N_GOTO", "B", 0, 0),
+            ("PUSH_D", 2),
+            ("IF_GOTO", "C", 0, 0),
+        ]
+        self.assertEqual(
+            self.codegen.code_fold_constants(code), [("GOTO", "A", 0, 0), ("GOTO", "C", 0, 0)]
+        )
+
+    def test_fusion(self):
+        """Test the instructions with their parameters on the code."""
+        code = [
+            ("PUSH_D", 1),
+            ("PUSH_D", 2),
+            ("PUSH_D", 3),
+            ("POP_AT",),
+            ("PUSH_I", 4),
+            ("POP_INK",),
+            ("PUSH_D", 5),
+            ("PUSH_D", 6),
+            ("POP_ALL_PUTATTR",),
+        ]
+        self.assertEqual(
+            self.codegen.code_fuse_instructions(code),
+            [("PUSH_D", 1), ("AT", 2, 3), ("INK_I", 4), ("POP_PUTATTR", 5, 6)],
+        )
+
+    def test_jump_threading(self):
+        """Test jumps to other jumps and over them."""
+        code = [
+            ("PUSH_I", 1),
+            ("IF_N_GOTO", "A", 0, 0),
+            ("GOTO", "B", 0, 0),
+            ("LABEL", "A"),
+            ("GOSUB", "C", 0, 0),
+            ("GOTO", "D", 0, 0),
+            ("LABEL", "D"),
+            ("LABEL", "B"),
+            ("END",),
+            ("LABEL", "C"),
+            ("GOTO", "E", 0, 0),
+            ("LABEL", "E"),
+            ("GOTO", "E", 0, 0),
+        ]
+        self.assertEqual(
+            self.codegen.code_thread_jumps(code),
+            [
+                ("PUSH_I", 1),
+                ("IF_GOTO", "B", 0, 0),
+                ("LABEL", "A"),
+                ("GOSUB", "E", 0, 0),
+                ("LABEL", "D"),
+                ("LABEL", "B"),
+                ("END",),
+                ("LABEL", "C"),
+                ("LABEL", "E"),
+                ("GOTO", "E", 0, 0),
+            ],
+        )
+
+    def test_dead_code_and_labels(self):
+        """Test that the code after a jump goes until a used label."""
+        code = [
+            ("GOTO", "B", 0, 0),
+            ("TEXT", [1, 245]),
+            ("ARRAY", "a", [1, 2]),
+            ("LABEL", "A"),
+            ("TEXT", [2, 245]),
+            ("LABEL", "B"),
+            ("PUSH_VAL_ARRAY", "a", 0, 0),
+            ("RETURN",),
+        ]
+        self.assertEqual(
+            self.codegen.code_simple_optimize(code),
+            [
+                ("GOTO", "B", 0, 0),
+                ("ARRAY", "a", [1, 2]),
+                ("LABEL", "B"),
+                ("PUSH_VAL_ARRAY", "a", 0, 0),
+                ("RETURN",),
+                ("END",),
+            ],
+        )
+        stats = self._stats()
+        self.assertEqual(stats["dead code"], (2, 6))
+        self.assertEqual(stats["unused labels"], (1, 0))
+
+    def test_redundant_settings(self):
+        """Test colors and positions set again before being used."""
+        code = [
+            ("INK_D", 2),
+            ("AT", 1, 1),
+            ("PAPER_D", 1),
+            ("AT", 2, 2),
+            ("INK_D", 3),
+            ("TEXT", [1, 245]),
+            ("INK_D", 3),
+            ("PAPER_D", 1),
+            ("AT", 2, 2),
+            ("INK_D", 8),
+            ("TEXT", [1, 245]),
+            ("LABEL", "A"),
+            ("INK_D", 8),
+        ]
+        self.assertEqual(
+            self.codegen.code_remove_redundant_settings(code),
+            [
+                ("PAPER_D", 1),
+                ("AT", 2, 2),
+                ("INK_D", 3),
+                ("TEXT", [1, 245]),
+                ("AT", 2, 2),
+                ("INK_D", 8),
+                ("TEXT", [1, 245]),
+                ("LABEL", "A"),
+                ("INK_D", 8),
+            ],
+        )
+
+    def test_merge_texts(self):
+        """Test that texts are joined only after a space."""
+        space = 255 - ord(" ")
+        code = [("TEXT", [1, space, 245]), ("TEXT", [2, 245]), ("TEXT", [3, 245])]
+        self.assertEqual(
+            self.codegen.code_merge_texts(code),
+            [("TEXT", [1, space, 2, 245]), ("TEXT", [3, 245])],
+        )
+
+    def test_unused_opcodes(self):
+        """Test that the opcodes removed by the optimizer are not needed."""
+        parser = CydcParser()
+        parser.build(use_cache=False)
+        code = parser.parse(input="[[ CONST c = 2\nINK c + 1\nIF 1 = 2 THEN BORDER 1 ENDIF\nEND ]]")
+        unused = CydcCodegen(gettext).get_unused_opcodes(code)
+        self.assertIn("ADD", unused)
+        self.assertIn("BORDER_D", unused)
+        self.codegen.generate_code(code)
+        ops = {c[0] for c in self.codegen.code_simple_optimize(self.codegen.code_extract_declarations(code)[0])}
+        self.assertEqual(ops & unused, set())
+        self.assertEqual(self.codegen.code[0][:2], [self.codegen.opcodes["INK_D"], 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import contextlib
+import io
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import cyd
+import cydc
+from cydc_tap import read_tap
+from test_interpreter_build import _FakeAssembler
+
+SOURCE = "[[ PAPER 0 ]]Hello world![[ WAITKEY ]]\n[[ END ]]\n"
+
+
+class TestCompileApi(unittest.TestCase):
+    def setUp(self):
+        cyd._interpreter_images.clear()
+        cyd._tape_loaders.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(cyd._interpreter_images.clear)
+        self.addCleanup(cyd._tape_loaders.clear)
+        patcher = patch("cyd.run_assembler", side_effect=_FakeAssembler())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.dict(os.environ, {"CYDC_CACHE_DIR": os.path.join(self.tmp.name, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write_source(self, text):
+        path = os.path.join(self.tmp.name, "game.cyd")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_result_is_kept_in_memory(self):
+        source = self._write_source(SOURCE)
+        result = cydc.compile(source, {"sjasmplus_path": "tools/sjasmplus.exe"})
+        self.assertEqual(result.target, "game.tap")
+        blocks = read_tap(result.data)
+        self.assertEqual(blocks[0][0], 0)
+        self.assertIn("Compilation successful", result.log)
+        self.assertEqual(result.dependencies[0], os.path.abspath(source))
+        self.assertTrue(result.memory_map)
+        for bank, used, free in result.memory_map:
+            self.assertGreater(used, 0)
+            self.assertGreaterEqual(free, 0)
+        self.assertGreater(result.interpreter_size, 0)
+        self.assertNotIn("game.tap", os.listdir(self.tmp.name))
+
+    def test_options_use_the_long_names(self):
+        source = self._write_source(SOURCE)
+        log = io.StringIO()
+        result = cydc.compile(
+            source,
+            {
+                "sjasmplus_path": "tools/sjasmplus.exe",
+                "model": "128k",
+                "output_path": self.tmp.name,
+                "name": "other",
+                "no_cache": True,
+            },
+            log=log,
+        )
+        self.assertEqual(result.target, "other.tap")
+        self.assertEqual(Path(self.tmp.name, "other.tap").read_bytes(), result.data)
+        self.assertEqual(result.log, "")
+        self.assertIn("Compilation successful", log.getvalue())
+
+    def test_profile(self):
+        source = self._write_source(SOURCE)
+        profile_path = os.path.join(self.tmp.name, "profile.json")
+        pstats_path = os.path.join(self.tmp.name, "profile.pstats")
+        cydc.compile(
+            source,
+            {
+                "sjasmplus_path": "tools/sjasmplus.exe",
+                "profile_json": profile_path,
+                "profile_memory": True,
+                "cprofile": pstats_path,
+            },
+        )
+        with open(profile_path, encoding="utf-8") as f:
+            profile = json.load(f)
+        self.assertEqual(profile["version"], cydc.PROFILE_VERSION)
+        self.assertEqual(profile["model"], "48k")
+        self.assertGreater(profile["peak_memory"], 0)
+        stages = {stage["name"]: stage for stage in profile["stages"]}
+        self.assertIn("parse", stages)
+        self.assertIn("texts", profile["critical_path"])
+        for key in ("wall", "cpu", "peak_memory", "input_size", "output_size", "external"):
+            self.assertIn(key, stages["texts"])
+        self.assertGreater(stages["parse"]["input_size"], 0)
+        stats = pstats.Stats(pstats_path)
+        self.assertTrue(any(func[2] == "texts_stage" for func in stats.stats))
+
+    def test_reused_images_need_no_process(self):
+        source = self._write_source(SOURCE)
+        images = os.path.join(self.tmp.name, "IMAGES")
+        os.mkdir(images)
+        shutil.copy(Path(__file__).parent.parent / "examples" / "CYD_presents" / "IMAGES" / "001.scr", images)
+        options = {"sjasmplus_path": "tools/sjasmplus.exe", "images_path": images, "verbose": 1}
+        result = cydc.compile(source, options)
+        # The report of the child process is in the log of the build
+        self.assertIn("Compressing file " + os.path.join(images, "001.scr"), result.log)
+        self.assertTrue(os.path.isfile(os.path.join(images, "001.csc")))
+        with patch("cydc_stages.ProcessPoolExecutor", side_effect=AssertionError("Process started")):
+            second = cydc.compile(source, options)
+        self.assertIn("it is up to date", second.log)
+        self.assertEqual(second.data, result.data)
+
+    def test_code_errors_are_reported(self):
+        source = self._write_source("[[ GOTO Nowhere ]]\n")
+        with self.assertRaises(cydc.CompileError) as cm:
+            cydc.compile(source, {"sjasmplus_path": "tools/sjasmplus.exe"})
+        self.assertTrue(cm.exception.diagnostics)
+        self.assertEqual(cm.exception.message, cm.exception.diagnostics[0][1])
+
+    def test_wrong_options(self):
+        source = self._write_source(SOURCE)
+        with self.assertRaises(ValueError):
+            cydc.compile(source, {"sjasmplus_path": "tools/sjasmplus.exe", "unknown": 1})
+        with self.assertRaises(cydc.CompileError) as cm:
+            cydc.compile(
+                source, {"sjasmplus_path": "tools/sjasmplus.exe", "images_path": os.path.join(self.tmp.name, "no")}
+            )
+        self.assertFalse(cm.exception.diagnostics)
+        with self.assertRaises(cydc.CompileError):
+            cydc.compile(os.path.join(self.tmp.name, "missing.cyd"), {"sjasmplus_path": "tools/sjasmplus.exe"})
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        cyd._interpreter_images.clear()
+        cyd._tape_loaders.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(cyd._interpreter_images.clear)
+        self.addCleanup(cyd._tape_loaders.clear)
+        self.assembler = _FakeAssembler()
+        for patcher in (
+            patch("cyd.run_assembler", side_effect=self.assembler),
+            patch.dict(os.environ, {"CYDC_CACHE_DIR": os.path.join(self.tmp.name, "cache")}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.source = Path(self.tmp.name, "game.cyd")
+        self.source.write_text(SOURCE)
+        self.images = Path(self.tmp.name, "IMAGES")
+        self.images.mkdir()
+
+    def test_rebuilds_until_interrupted(self):
+        edits = [
+            "[[ GOTO Nowhere ]]\n",  # Broken, the error is shown and the files watched again
+            SOURCE.replace("Hello", "Bye"),
+        ]
+        watched = []
+
+        def wait_for_changes(paths, interval):
+            watched.append(paths)
+            if not edits:
+                raise KeyboardInterrupt()
+            self.source.write_text(edits.pop(0))
+            return [str(self.source)]
+
+        args = cydc.get_arg_parser().parse_args(
+            ["-img", str(self.images), "--watch", "48k", str(self.source), "tools/sjasmplus.exe", self.tmp.name]
+        )
+        output = io.StringIO()
+        with patch("cydc.wait_for_changes", side_effect=wait_for_changes), contextlib.redirect_stdout(
+            output
+        ), contextlib.redirect_stderr(output):
+            with self.assertRaises(KeyboardInterrupt):
+                cydc.watch(args)
+        log = output.getvalue()
+        self.assertEqual(log.count("Compilation successful"), 2)
+        self.assertIn("ERROR [PARSER]", log)
+        self.assertEqual(log.count("Changed: game.cyd"), 2)
+        self.assertEqual(len(watched), 3)
+        for paths in watched:
+            self.assertIn(str(self.source), paths)
+            self.assertIn(str(self.images), paths)
+        # The interpreter is only assembled once
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+        result = cydc.compile(str(self.source), {"sjasmplus_path": "tools/sjasmplus.exe"})
+        self.assertEqual(Path(self.tmp.name, "game.tap").read_bytes(), result.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import cyd
+import cydc_server
+from cydc_tap import read_tap
+from test_interpreter_build import _FakeAssembler
+
+SJASMPLUS = str(Path(__file__).parent.parent / "tools" / "sjasmplus.exe")
+
+
+class TestCompileServer(unittest.TestCase):
+    def setUp(self):
+        cyd._interpreter_images.clear()
+        cyd._tape_loaders.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(cyd._interpreter_images.clear)
+        self.addCleanup(cyd._tape_loaders.clear)
+        self.assembler = _FakeAssembler()
+        for patcher in (
+            patch("cyd.run_assembler", side_effect=self.assembler),
+            patch.dict(os.environ, {"CYDC_CACHE_DIR": os.path.join(self.tmp.name, "cache")}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        Path(self.tmp.name, "game.cyd").write_text("[[ PAPER 0 ]]Hello![[ WAITKEY : END ]]\n")
+
+    def _start(self, idle_timeout=60):
+        server = cydc_server.CompileServer(idle_timeout)
+        thread = threading.Thread(target=server.serve, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not cydc_server.is_server_running():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        return (server, thread)
+
+    def _compile(self, source="game.cyd"):
+        output = []
+        code = cydc_server.compile_on_server(
+            ["48k", source, SJASMPLUS, "."],
+            cwd=self.tmp.name,
+            output=lambda stream, text: output.append((stream, text)),
+        )
+        return (code, "".join(text for stream, text in output))
+
+    def test_no_server(self):
+        self.assertFalse(cydc_server.is_server_running())
+        self.assertIsNone(cydc_server.compile_on_server(["48k", "game.cyd"]))
+
+    def test_builds_reuse_the_server(self):
+        (server, thread) = self._start()
+        cwd = os.getcwd()
+        (code, output) = self._compile()
+        self.assertEqual(code, 0, output)
+        self.assertIn("Compilation successful", output)
+        self.assertEqual(os.getcwd(), cwd)
+        tap = Path(self.tmp.name, "game.tap").read_bytes()
+        self.assertEqual(read_tap(tap)[0][0], 0)
+
+        # The interpreter and the texts of the first build are reused
+        (code, output) = self._compile()
+        self.assertEqual(code, 0, output)
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+        self.assertIn("Texts unchanged", output)
+        self.assertEqual(Path(self.tmp.name, "game.tap").read_bytes(), tap)
+        self.assertEqual(server.builds, 2)
+
+        Path(self.tmp.name, "bad.cyd").write_text("[[ GOTO Nowhere ]]\n")
+        (code, output) = self._compile("bad.cyd")
+        self.assertEqual(code, 1)
+        self.assertIn("ERROR [PARSER]", output)
+        (code, output) = self._compile("missing.cyd")
+        self.assertNotEqual(code, 0)
+        self.assertIn("ERROR", output)
+
+        self.assertTrue(cydc_server.stop_server())
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(cydc_server.get_endpoint_path()))
+        self.assertIsNone(self._compile()[0])
+
+    def test_idle_server_exits(self):
+        (server, thread) = self._start(idle_timeout=0.2)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(cydc_server.is_server_running())
+
+    def test_other_sources_are_not_served(self):
+        (server, thread) = self._start()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(cydc_server.stop_server)
+        with patch("cydc_server.get_code_key", return_value="other"):
+            self.assertIsNone(cydc_server.connect())
+        self.assertTrue(cydc_server.is_server_running())
+
+
+if __name__ == "__main__":
+    unittest.main()
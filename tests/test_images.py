@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_cache import BuildCache
+from cydc_utils import compress_screen_files, get_screen_key
+
+IMAGES_DIR = Path(__file__).parent.parent / "examples" / "CYD_presents" / "IMAGES"
+
+
+class _FakeScreenCompress:
+    calls = []
+
+    def __init__(self, scr_data):
+        self.scr_data = scr_data
+
+    def convert_to_CSC(self, num_lines=192, force_mirror=False):
+        self.calls.append((bytes(self.scr_data[:4]), num_lines, force_mirror))
+        return (self.scr_data[:4] + [num_lines, int(force_mirror)], "")
+
+
+class TestCompressScreenFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = BuildCache(os.path.join(self.tmp.name, "cache"))
+        self.images = []
+        for i, data in enumerate((b"AAAA", b"BBBB", b"AAAA")):
+            path = os.path.join(self.tmp.name, f"{i:03d}.scr")
+            Path(path).write_bytes(data * 1728)
+            self.images.append(path)
+
+    def _compress(self, screens, cache=True):
+        _FakeScreenCompress.calls = []
+        with patch("cydc_utils.ScreenCompress", _FakeScreenCompress):
+            result = compress_screen_files(screens, cache=self.cache if cache else None)
+        return result, len(_FakeScreenCompress.calls)
+
+    def test_only_changed_images_are_compressed(self):
+        screens = [(path, 192, False) for path in self.images]
+        first, calls = self._compress(screens)
+        self.assertEqual(calls, 2)  # The first and last images are the same
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(first[1], list(b"BBBB") + [192, 0])
+
+        second, calls = self._compress(screens)
+        self.assertEqual(calls, 0)
+        self.assertEqual(second, first)
+
+        # Only the image with new parameters is compressed again
+        screens[1] = (self.images[1], 96, False)
+        third, calls = self._compress(screens)
+        self.assertEqual(calls, 1)
+        self.assertEqual(third[1], list(b"BBBB") + [96, 0])
+
+        Path(self.images[2]).write_bytes(b"CCCC" * 1728)
+        _result, calls = self._compress(screens)
+        self.assertEqual(calls, 1)
+
+    def test_without_cache(self):
+        screens = [(path, 192, False) for path in self.images]
+        self._compress(screens, cache=False)
+        _result, calls = self._compress(screens, cache=False)
+        self.assertEqual(calls, 2)
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_up_to_date_csc_files_are_reused(self):
+        screens = [(path, 192, False, path[:-4] + ".csc") for path in self.images]
+        first, calls = self._compress(screens, cache=False)
+        self.assertEqual(calls, 2)
+        self.assertEqual(Path(screens[1][3]).read_bytes(), bytes(first[1]))
+        mtime = os.stat(screens[1][3]).st_mtime_ns
+
+        # Without cache, as with --no-cache or on a new machine
+        second, calls = self._compress(screens, cache=False)
+        self.assertEqual(calls, 0)
+        self.assertEqual(second, first)
+        self.assertEqual(os.stat(screens[1][3]).st_mtime_ns, mtime)
+
+        # A CSC written for other parameters is compressed and written again
+        screens[1] = screens[1][:1] + (96,) + screens[1][2:]
+        third, calls = self._compress(screens, cache=False)
+        self.assertEqual(calls, 1)
+        self.assertEqual(Path(screens[1][3]).read_bytes(), bytes(third[1]))
+
+        # A CSC without key is not trusted
+        os.remove(screens[0][3] + ".key")
+        _result, calls = self._compress(screens, cache=False)
+        self.assertEqual(calls, 1)
+
+    def test_parallel_compression(self):
+        path = str(IMAGES_DIR / "001.scr")
+        result = compress_screen_files([(path, 192, False), (path, 96, False)], jobs=2)
+        self.assertEqual(bytes(result[0]), (IMAGES_DIR / "001.CSC").read_bytes())
+        self.assertEqual(result[1][2], 96)
+
+    def test_key_depends_on_parameters(self):
+        data = (IMAGES_DIR / "001.scr").read_bytes()
+        keys = {
+            get_screen_key(data),
+            get_screen_key(data, num_lines=96),
+            get_screen_key(data, force_mirror=True),
+            get_screen_key(data[::-1]),
+        }
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(get_screen_key(data), get_screen_key(bytearray(data), 192, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
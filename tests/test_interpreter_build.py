@@ -0,0 +1,653 @@
+import importlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+cyd = importlib.import_module("cyd")
+from cydc_cache import BuildCache
+from cydc_tap import TapFile, read_tap
+
+
+class _FakeResult:
+    returncode = 0
+
+    def __init__(self, stderr=""):
+        self.stderr = stderr
+
+
+# Fake interpreter: 64 bytes, GAME_ID at $8020
+FAKE_SIZE = 64
+FAKE_GAME_ID = 0x8020
+
+
+class _FakeAssembler:
+    def __init__(self):
+        self.calls = []
+        self.incbins = {}
+
+    def __call__(self, asm_path, asm, filename, listing=True, capture_output=False):
+        self.calls.append((str(filename), asm))
+        for path in re.findall(r'INCBIN\s+"([^"]+)"', asm):
+            self.incbins[path] = Path(path).read_bytes()
+        if "DEFINE BUILD_INTERPRETER" in asm:
+            m = re.search(r'SAVEBIN\s+"([^"]+)"', asm)
+            Path(m.group(1)).write_bytes(bytes([0xAA] * FAKE_SIZE))
+            return _FakeResult(
+                f"> SIZE_INTERPRETER={FAKE_SIZE} <\n"
+                f"> GAME_ID={FAKE_GAME_ID} <\n"
+            )
+        m = re.search(r'SAVETAP\s+"([^"]+)",BASIC', asm)
+        if m:
+            # BASIC loader: line header, REM, LOAD_TABLE and some code
+            table = asm.split("LOAD_TABLE:\n", 1)[1].split("\n\n", 1)[0]
+            program = bytes([0, 0, 0, 0, 0xEA])
+            program += bytes(int(v, 16) for v in re.findall(r"\$([0-9A-F]{2})", table))
+            tap = TapFile()
+            tap.add_program("loader", program + b"LOADER", autostart=10)
+            tap.write(m.group(1))
+        m = re.search(r'SAVEBIN\s+"([^"]+)"', asm)
+        if m and str(filename).endswith("cyd_loader_mld.asm"):
+            Path(m.group(1)).write_bytes(bytes([0xFF]) * 0x4000)
+        return _FakeResult()
+
+    def interpreter_builds(self):
+        return [c for c in self.calls if "DEFINE BUILD_INTERPRETER" in c[1]]
+
+
+def _find_sjasmplus():
+    """Returns the sjasmplus executable to use, None if there is none."""
+    root = Path(__file__).parent.parent
+    paths = [os.environ.get("SJASMPLUS")]
+    if os.name == "nt":
+        paths.append(str(root / "tools" / "sjasmplus.exe"))
+    paths += [str(root / "external" / "sjasmplus" / "sjasmplus"), shutil.which("sjasmplus")]
+    for path in paths:
+        if path and os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+SJASMPLUS = _find_sjasmplus()
+
+_Z80_REGS = ("b", "c", "d", "e", "h", "l", None, "a")  # None is (HL)
+
+
+def _run_z80(memory, pc, regs, stop):
+    """
+    Runs Z80 code until it returns or reaches an address in stop.
+
+    Only the instructions used by FIND_IN_INDEX are implemented, and only
+    the carry and zero flags.
+
+    Returns:
+        (registers, address of stop reached or None if it returned)
+    """
+    r = dict.fromkeys(("a", "b", "c", "d", "e", "h", "l", "ix"), 0)
+    r.update(regs)
+    stack = []
+    carry = zero = False
+
+    def fetch():
+        nonlocal pc
+        pc += 1
+        return memory[pc - 1]
+
+    def fetch_offset():
+        value = fetch()
+        return value - 256 if value > 127 else value
+
+    def get(reg):
+        return memory[r["h"] << 8 | r["l"]] if reg is None else r[reg]
+
+    for _step in range(10000):
+        if pc in stop:
+            return (r, pc)
+        op = fetch()
+        if 0x40 <= op < 0x80 and op != 0x76:  # LD r, r'
+            r[_Z80_REGS[op >> 3 & 7]] = get(_Z80_REGS[op & 7])
+        elif 0x80 <= op < 0xC0 or op == 0xFE:  # ADD/SUB/OR/CP A, r and CP n
+            alu = 7 if op == 0xFE else op >> 3 & 7
+            value = fetch() if op == 0xFE else get(_Z80_REGS[op & 7])
+            if alu == 0:
+                result = r["a"] + value
+                carry = result > 0xFF
+            elif alu in (2, 7):
+                result = r["a"] - value
+                carry = result < 0
+            elif alu == 6:
+                result = r["a"] | value
+                carry = False
+            else:
+                raise NotImplementedError(f"Opcode ${op:02X}")
+            zero = result & 0xFF == 0
+            if alu != 7:
+                r["a"] = result & 0xFF
+        elif op & 0xC7 == 0x06 and op != 0x36:  # LD r, n
+            r[_Z80_REGS[op >> 3 & 7]] = fetch()
+        elif op in (0x18, 0x20, 0x28, 0x30, 0x38):  # JR, JR NZ/Z/NC/C
+            offset = fetch_offset()
+            taken = {0x18: True, 0x20: not zero, 0x28: zero, 0x30: not carry, 0x38: carry}
+            if taken[op]:
+                pc += offset
+        elif op == 0x11:  # LD DE, nn
+            r["e"], r["d"] = fetch(), fetch()
+        elif op in (0x19, 0x29, 0x23):  # ADD HL, DE / ADD HL, HL / INC HL
+            hl = r["h"] << 8 | r["l"]
+            if op == 0x23:
+                hl += 1
+            else:
+                hl += (r["d"] << 8 | r["e"]) if op == 0x19 else hl
+                carry = hl > 0xFFFF
+            r["h"], r["l"] = hl >> 8 & 0xFF, hl & 0xFF
+        elif op == 0xE5:  # PUSH HL
+            stack.append(r["h"] << 8 | r["l"])
+        elif op == 0xC3:  # JP nn
+            pc = fetch() | fetch() << 8
+        elif op == 0xC9:  # RET
+            if stack:
+                raise AssertionError("Values left on the stack")
+            return (r, None)
+        elif op == 0xDD:
+            op = fetch()
+            if op == 0xE5:  # PUSH IX
+                stack.append(r["ix"])
+            elif op == 0xE1:  # POP IX
+                r["ix"] = stack.pop()
+            elif op == 0x19:  # ADD IX, DE
+                ix = r["ix"] + (r["d"] << 8 | r["e"])
+                carry = ix > 0xFFFF
+                r["ix"] = ix & 0xFFFF
+            elif op & 0xC7 == 0x46 and op != 0x76:  # LD r, (IX+d)
+                r[_Z80_REGS[op >> 3 & 7]] = memory[(r["ix"] + fetch_offset()) & 0xFFFF]
+            else:
+                raise NotImplementedError(f"Opcode $DD ${op:02X}")
+        else:
+            raise NotImplementedError(f"Opcode ${op:02X}")
+    raise AssertionError("The code doesn't end")
+
+
+class TestInterpreterBuild(unittest.TestCase):
+    def setUp(self):
+        cyd._interpreter_images.clear()
+        cyd._tape_loaders.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.assembler = _FakeAssembler()
+        patcher = patch("cyd.run_assembler", side_effect=self.assembler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(cyd._interpreter_images.clear)
+        self.addCleanup(cyd._tape_loaders.clear)
+
+    def _build(self, model="48k", tokens=(0x80,), unused_opcodes=None, cache=None):
+        return cyd.build_interpreter(
+            sjasmplus_path="tools/sjasmplus.exe",
+            output_path=self.tmp.name,
+            verbose=False,
+            model=model,
+            tokens=list(tokens),
+            chars=[0] * 8,
+            charw=[8],
+            sfx_asm=None,
+            unused_opcodes=unused_opcodes,
+            cache=cache,
+        )
+
+    def test_symbols_and_size_are_read(self):
+        interpreter = self._build()
+        self.assertEqual(interpreter.size, FAKE_SIZE)
+        self.assertEqual(interpreter.symbols["GAME_ID"], FAKE_GAME_ID)
+        self.assertEqual(len(interpreter.code), FAKE_SIZE)
+        self.assertFalse((Path(self.tmp.name) / "__INTERP.BIN").exists())
+
+    def test_interpreter_is_assembled_once_per_inputs(self):
+        first = self._build()
+        second = self._build()
+        self.assertIs(first, second)
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+        self._build(tokens=(0x81,))
+        self._build(unused_opcodes={"BORDER"})
+        self._build(model="128k")
+        self.assertEqual(len(self.assembler.interpreter_builds()), 4)
+
+    def test_link_patches_game_id_and_appends_index(self):
+        interpreter = self._build()
+        index = [(1, 2, 3, 0xC000), (0, 0, 0, 0x8123)]
+        linked = interpreter.link(index, "MYGAME")
+        self.assertEqual(len(linked), FAKE_SIZE + cyd.get_index_size(len(index)))
+        pos = FAKE_GAME_ID - 0x8000
+        self.assertEqual(bytes(linked[pos : pos + 16]), b"MYGAME" + bytes(10))
+        self.assertEqual(bytes(linked[FAKE_SIZE:]), bytes(cyd.get_index_bytes(index)))
+        # The assembled image is left untouched
+        self.assertEqual(interpreter.code[pos : pos + 16], bytes([0xAA] * 16))
+
+    def _do_asm_48(self, interpreter, blocks, loading_scr=None, cache=None):
+        cyd.do_asm_48(
+            sjasmplus_path="tools/sjasmplus.exe",
+            output_path=self.tmp.name,
+            verbose=False,
+            tap_name="test",
+            index=[(0, 0, 0, 0x8045)],
+            blocks=blocks,
+            banks=[0] * len(blocks),
+            size_interpreter=interpreter.size,
+            bank0_offset=0x8045,
+            tokens=[0x80],
+            chars=[0] * 8,
+            charw=[8],
+            sfx_asm=None,
+            loading_scr=loading_scr,
+            name="test",
+            interpreter=interpreter,
+            cache=cache,
+        )
+        return read_tap((Path(self.tmp.name) / "test.tap").read_bytes())
+
+    def test_do_asm_48_writes_tap_without_assembling_data(self):
+        interpreter = self._build()
+        tap = self._do_asm_48(interpreter, [[1, 2, 3]])
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+        self.assertEqual(len(self.assembler.calls), 2)  # Interpreter and loader
+        self.assertEqual([flag for flag, data in tap], [0, 255, 255, 255])
+        self.assertEqual(tap[0][1][1:11], b"test      ")
+        size = interpreter.size + cyd.get_index_size(1)
+        self.assertEqual(
+            tap[1][1],
+            bytes([0, 0, 0, 0, 0xEA])
+            + bytes([0x00, 0x80, size & 0xFF, size >> 8, 0x45, 0x80, 3, 0, 0, 0])
+            + b"LOADER",
+        )
+        self.assertEqual(tap[2][1], bytes(interpreter.link([(0, 0, 0, 0x8045)], "test")))
+        self.assertEqual(tap[3][1], bytes([1, 2, 3]))
+        self.assertEqual(os.listdir(self.tmp.name), ["test.tap"])
+
+        # Same number of blocks: the loader is reused, only the table changes
+        tap = self._do_asm_48(interpreter, [[4, 5]])
+        self.assertEqual(len(self.assembler.calls), 2)
+        self.assertEqual(tap[1][1][11:13], bytes([2, 0]))
+        self.assertEqual(tap[3][1], bytes([4, 5]))
+
+        tap = self._do_asm_48(interpreter, [[4, 5]], loading_scr=[7] * 6912)
+        self.assertEqual(len(self.assembler.calls), 3)
+        self.assertEqual(tap[1][1][5:9], bytes([0x00, 0x40, 0x00, 0x1B]))
+        self.assertEqual(tap[2][1], bytes([7] * 6912))
+
+    def test_tape_loader_is_cached(self):
+        cache = BuildCache(os.path.join(self.tmp.name, "cache"))
+        interpreter = self._build()
+        first = self._do_asm_48(interpreter, [[1, 2, 3]], cache=cache)
+        cyd._tape_loaders.clear()  # Simulate a new process
+        second = self._do_asm_48(interpreter, [[1, 2, 3]], cache=cache)
+        self.assertEqual(len(self.assembler.calls), 2)
+        self.assertEqual(second, first)
+
+    def test_tape_loader_rebuilt_when_its_source_changes(self):
+        interpreter = self._build()
+        self._do_asm_48(interpreter, [[1, 2, 3]])
+        template = cyd.get_asm_template
+
+        def edited_template(filename):
+            t = template(filename)
+            if filename == "loadertape":
+                t.template = "; Edited\n" + t.template
+            return t
+
+        # Same process, as in --watch or the compile server
+        with patch("cyd.get_asm_template", side_effect=edited_template):
+            self._do_asm_48(interpreter, [[1, 2, 3]])
+        loaders = [c for c in self.assembler.calls if c[0].endswith("cyd_loader.asm")]
+        self.assertEqual(len(loaders), 2)
+        self.assertTrue(loaders[1][1].startswith("; Edited"))
+
+    def test_do_asm_plus3_appends_blocks(self):
+        interpreter = self._build(model="plus3")
+        dsk_path = Path(self.tmp.name) / "test.BIN"
+
+        def fake_assembler(asm_path, asm, filename, listing=True, capture_output=False):
+            dsk_path.write_bytes(b"INT")
+            return self.assembler(asm_path, asm, filename, listing, capture_output)
+
+        with patch("cyd.run_assembler", side_effect=fake_assembler):
+            cyd.do_asm_plus3(
+                sjasmplus_path="tools/sjasmplus.exe",
+                output_path=self.tmp.name,
+                verbose=False,
+                dsk_name="test",
+                index=[(0, 0, 0, 0x8045), (0, 1, 1, 0xC000)],
+                blocks=[[1, 2, 3], [4, 5]],
+                banks=[0, 1],
+                size_interpreter=interpreter.size,
+                bank0_offset=0x8045,
+                tokens=[0x80],
+                chars=[0] * 8,
+                charw=[8],
+                sfx_asm=None,
+                loading_scr=[7] * 6912,
+                name="test",
+                interpreter=interpreter,
+            )
+        self.assertEqual(dsk_path.read_bytes(), b"INT" + bytes([1, 2, 3, 4, 5]))
+        filename, asm = self.assembler.calls[-1]
+        self.assertNotIn("START_BLOCK_0", asm)
+        scr_path = os.path.join(self.tmp.name, "__LOADSCR.BIN").replace(os.sep, "/")
+        self.assertEqual(self.assembler.incbins[scr_path], bytes([7] * 6912))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["test.BIN"])
+
+    def test_do_asm_mld_links_remapped_index(self):
+        interpreter = self._build(model="mld")
+        cyd.do_asm_mld(
+            sjasmplus_path="tools/sjasmplus.exe",
+            output_path=self.tmp.name,
+            verbose=False,
+            mld_name="test",
+            index=[(0, 0, 0, 0x9000), (1, 0, 3, 0xC000)],
+            blocks=[bytes([1] * 32), bytes([2] * 32)],
+            banks=[0, 3],
+            size_interpreter=interpreter.size,
+            bank0_offset=0x8000,
+            tokens=[0x80],
+            chars=[0] * 8,
+            charw=[8],
+            sfx_asm=None,
+            mld_type="$83",
+            name="TEST",
+            interpreter=interpreter,
+        )
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+        mld = (Path(self.tmp.name) / "test.MLD").read_bytes()
+        slot1 = mld[0x4000:0x8000]
+        # TXT and SCR entries carry Dandanator slot IDs 2 and 3
+        start = FAKE_SIZE + cyd.INDEX_HEADER_SIZE
+        self.assertEqual(
+            slot1[start : start + 10],
+            bytes([0, 0, 2, 0x00, 0x90, 1, 0, 3, 0x00, 0xC0]),
+        )
+
+    def test_disk_cache_reused_across_processes(self):
+        cache = BuildCache(os.path.join(self.tmp.name, "cache"))
+        first = self._build(cache=cache)
+        cyd._interpreter_images.clear()  # Simulate a new process
+        second = self._build(cache=cache)
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+        self.assertEqual(second.code, first.code)
+        self.assertEqual(second.symbols, first.symbols)
+        cyd._interpreter_images.clear()
+        self._build(tokens=(0x81,), cache=cache)
+        self.assertEqual(len(self.assembler.interpreter_builds()), 2)
+
+    def test_token_table_is_assembled_when_requested(self):
+        self._build()
+        cyd.build_interpreter(
+            sjasmplus_path="tools/sjasmplus.exe",
+            output_path=self.tmp.name,
+            verbose=False,
+            model="plus3",
+            tokens=[ord("a"), 0x80 + ord("b"), 0x80 + ord("c")],
+            chars=[0] * 8,
+            charw=[8],
+            sfx_asm=None,
+            token_table=True,
+        )
+        builds = self.assembler.interpreter_builds()
+        self.assertEqual(len(builds), 2)
+        self.assertNotIn("DEFINE USE_TOKEN_TABLE", builds[0][1])
+        self.assertNotIn("TOKEN_OFFSETS:", builds[0][1])
+        asm = builds[1][1]
+        self.assertIn("DEFINE USE_TOKEN_TABLE", asm)
+        self.assertLess(asm.index("DEFINE USE_TOKEN_TABLE"), asm.index("PRINT_TOKEN_STR:"))
+        self.assertIn("TOKEN_OFFSETS:\n    DEFW TOKENS+$0\n    DEFW TOKENS+$2\n", asm)
+
+    def test_disk_cache_invalidated_by_templates(self):
+        cache = BuildCache(os.path.join(self.tmp.name, "cache"))
+        self._build(cache=cache)
+        cyd._interpreter_images.clear()
+        with patch("cyd.hash_files", side_effect=lambda h, paths: h.update(b"edited")):
+            self._build(cache=cache)
+        self.assertEqual(len(self.assembler.interpreter_builds()), 2)
+
+    def test_disk_cache_invalidated_by_generated_source(self):
+        cache = BuildCache(os.path.join(self.tmp.name, "cache"))
+        self._build(cache=cache)
+        cyd._interpreter_images.clear()
+        # Same inputs, but a compiler that writes the tokens in another way
+        with patch("cyd.bytes2str", side_effect=lambda b, *args: "DB 0"):
+            self._build(cache=cache)
+        self.assertEqual(len(self.assembler.interpreter_builds()), 2)
+
+    def test_cache_shared_between_output_paths(self):
+        cache = BuildCache(os.path.join(self.tmp.name, "cache"))
+        self._build(cache=cache)
+        cyd._interpreter_images.clear()
+        with tempfile.TemporaryDirectory() as other:
+            cyd.build_interpreter(
+                sjasmplus_path="tools/sjasmplus.exe",
+                output_path=other,
+                verbose=False,
+                model="48k",
+                tokens=[0x80],
+                chars=[0] * 8,
+                charw=[8],
+                sfx_asm=None,
+                cache=cache,
+            )
+        self.assertEqual(len(self.assembler.interpreter_builds()), 1)
+
+
+def find_in_index(data, entry_type, entry_idx):
+    # Same steps as FIND_IN_INDEX, returns (bank, offset) or None
+    if entry_type >= cyd.INDEX_NUM_TYPES:
+        return None
+    h = 4 * entry_type
+    first = data[h] + 256 * data[h + 1]
+    if first == 0 or entry_idx < data[h + 2]:
+        return None
+    pos = first + cyd.INDEX_ENTRY_SIZE * min(entry_idx - data[h + 2], data[h + 3])
+    while data[pos + 1] != entry_idx:
+        if data[pos + 1] < entry_idx:
+            return None
+        pos -= cyd.INDEX_ENTRY_SIZE
+    return (data[pos + 2], data[pos + 3] + 256 * data[pos + 4])
+
+
+class TestIndexLayout(unittest.TestCase):
+    def test_entries_are_sorted_after_header(self):
+        index = [(1, 5, 3, 0xC000), (0, 1, 1, 0xC000), (0, 0, 0, 0x9000), (2, 0, 4, 0xC100)]
+        data = cyd.get_index_bytes(index)
+        self.assertEqual(len(data), cyd.get_index_size(4))
+        header = cyd.INDEX_HEADER_SIZE
+        self.assertEqual(data[:header], [header, 0, 0, 1, header + 10, 0, 5, 0, header + 15, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(data[header : header + 2], [0, 0])
+        self.assertEqual(data[header + 10 : header + 12], [1, 5])
+
+    def test_lookup(self):
+        images = [0, 1, 2, 5, 6, 9, 200, 255]
+        index = [(0, i, i % 8, 0xC000 + i) for i in range(20)]
+        index += [(1, i, 3, 0xD000 + i) for i in images]
+        index += [(3, 7, 1, 0xE000)]
+        data = cyd.get_index_bytes(index)
+        for entry_type, entry_idx, bank, offset in index:
+            self.assertEqual(find_in_index(data, entry_type, entry_idx), (bank, offset))
+        for entry_type, entry_idx in ((0, 20), (1, 3), (1, 100), (1, 254), (2, 0), (3, 6), (3, 8), (4, 0)):
+            self.assertIsNone(find_in_index(data, entry_type, entry_idx))
+        self.assertIn("    DEFW $10\n    DEFB $0, $13\n", cyd.get_index_asm(index))
+
+    def test_duplicated_entries_are_rejected(self):
+        with self.assertRaises(ValueError):
+            cyd.get_index_bytes([(1, 0, 3, 0xC000), (1, 0, 4, 0xC000)])
+
+
+class TestTokenTable(unittest.TestCase):
+    # Tokens "ab", "c" and "de"
+    TOKENS = [ord("a"), 0x80 + ord("b"), 0x80 + ord("c"), ord("d"), 0x80 + ord("e")]
+
+    def test_offsets(self):
+        self.assertEqual(cyd.get_token_offsets(self.TOKENS), [0, 2, 3])
+        self.assertEqual(cyd.get_token_offsets([]), [])
+        self.assertEqual(cyd.get_token_offsets_asm(self.TOKENS), "")
+
+    def test_lookup_stats(self):
+        # "x", token 2, token 0 and the end of text, encoded like the compressor does
+        text = [c ^ 0xFF for c in (ord("x"), 130, 128, 0x0A)]
+        size, chars, scan, table = cyd.get_token_lookup_stats(self.TOKENS, [text])
+        self.assertEqual(size, 6)
+        self.assertEqual(chars, 6)
+        self.assertEqual(table, 2 * cyd.TOKEN_TABLE_TSTATES)
+        # Token 2 walks 3 characters, 2 of them the last one of a token
+        token0 = cyd.TOKEN_SCAN_TSTATES + 12
+        token2 = cyd.TOKEN_SCAN_TSTATES + 6 + cyd.TOKEN_SCAN_CHAR_TSTATES + 2 * cyd.TOKEN_SCAN_END_TSTATES
+        self.assertEqual(scan, token0 + token2)
+
+
+@unittest.skipIf(SJASMPLUS is None, "sjasmplus not found, set SJASMPLUS to its path")
+class TestAssembledInterpreter(unittest.TestCase):
+    """Assembles the real templates, checking what link() and the Z80 code rely on."""
+
+    MODELS = ("48k", "128k", "plus3", "mld", "mld128")
+    SYMBOLS = ("INDEX", "FIND_IN_INDEX", "SYS_ERROR", "TOKENS", "TOKEN_OFFSETS")
+    TOKENS = TestTokenTable.TOKENS
+    INDEX = [(0, i, i % 8, 0xC000 + i) for i in range(20)]
+    INDEX += [(1, i, 3, 0xD000 + i) for i in (0, 1, 2, 5, 6, 9, 200, 255)]
+    INDEX += [(3, 7, 1, 0xE000)]
+
+    def setUp(self):
+        cyd._interpreter_images.clear()
+        self.addCleanup(cyd._interpreter_images.clear)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _build(self, model, token_table):
+        # The addresses of other labels are shown like the ones build_interpreter() reads
+        names = [n for n in self.SYMBOLS if token_table or n != "TOKEN_OFFSETS"]
+        display = "".join(f'    DISPLAY "{n}=", /D, {n}, " <"\n' for n in names)
+        get_asm = cyd.get_asm_interpreter
+        with patch("cyd.get_asm_interpreter", lambda *args, **kwargs: get_asm(*args, **kwargs) + display):
+            return cyd.build_interpreter(
+                sjasmplus_path=SJASMPLUS,
+                output_path=self.tmp.name,
+                verbose=False,
+                model=model,
+                tokens=self.TOKENS,
+                chars=[0] * 8,
+                charw=[8],
+                sfx_asm=None,
+                token_table=token_table,
+            )
+
+    def test_templates(self):
+        for model in self.MODELS:
+            for token_table in (False, True):
+                with self.subTest(model=model, token_table=token_table):
+                    interpreter = self._build(model, token_table)
+                    self._check_layout(interpreter, token_table)
+                    self._check_find_in_index(interpreter)
+
+    def _check_layout(self, interpreter, token_table):
+        symbols = interpreter.symbols
+        # The index is appended right where FIND_IN_INDEX reads it
+        self.assertEqual(symbols["INDEX"], interpreter.start + interpreter.size)
+        self.assertEqual(len(interpreter.code), interpreter.size)
+        pos = symbols["GAME_ID"] - interpreter.start
+        self.assertEqual(interpreter.code[pos : pos + cyd.GAME_ID_SIZE], bytes(cyd.GAME_ID_SIZE))
+        linked = interpreter.link(self.INDEX, "TEST")
+        self.assertEqual(bytes(linked[pos : pos + cyd.GAME_ID_SIZE]), b"TEST" + bytes(cyd.GAME_ID_SIZE - 4))
+        self.assertEqual(bytes(linked[interpreter.size :]), bytes(cyd.get_index_bytes(self.INDEX)))
+        pos = symbols["TOKENS"] - interpreter.start
+        self.assertEqual(interpreter.code[pos : pos + len(self.TOKENS)], bytes(self.TOKENS))
+        if token_table:
+            pos = symbols["TOKEN_OFFSETS"] - interpreter.start
+            for offset in cyd.get_token_offsets(self.TOKENS):
+                address = interpreter.code[pos] | interpreter.code[pos + 1] << 8
+                self.assertEqual(address, symbols["TOKENS"] + offset)
+                pos += 2
+
+    def _check_find_in_index(self, interpreter):
+        memory = bytearray(0x10000)
+        linked = interpreter.link(self.INDEX)
+        memory[interpreter.start : interpreter.start + len(linked)] = linked
+        entries = {(t, i): (bank, offset) for t, i, bank, offset in self.INDEX}
+        sys_error = interpreter.symbols["SYS_ERROR"]
+        for entry_type in range(cyd.INDEX_NUM_TYPES + 1):
+            for entry_idx in range(256):
+                (regs, stopped) = _run_z80(
+                    memory,
+                    interpreter.symbols["FIND_IN_INDEX"],
+                    dict(b=entry_type, c=entry_idx, ix=0x1234),
+                    {sys_error},
+                )
+                if (entry_type, entry_idx) in entries:
+                    self.assertIsNone(stopped)
+                    self.assertEqual(regs["ix"], 0x1234)
+                    self.assertEqual((regs["a"], regs["h"] << 8 | regs["l"]), entries[(entry_type, entry_idx)])
+                else:
+                    self.assertEqual(stopped, sys_error)
+
+
+class TestBytes2Str(unittest.TestCase):
+    def test_lines_of_16_bytes(self):
+        from cydc_utils import bytes2str
+
+        self.assertEqual(bytes2str([]), "")
+        self.assertEqual(bytes2str([], "X:\n"), "X:\n")
+        text = bytes2str(list(range(17)) + [255], "X:\n")
+        self.assertEqual(
+            text,
+            "X:\n    DEFB " + ", ".join(f"${i:02X}" for i in range(16)) + "\n    DEFB $10, $FF\n",
+        )
+        self.assertEqual(bytes2str(bytes(range(17))), bytes2str(list(range(17))))
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_get_returns_stored_files(self):
+        cache = BuildCache(self.tmp.name)
+        self.assertIsNone(cache.get("abc"))
+        self.assertTrue(cache.put("abc", {"a.bin": b"123", "b.json": b"{}"}))
+        self.assertEqual(cache.get("abc"), {"a.bin": b"123", "b.json": b"{}"})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = BuildCache(self.tmp.name, max_size=250)
+        cache.put("old", {"f": bytes(100)})
+        cache.put("mid", {"f": bytes(100)})
+        os.utime(os.path.join(self.tmp.name, "old"), (1000, 1000))
+        os.utime(os.path.join(self.tmp.name, "mid"), (2000, 2000))
+        cache.get("old")  # Refreshes it, so "mid" is now the oldest
+        cache.put("new", {"f": bytes(100)})
+        self.assertIsNone(cache.get("mid"))
+        self.assertIsNotNone(cache.get("old"))
+        self.assertIsNotNone(cache.get("new"))
+
+
+@unittest.skipIf(shutil.which("true") is None, "needs the true command")
+class TestExternalCalls(unittest.TestCase):
+    def test_assembler_calls_are_recorded(self):
+        utils = importlib.import_module("cydc_utils")
+        with tempfile.TemporaryDirectory() as tmp:
+            asm_file = os.path.join(tmp, "test.asm")
+            utils.run_assembler(shutil.which("true"), "", asm_file)  # Not recorded
+            utils.record_external_calls(True)
+            try:
+                utils.run_assembler(shutil.which("true"), "  NOP\n", asm_file)
+            finally:
+                calls = utils.record_external_calls(False)
+            self.assertFalse(os.path.exists(asm_file))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0]["program"], "true")
+        self.assertEqual(calls[0]["file"], "test.asm")
+        self.assertGreater(calls[0]["wall"], 0)
+        self.assertGreaterEqual(calls[0]["cpu"], 0)
+        self.assertEqual(utils.record_external_calls(False), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -351,6 +351,35 @@ class TestLexerRegressions(unittest.TestCase):
         token_types = [t.type for t in tokens]
         self.assertIn("COLON", token_types)
 
+    def test_text_run_with_brackets(self):
+        """Test that single brackets stay inside the text run."""
+        self.lexer.input("A [door] and [[ PRINT 1 ]]x[[[ 1 ]]")
+        tokens = [(t.type, t.value) for t in self.lexer.lexer]
+        self.assertEqual(tokens[0], ("TEXT", ("TEXT", "A [door] and ")))
+        self.assertEqual(tokens[4], ("TEXT", ("TEXT", "x")))
+        self.assertEqual(tokens[5][0], "LCARET")
+
+    def test_text_run_line_numbers(self):
+        """Test that line breaks inside text runs advance the line number."""
+        self.lexer.input("one\r\ntwo\rthree\n\n[[ END ]]\nfour\n[[ END ]]")
+        tokens = list(self.lexer.lexer)
+        self.assertEqual(tokens[0].value, ("TEXT", "one\r\rtwo\rthree\r\r"))
+        self.assertEqual([t.lineno for t in tokens if t.type == "END"], [5, 7])
+
+    def test_text_special_chars(self):
+        """Test the conversion of the special characters of the texts."""
+        self.lexer.input("ªÑÁ«ý—’")
+        tokens = list(self.lexer.lexer)
+        self.assertEqual(tokens[0].value, ("TEXT", "\x10\x1bA\x13y-'"))
+
+    def test_text_encoding_errors(self):
+        """Test that unknown characters are reported with their position."""
+        self.lexer.input("ok\nab€[[ END ]]")
+        tokens = list(self.lexer.lexer)
+        self.assertEqual(tokens[0].type, "ERROR_TEXT")
+        self.assertEqual(tokens[0].value, ("ERROR_TEXT", [(3, 2, "€")]))
+        self.assertEqual(self.lexer.errors[0]["column"], 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,78 @@
+import random
+import sys
+import unittest
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_packing import (
+    pack_best_fit,
+    pack_blocks,
+    pack_blocks_best_fit,
+    pack_exact,
+    pack_first_fit_decreasing,
+)
+
+
+def _check(test, sizes, free, placement):
+    used = [0] * len(free)
+    for size, bank in zip(sizes, placement):
+        used[bank] += size
+    for u, f in zip(used, free):
+        test.assertLessEqual(u, f)
+
+
+class TestPacking(unittest.TestCase):
+    def test_best_fit_keeps_the_order(self):
+        self.assertEqual(pack_best_fit([5, 5, 4], [10, 10]), [0, 0, 1])
+        self.assertIsNone(pack_best_fit([2, 5, 4, 4, 5], [10, 10]))
+        self.assertEqual(pack_blocks_best_fit([2, 5, 4, 4, 5], [10, 10, 10], 1), ([0, 0, 1, 1, 2], 3))
+
+    def test_fewer_banks_than_best_fit(self):
+        sizes = [2, 5, 4, 4, 5]
+        (placement, num_banks) = pack_blocks(sizes, [10, 10, 10], 1)
+        self.assertEqual(num_banks, 2)
+        _check(self, sizes, [10, 10], placement)
+
+    def test_exact_when_first_fit_decreasing_fails(self):
+        sizes = [4, 4, 3, 3, 3, 3]
+        self.assertIsNone(pack_first_fit_decreasing(sizes, [10, 10]))
+        placement = pack_exact(sizes, [10, 10])
+        _check(self, sizes, [10, 10], placement)
+        self.assertEqual(pack_blocks(sizes, [10, 10], 1)[1], 2)
+        self.assertIsNone(pack_blocks(sizes, [10, 10], 1, exact=False))
+
+    def test_banks_of_different_sizes(self):
+        # Bank 0 after the interpreter and the 8K bank of the +3
+        free = [3000, 16384, 16384, 8192]
+        sizes = [6912, 6912, 6912, 6912, 2500, 6000]
+        (placement, num_banks) = pack_blocks(sizes, free, 1)
+        self.assertEqual(num_banks, 4)
+        _check(self, sizes, free[:num_banks], placement)
+        self.assertIsNone(pack_blocks(sizes + [6912], free, 1))
+
+    def test_impossible_and_empty(self):
+        self.assertIsNone(pack_exact([6, 6, 6], [10, 10]))
+        self.assertEqual(pack_exact([], [10]), [])
+        self.assertEqual(pack_blocks([], [10, 10], 2), ([], 2))
+        self.assertIsNone(pack_blocks([11], [10, 10], 1))
+        # Gives up on a search too long
+        self.assertIsNone(pack_exact([3] * 20 + [2], [7] * 9, max_nodes=10))
+
+    def test_never_worse_than_best_fit(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            free = [rng.randint(5, 30) for _ in range(rng.randint(1, 6))]
+            sizes = [rng.randint(1, 12) for _ in range(rng.randint(0, 10))]
+            previous = pack_blocks_best_fit(sizes, free, 1)
+            packing = pack_blocks(sizes, free, 1)
+            if previous is not None:
+                self.assertIsNotNone(packing)
+                self.assertLessEqual(packing[1], previous[1])
+            if packing is not None:
+                _check(self, sizes, free[: packing[1]], packing[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,14 +9,18 @@ This module tests the parser's ability to:
 - Detect and report syntax errors
 """
 
+import os
 import unittest
 import sys
+import tempfile
 from pathlib import Path
+from unittest.mock import patch
 
 # Add src to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
 
-from cydc_parser import CydcParser
+from cydc_parser import CydcParser, PARSETAB_VERSION
+from cydc_cache import load_pickle, save_pickle
 from cydc_lexer import CydcLexer
 
 
@@ -389,5 +393,60 @@ Choice 2
         self.assertIsNotNone(result)
 
 
+class TestParserTableCache(unittest.TestCase):
+    """Test the persistent LALR table cache used by CydcParser.build()."""
+
+    CODE = """Intro text
+[[ DECLARE 5 AS Counter : SET Counter TO 3 + 4 ]]
+[[ IF @Counter = 7 THEN GOTO Done ENDIF : LABEL Done : END ]]"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmp.name, "parsetab.pickle")
+        self.saved_tables = dict(CydcParser._tables)
+        CydcParser._tables.clear()
+
+    def tearDown(self):
+        CydcParser._tables.clear()
+        CydcParser._tables.update(self.saved_tables)
+        self.tmp.cleanup()
+
+    def test_tables_are_written_and_reused(self):
+        """Second build must come from the cache file and parse the same."""
+        first = CydcParser()
+        first.build(cache_file=self.cache_file)
+        self.assertTrue(os.path.isfile(self.cache_file))
+
+        CydcParser._tables.clear()
+        with patch("cydc_parser.yacc.yacc") as mocked_yacc:
+            second = CydcParser()
+            second.build(cache_file=self.cache_file)
+            mocked_yacc.assert_not_called()
+
+        reference = CydcParser()
+        reference.build(use_cache=False)
+        expected = reference.parse(input=self.CODE)
+        self.assertEqual(second.parse(input=self.CODE), expected)
+        self.assertEqual(second.errors, reference.errors)
+
+    def test_stale_cache_is_regenerated(self):
+        """A cache written for another grammar must be ignored."""
+        save_pickle(self.cache_file, PARSETAB_VERSION, "other-grammar", {})
+        parser = CydcParser()
+        parser.build(cache_file=self.cache_file)
+        self.assertIsNotNone(parser.parse(input=self.CODE))
+        self.assertIsNotNone(
+            load_pickle(self.cache_file, PARSETAB_VERSION, parser._grammar_key())
+        )
+
+    def test_corrupted_cache_is_ignored(self):
+        """Garbage in the cache file falls back to table generation."""
+        with open(self.cache_file, "wb") as f:
+            f.write(b"not a pickle")
+        parser = CydcParser()
+        parser.build(cache_file=self.cache_file)
+        self.assertIsNotNone(parser.parse(input=self.CODE))
+
+
 if __name__ == "__main__":
     unittest.main()
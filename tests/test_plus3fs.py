@@ -0,0 +1,77 @@
+import contextlib
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from mkp3fs import Plus3DosFilesystem
+from plus3fs import DSK_ERR, PLUS3FS
+
+FIXED_TIME = time.struct_time((2025, 3, 14, 15, 9, 26, 4, 73, 0))
+
+
+def _make_disk(size720, size, putc=False):
+    fs = Plus3DosFilesystem()
+    fs.add_file_data("DISK", bytes(range(256)) * 3 + b"\x01")
+    fs.add_file_data("CYD.BIN", bytes((i * 7) & 0xFF for i in range(size)))
+    fs.add_file_data("SCRIPT.BIN", bytes((i * 13) & 0xFF for i in range(2048)))
+    with tempfile.TemporaryDirectory() as tmp, patch(
+        "plus3fs.time.time", return_value=0
+    ), patch("plus3fs.time.localtime", return_value=FIXED_TIME), patch.object(
+        Plus3DosFilesystem, "report"
+    ):
+        patcher = contextlib.nullcontext()
+        if putc:
+            # Write byte by byte, like the original implementation
+            def write(fp, buf):
+                for c in buf:
+                    err = fp.p3fs_putc(c)
+                    if err != DSK_ERR.OK:
+                        return err
+                return DSK_ERR.OK
+
+            patcher = patch("plus3fs.PLUS3FILE.p3fs_write", write)
+        path = os.path.join(tmp, "test.dsk")
+        with patcher:
+            if not fs.make_plus3_disk(path, size720=size720, label="TEST"):
+                raise AssertionError("Disk not created")
+        return Path(path).read_bytes()
+
+
+class TestPlus3Disk(unittest.TestCase):
+    def test_images_are_unchanged(self):
+        # Digests of the images written by the byte by byte implementation
+        expected = {
+            (False, 40000): "40c7d132b42ad8b8dc85d265ea41f44ad6b9740e3b0ed482922188dff921c5fb",
+            (True, 40000): "c76f5c5371d0679e1d07db899bf1c0d8022c4cc7c124efce9c3aef7f1c9a69a0",
+            (True, 600000): "6fc859b3ff1fd98a7e4e61700220fb3a8a8693043ae9673eac753a4066708752",
+        }
+        for (size720, size), digest in expected.items():
+            with self.subTest(size720=size720, size=size):
+                data = _make_disk(size720, size)
+                self.assertEqual(len(data), 778496 if size720 else 194816)
+                self.assertEqual(hashlib.sha256(data).hexdigest(), digest)
+
+    def test_write_matches_putc(self):
+        for size in (0, 1, 2047, 2048, 2049, 4096 * 3):
+            with self.subTest(size=size):
+                self.assertEqual(_make_disk(False, size), _make_disk(False, size, putc=True))
+
+    def test_unformatted_sector(self):
+        fs = PLUS3FS(lambda s: None)
+        self.assertEqual(fs.p3fs_mkfs("x.dsk", "dsk", 180, Plus3DosFilesystem.BOOT_180, 1), 0)
+        self.assertEqual(fs.drive.dsk_lwrite(bytes(512), 9 * 40), DSK_ERR.SYSERR)
+        self.assertEqual(fs.drive.dsk_lwrite(bytes(256), 0), DSK_ERR.SYSERR)
+        self.assertEqual(fs.drive.dsk_lwrite(bytes(range(256)) * 2, 9), DSK_ERR.OK)
+        self.assertEqual(fs.drive.image[9 * 512 : 10 * 512], bytes(range(256)) * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
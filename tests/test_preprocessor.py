@@ -16,11 +16,19 @@ import sys
 import os
 import tempfile
 import shutil
+from unittest.mock import patch
 
 # Add the src directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "cydc", "cydc"))
 
-from cydc_preprocessor import CydcPreprocessor, PreprocessorError, SourceLocation
+from cydc_preprocessor import (
+    CydcPreprocessor,
+    PreprocessorError,
+    SourceLocation,
+    STATE_CODE,
+    STATE_COMMENT,
+    STATE_TEXT,
+)
 
 
 class TestPreprocessorBasic(unittest.TestCase):
@@ -476,6 +484,84 @@ INCLUDE "lib.cyd"
         result, _ = self.preprocessor.preprocess(filepath)
         self.assertIn('// Lib', result)
 
+    def test_brackets_in_comments_are_ignored(self):
+        """Test that [[ and ]] inside comments don't change the block state."""
+        self._write_file("lib.cyd", "[[// Lib]]")
+        filepath = self._write_file("main.cyd", """[[
+/* Closes with ]] */
+INCLUDE "lib.cyd"
+]]""")
+        
+        result, _ = self.preprocessor.preprocess(filepath)
+        self.assertIn('// Lib', result)
+    
+    def test_brackets_in_text_are_ignored(self):
+        """Test that ]] inside text doesn't close anything."""
+        filepath = self._write_file("main.cyd", """Some text ]] with brackets
+INCLUDE "lib.cyd"
+""")
+        
+        with self.assertRaises(PreprocessorError) as context:
+            self.preprocessor.preprocess(filepath)
+        self.assertIn("must be inside", str(context.exception).lower())
+    
+    def test_include_in_comment_is_kept(self):
+        """Test that a commented out INCLUDE is left untouched."""
+        filepath = self._write_file("main.cyd", """[[ /*
+INCLUDE "missing.cyd"
+*/ ]]""")
+        
+        result, _ = self.preprocessor.preprocess(filepath)
+        self.assertIn('INCLUDE "missing.cyd"', result)
+        self.assertNotIn('/* BEGIN INCLUDE:', result)
+    
+    def test_line_states(self):
+        """Test the lexical state recorded at the start of each line."""
+        self._write_file("lib.cyd", "[[// Lib]]")
+        filepath = self._write_file("main.cyd", """Text [[
+/* Comment
+INCLUDE "lib.cyd" */
+INCLUDE "lib.cyd"
+]] Text /* not a comment
+[[ ]]""")
+        
+        self.preprocessor.preprocess(filepath)
+        states = self.preprocessor.line_states[os.path.normpath(filepath)]
+        self.assertEqual(states, [
+            STATE_TEXT, STATE_CODE, STATE_COMMENT, STATE_CODE, STATE_CODE, STATE_TEXT, STATE_TEXT,
+        ])
+        lib_states = self.preprocessor.line_states[os.path.join(self.test_dir, "lib.cyd")]
+        self.assertEqual(lib_states, [STATE_TEXT, STATE_TEXT])
+
+    def test_source_files(self):
+        """Test that the processed files are listed in order of inclusion."""
+        self._write_file("b.cyd", "[[// B]]")
+        self._write_file("a.cyd", '[[INCLUDE "b.cyd"\n]]')
+        filepath = self._write_file("main.cyd", '[[INCLUDE "a.cyd"\n]]')
+        
+        self.preprocessor.preprocess(filepath)
+        self.assertEqual(
+            [os.path.basename(f) for f in self.preprocessor.source_files],
+            ["main.cyd", "a.cyd", "b.cyd"],
+        )
+    
+    def test_unchanged_files_are_not_read_again(self):
+        """Test that files are only read again when their stamp changes."""
+        lib = self._write_file("lib.cyd", "[[// Lib]]")
+        filepath = self._write_file("main.cyd", '[[INCLUDE "lib.cyd"\n]]')
+        
+        with patch.object(CydcPreprocessor, "_read_file", autospec=True,
+                          side_effect=CydcPreprocessor._read_file) as read_file:
+            self.preprocessor.preprocess(filepath)
+            CydcPreprocessor(base_path=self.test_dir).preprocess(filepath)
+            self.assertEqual(read_file.call_count, 2)
+            
+            self._write_file("lib.cyd", "[[// Library]]")
+            read_file.reset_mock()
+            result, _ = self.preprocessor.preprocess(filepath)
+            self.assertEqual(read_file.call_count, 1)
+            self.assertIn("// Library", result)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,145 @@
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_stages import StageScheduler, get_data_size
+
+
+def _get_pid(value):
+    return (value, os.getpid())
+
+
+class TestStageScheduler(unittest.TestCase):
+    def test_values_are_passed_between_stages(self):
+        scheduler = StageScheduler()
+        scheduler.add("split", lambda text: tuple(text.split()), ("text",), ("a", "b"))
+        scheduler.add("join", lambda a, b: b + a, ("a", "b"), ("joined",))
+        scheduler.add("upper", lambda joined: joined.upper(), ("joined",))
+        values = scheduler.run({"text": "foo bar"})
+        self.assertEqual(values["joined"], "barfoo")
+        self.assertEqual(values["upper"], "BARFOO")
+        self.assertEqual(values["text"], "foo bar")
+
+    def test_independent_stages_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_other():
+            barrier.wait()  # Only returns if both stages run at the same time
+            return True
+
+        scheduler = StageScheduler()
+        scheduler.add("first", wait_other)
+        scheduler.add("second", wait_other)
+        scheduler.add("last", lambda first, second: first and second, ("first", "second"))
+        self.assertTrue(scheduler.run()["last"])
+
+    def test_process_stage(self):
+        scheduler = StageScheduler()
+        scheduler.add("child", _get_pid, ("value",), process=True)
+        scheduler.add("parent", _get_pid, ("value",))
+        values = scheduler.run({"value": 3})
+        self.assertEqual(values["child"][0], 3)
+        self.assertNotEqual(values["child"][1], os.getpid())
+        self.assertEqual(values["parent"], (3, os.getpid()))
+
+    def test_critical_path(self):
+        scheduler = StageScheduler()
+        scheduler.add("slow", lambda: time.sleep(0.2))
+        scheduler.add("fast", lambda: None)
+        scheduler.add("after_fast", lambda fast: time.sleep(0.05), ("fast",))
+        scheduler.add("end", lambda slow, after_fast: None, ("slow", "after_fast"))
+        scheduler.run()
+        path, seconds = scheduler.get_critical_path()
+        self.assertEqual(path, ["slow", "end"])
+        self.assertGreaterEqual(seconds, 0.2)
+        self.assertGreaterEqual(scheduler.get_duration("after_fast"), 0.05)
+
+    def test_errors_are_raised(self):
+        def fail():
+            sys.exit("ERROR")
+
+        scheduler = StageScheduler()
+        scheduler.add("fail", fail)
+        scheduler.add("never", lambda fail: None, ("fail",))
+        with self.assertRaises(SystemExit):
+            scheduler.run()
+        self.assertNotIn("never", scheduler.times)
+
+    def test_profile(self):
+        def text(n):
+            return "x" * n
+
+        scheduler = StageScheduler()
+        scheduler.add("first", text, ("n",))
+        scheduler.add("second", lambda n: [1] * n, ("n",))
+        scheduler.add("joined", lambda first, second: first.encode() + bytes(second), ("first", "second"))
+        scheduler.add("child", _get_pid, ("value",), process=True)
+        values = scheduler.run({"n": 100, "value": 3}, profile=True, cprofile=True)
+        self.assertEqual(values["joined"], b"x" * 100 + b"\x01" * 100)
+        self.assertEqual(scheduler.stats["first"]["input_size"], 1)
+        self.assertEqual(scheduler.stats["first"]["output_size"], 100)
+        self.assertEqual(scheduler.stats["joined"]["input_size"], 200)
+        for name in ("first", "second", "joined", "child"):
+            self.assertGreaterEqual(scheduler.stats[name]["cpu"], 0)
+            self.assertIsNone(scheduler.stats[name]["peak_memory"])  # Not tracing
+        # One stage at a time
+        spans = sorted(scheduler.times.values())
+        for (begin1, end1), (begin2, end2) in zip(spans, spans[1:]):
+            self.assertLessEqual(end1, begin2)
+        # A profiler for each stage run on a thread
+        self.assertEqual(len(scheduler.profilers), 3)
+
+    @unittest.skipIf(os.name == "nt", "Needs SIGINT delivered to the process")
+    def test_ctrl_c_lets_interruptible_stages_finish(self):
+        scheduler = StageScheduler()
+
+        def search():
+            time.sleep(0.1)  # Let run() reach wait()
+            os.kill(os.getpid(), signal.SIGINT)
+            return scheduler.interrupted.wait(5)
+
+        scheduler.add("search", search, interruptible=True)
+        scheduler.add("after", lambda search: search, ("search",))
+        self.assertTrue(scheduler.run()["after"])
+
+    @unittest.skipIf(os.name == "nt", "Needs SIGINT delivered to the process")
+    def test_ctrl_c_stops_the_build(self):
+        def work():
+            time.sleep(0.1)
+            os.kill(os.getpid(), signal.SIGINT)
+            time.sleep(0.1)
+
+        scheduler = StageScheduler()
+        scheduler.add("work", work)
+        scheduler.add("never", lambda work: None, ("work",))
+        with self.assertRaises(KeyboardInterrupt):
+            scheduler.run()
+        self.assertNotIn("never", scheduler.times)
+
+    def test_data_size(self):
+        self.assertEqual(get_data_size([b"ab", "cde", (1, 2.0), {"k": [True, None]}]), 2 + 3 + 2 + 1)
+        self.assertEqual(get_data_size(object()), 0)
+
+    def test_wrong_graphs(self):
+        scheduler = StageScheduler()
+        scheduler.add("a", lambda b: b, ("b",))
+        with self.assertRaises(ValueError):
+            scheduler.run()  # Nobody produces b
+        scheduler.add("b", lambda a: a, ("a",))
+        with self.assertRaises(ValueError):
+            scheduler.run()  # Cycle
+        with self.assertRaises(ValueError):
+            scheduler.add("c", lambda: None, outputs=("a",))
+        with self.assertRaises(ValueError):
+            scheduler.add("a", lambda: None, outputs=("d",))
+
+
+if __name__ == "__main__":
+    unittest.main()
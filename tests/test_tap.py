@@ -0,0 +1,50 @@
+import sys
+import unittest
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_tap import TapFile, get_tap_block, get_tap_header, read_tap
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+
+class TestTapFile(unittest.TestCase):
+    def test_round_trip_of_example(self):
+        data = (EXAMPLES_DIR / "Rocky_Horror_Show" / "test.tap").read_bytes()
+        blocks = read_tap(data)
+        self.assertEqual([flag for flag, block in blocks], [0, 255, 255, 255])
+        self.assertEqual(get_tap_header(0, "test", 167, 10, 167), data[:21])
+
+        tap = TapFile()
+        tap.add_program("test", blocks[1][1], autostart=10)
+        for _flag, block in blocks[2:]:
+            tap.add_data(block)
+        self.assertEqual(tap.get_bytes(), data)
+
+    def test_block(self):
+        self.assertEqual(get_tap_block([1, 2, 3]), bytes([5, 0, 255, 1, 2, 3, 255 ^ 1 ^ 2 ^ 3]))
+        self.assertEqual(read_tap(get_tap_block(b"", 0x42)), [(0x42, b"")])
+        with self.assertRaises(ValueError):
+            get_tap_block(bytes(0xFFFE))
+
+    def test_name_is_padded_and_cut(self):
+        self.assertEqual(read_tap(get_tap_header(3, "a", 1, 2, 3))[0][1][1:11], b"a         ")
+        self.assertEqual(
+            read_tap(get_tap_header(3, "long_tap_name", 1, 2, 3))[0][1][1:11], b"long_tap_n"
+        )
+
+    def test_broken_files(self):
+        data = bytearray(get_tap_block(b"abc"))
+        with self.assertRaises(ValueError):
+            read_tap(data[:-1])
+        with self.assertRaises(ValueError):
+            read_tap(data + b"\x01")
+        data[3] ^= 1
+        with self.assertRaises(ValueError):
+            read_tap(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+"""
+Tests for the abbreviation search of CydcTextCompressor.
+
+The indexed engine must choose exactly the same tokens as the classic one.
+"""
+
+import gettext
+import os
+import signal
+import sys
+import time
+import unittest
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from cydc_stages import StageScheduler
+from cydc_txt_compress import (
+    CydcTextCompressor,
+    TOKEN_ENGINES,
+    get_texts_drift,
+    get_texts_fingerprint,
+)
+
+
+TEXTS = [
+    "You are in a dark room. There is a door to the north and a door to the south.",
+    "The door to the north is locked. You need a key to open the door.",
+    "You are in the garden. There is a fountain in the middle of the garden.",
+    "aaaaaaaaaaaaaaaaaaaaabababababababab",
+    "",
+    "x",
+    "Estás en una habitación oscura. Hay una puerta al norte y otra al sur.",
+    "-----------------------------------------",
+]
+
+
+def _example_texts(name):
+    from cydc_parser import CydcParser
+    from cydc_preprocessor import CydcPreprocessor
+
+    path = Path(__file__).parent.parent / "examples" / name
+    text, line_map = CydcPreprocessor().preprocess(str(path))
+    parser = CydcParser(strict_colon_mode=False)
+    parser.set_line_map(line_map)
+    parser.build()
+    code = parser.parse(input=text)
+    return [value[1] for value in code if value[0] == "TEXT"]
+
+
+class TestTokenEngines(unittest.TestCase):
+    def _generate(self, engine, strings, max_len, superset_limit=100):
+        compressor = CydcTextCompressor(gettext, superset_limit, engine=engine)
+        strings = list(strings)
+        result = compressor._generate_tokens(strings, max_len)
+        return result, strings
+
+    def _assert_same_tokens(self, strings, max_lengths, superset_limit=100):
+        for max_len in max_lengths:
+            with self.subTest(max_len=max_len, superset_limit=superset_limit):
+                self.assertEqual(
+                    self._generate("indexed", strings, max_len, superset_limit),
+                    self._generate("classic", strings, max_len, superset_limit),
+                )
+
+    def test_same_tokens_as_classic_engine(self):
+        self._assert_same_tokens(TEXTS, (2, 3, 5, 8, 30))
+
+    def test_same_tokens_without_superset_search(self):
+        self._assert_same_tokens(TEXTS, (3, 8), superset_limit=0)
+
+    def test_same_tokens_on_example(self):
+        texts = _example_texts("Delerict/delerict.cyd")
+        self.assertTrue(texts)
+        self._assert_same_tokens(texts, (3, 10))
+
+    def test_compress_gives_same_result(self):
+        results = []
+        for engine in TOKEN_ENGINES:
+            compressor = CydcTextCompressor(gettext, 100, engine=engine)
+            results.append(compressor.compress(list(TEXTS), 3, 6))
+        self.assertEqual(results[0], results[1])
+
+    def test_parallel_sweep_gives_same_result(self):
+        results = []
+        for jobs in (1, 3):
+            compressor = CydcTextCompressor(gettext, 100, jobs=jobs)
+            results.append(compressor.compress(list(TEXTS), 2, 8))
+        self.assertEqual(results[0], results[1])
+
+    def test_sweep_returns_every_length(self):
+        compressor = CydcTextCompressor(gettext, 100, jobs=2)
+        lengths = range(3, 7)
+        found = sorted(r[0] for r in compressor._sweep(TEXTS, lengths, None))
+        self.assertEqual(found, list(lengths))
+
+    def test_no_repeated_text(self):
+        for engine in TOKEN_ENGINES:
+            tokens, _ = self._generate(engine, ["abc", "def"], 5)[0]
+            self.assertEqual(tokens, [])
+
+    def test_count_repeated(self):
+        compressor = CydcTextCompressor(gettext, 100)
+        repeated = compressor._count_repeated(["abcab", "cabx"], 4)
+        self.assertEqual(repeated[2], {"ab": 3, "ca": 2})
+        self.assertEqual(repeated[3], {"cab": 2})
+        self.assertEqual(repeated[4], {})
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            CydcTextCompressor(gettext, 100, engine="suffix")
+
+
+class TestIncrementalTokens(unittest.TestCase):
+    def setUp(self):
+        self.compressor = CydcTextCompressor(gettext, 100)
+        (_text_bytes, _token_bytes, self.tokens) = self.compressor.compress(
+            list(TEXTS), 3, 8
+        )
+        self.savings = self.compressor.get_token_savings(TEXTS, self.tokens)
+
+    def test_drift(self):
+        fingerprint = get_texts_fingerprint(TEXTS)
+        self.assertEqual(get_texts_drift(fingerprint, TEXTS), 0.0)
+        changed = list(TEXTS)
+        changed[0] = changed[0].upper()
+        total = sum(len(t) for t in TEXTS)
+        self.assertAlmostEqual(
+            get_texts_drift(fingerprint, changed), 200.0 * len(TEXTS[0]) / total
+        )
+        self.assertEqual(get_texts_drift(fingerprint, []), 100.0)
+
+    def test_savings(self):
+        self.assertEqual(len(self.savings), len(self.tokens))
+        self.assertEqual(
+            self.compressor.get_token_savings(["abcabcabc", "abcd"], ["abc", "cd"]),
+            [6, -1],
+        )
+
+    def test_unchanged_texts_keep_tokens(self):
+        tokens = self.compressor.update_tokens(
+            TEXTS, self.tokens, self.savings, self.compressor.best_max_length
+        )
+        self.assertEqual(tokens[: len(self.tokens)], self.tokens)
+        self.assertEqual(self.compressor.compress(list(TEXTS), 3, 8, tokens)[2], tokens)
+
+    def test_weak_tokens_are_replaced(self):
+        texts = [t for t in TEXTS if "door" not in t] + ["zzzzzz zzzzzz zzzzzz"]
+        tokens = self.compressor.update_tokens(
+            texts, self.tokens, self.savings, self.compressor.best_max_length
+        )
+        self.assertFalse(any("door" in t for t in tokens))
+        self.assertTrue(any("zzz" in t for t in tokens))
+        self.assertEqual(len(tokens), len(set(tokens)))
+
+
+@unittest.skipIf(os.name == "nt", "Needs SIGINT delivered to the process")
+class TestInterruptedSweep(unittest.TestCase):
+    def test_ctrl_c_keeps_best_tokens_found(self):
+        scheduler = StageScheduler()
+        compressor = CydcTextCompressor(gettext, 100)
+        searched = []
+        generate = compressor._generate_tokens
+
+        def generate_and_interrupt(strings, max_len_token, repeated=None):
+            searched.append(max_len_token)
+            if len(searched) == 2:
+                time.sleep(0.1)  # Let run() reach wait()
+                os.kill(os.getpid(), signal.SIGINT)
+                self.assertTrue(scheduler.interrupted.wait(5))
+            return generate(strings, max_len_token, repeated)
+
+        compressor._generate_tokens = generate_and_interrupt
+        scheduler.add(
+            "texts",
+            lambda: compressor.compress(list(TEXTS), 2, 30, stop=scheduler.interrupted),
+            interruptible=True,
+        )
+        scheduler.add("tokens", lambda texts: texts[2], ("texts",))
+        values = scheduler.run()
+        self.assertEqual(searched, [2, 3])
+        expected = CydcTextCompressor(gettext, 100).compress(list(TEXTS), 2, 3)
+        self.assertEqual(values["texts"], expected)
+        self.assertEqual(values["tokens"], expected[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
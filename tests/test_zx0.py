@@ -0,0 +1,83 @@
+"""
+Tests for the NumPy optimizer of pyZX0.
+
+It must choose exactly the same blocks as the reference optimizer, so the
+compressed data is byte-identical.
+"""
+
+import random
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent / "src" / "cydc" / "cydc"))
+
+from pyZX0 import compress
+from pyZX0.optimize import optimize as optimize_reference
+
+try:
+    from pyZX0 import optimize_numpy
+except ImportError:
+    optimize_numpy = None
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+
+def _compress(optimizer, data, skip=0, backwards=False, quick=False):
+    with patch.object(compress, "optimize", optimizer):
+        return compress.compress_data(bytearray(data), skip, backwards, False, quick)
+
+
+@unittest.skipIf(optimize_numpy is None, "NumPy is not installed")
+class TestOptimizerParity(unittest.TestCase):
+    def _assert_same_output(self, data, **kwargs):
+        self.assertEqual(
+            _compress(optimize_numpy.optimize, data, **kwargs),
+            _compress(optimize_reference, data, **kwargs),
+        )
+
+    def test_compress_data_uses_numpy(self):
+        self.assertTrue(compress.numpyAvailable)
+        self.assertIs(compress.optimize, optimize_numpy.optimize)
+
+    def test_small_inputs(self):
+        rng = random.Random(1)
+        for size in (0, 1, 2, 3, 4, 5, 17, 64):
+            data = bytes(rng.choice(b"ab") for _ in range(size))
+            for skip in (0, 2):
+                with self.subTest(size=size, skip=skip):
+                    if skip < size:
+                        self._assert_same_output(data, skip=skip)
+
+    def test_modes(self):
+        rng = random.Random(2)
+        data = b"abc" * 60 + bytes(rng.randrange(4) for _ in range(200)) + bytes(100)
+        for backwards in (False, True):
+            for quick in (False, True):
+                with self.subTest(backwards=backwards, quick=quick):
+                    self._assert_same_output(data, backwards=backwards, quick=quick)
+
+    def test_random_and_repeated_data(self):
+        rng = random.Random(3)
+        self._assert_same_output(bytes(rng.randrange(256) for _ in range(400)))
+        self._assert_same_output(bytes(600))
+
+    def test_block_pool_is_collected(self):
+        rng = random.Random(4)
+        data = bytes(rng.choice(b"aab\0") for _ in range(1000))
+        with patch.object(optimize_numpy, "POOL_SIZE", 64):
+            self._assert_same_output(data)
+
+    def test_example_images(self):
+        images = sorted(EXAMPLES_DIR.glob("**/*.scr"))
+        self.assertTrue(images)
+        for path in images:
+            with self.subTest(image=path.name):
+                # Top half of the attributes, whole screens are too slow for the reference
+                self._assert_same_output(path.read_bytes()[6144:6528])
+
+
+if __name__ == "__main__":
+    unittest.main()